@@ -0,0 +1,240 @@
+import copy
+import queue
+import random
+import time
+import torch
+import torch.multiprocessing as mp
+from checkpoint import CheckpointManager
+from config import Opponent, load_config
+from evaluator import shutdown_evaluator
+from game import Stockfish, refresh_inference, self_play
+from logger import get_logger, init_logger
+from metrics import collect_metrics, merge_metrics
+from mcts.pool import shutdown_pool
+from model import CheckMatrixModel, train_model
+from position_store import PositionStore, pack_positions
+from replay_buffer import ReplayBuffer
+
+
+
+class ActorLearner:
+    """
+    Self-play in actor processes, training in this process (the learner)
+
+    Every actor plays games with its own copy of the model and sends each finished game
+    through a queue: the states and rewards after every move, the version of the weights
+    that searched the move, the packed positions for the position store and the actor's
+    metrics. The learner adds them to the replay buffer and trains at the cadence of
+    play_game, so the two overlap instead of taking turns.
+
+    Every publish_every training steps the weights are copied to a shared memory model,
+    which the actors load before their next move. A version is the training step the
+    weights were published at, positions searched with weights more than max_staleness
+    steps older than the learner's are dropped.
+    """
+
+    def __init__(
+            self,
+            model: CheckMatrixModel,
+            optimizer: torch.optim.Optimizer,
+            criterion: torch.nn.Module,
+            device: torch.device,
+            replay_buffer: ReplayBuffer,
+            checkpoints: CheckpointManager = None,
+            position_store: PositionStore = None,
+            num_actors: int = None
+        ) -> None:
+        config = load_config().model
+        self.config = config.self_play
+        self.training = config.training
+        self.model = model
+        self.optimizer = optimizer
+        self.criterion = criterion
+        self.device = torch.device(device)
+        self.replay_buffer = replay_buffer
+        self.checkpoints = checkpoints
+        self.position_store = position_store
+        self.num_actors = num_actors or self.config.actors
+
+        self.steps = 0
+        self.published = 0
+        self.untrained = 0  # Positions added since the last training step
+        self.games = 0
+        self.positions = 0
+        self.dropped = 0
+
+        # CUDA tensors can only be shared with spawned processes
+        context = mp.get_context("spawn" if self.device.type == "cuda" else None)
+        self.shared_model = copy.deepcopy(model).cpu().share_memory()
+        self.version = context.Value("q", 0, lock=False)
+        self.lock = context.Lock()  # Held while the shared weights are written or read
+        self.records = context.Queue(self.config.queue_size)
+        self.stop_event = context.Event()
+        self.actors = [
+            context.Process(
+                target=_run_actor,
+                args=(i, self.shared_model, self.version, self.lock, self.records, self.stop_event, self.device, random.getrandbits(64), context.get_start_method() == "spawn"),
+                name=f"checkmatrix-actor-{i}"
+            )
+            for i in range(self.num_actors)
+        ]
+
+
+    def start(self):
+        for actor in self.actors:
+            if actor.pid is None:
+                actor.start()
+        get_logger().debug(f"Started {self.num_actors} self-play actors")
+
+
+    def run(self, games: int = -1):
+        """
+        Learns from the actors' games until the given number of games is played, -1 for no limit
+        """
+        self.start()
+        start_time = time.time()
+        while games == -1 or self.games < games:
+            if len(self.replay_buffer) >= self.training.min_samples and self.untrained >= self.training.train_every:
+                self.train()
+                continue
+
+            try:
+                record = self.records.get(timeout=1)
+            except queue.Empty:
+                self.check_actors()
+                continue
+            self.consume(record)
+
+        duration = time.time() - start_time
+        get_logger().info(
+            f"{self.games} games, {self.positions} positions ({self.dropped} stale) and {self.steps} training steps "
+            f"in {duration:.1f}s, {self.games / duration:.3f} games/s"
+        )
+
+
+    def consume(self, record):
+        """
+        Adds the positions of a finished game to the replay buffer
+        """
+        actor, result, states, rewards, versions, positions, actor_metrics = record
+        merge_metrics(actor_metrics)  # The searches happen in the actors
+        if self.position_store is not None:
+            self.position_store.append(positions)  # Stale positions are still good for offline training
+
+        fresh = versions >= self.steps - self.config.max_staleness
+        self.replay_buffer.add_many(states[fresh], rewards[fresh].tolist())
+
+        count = int(fresh.sum())
+        self.untrained += count
+        self.positions += count
+        self.dropped += len(versions) - count
+        self.games += 1
+        get_logger().info(f"Game {self.games}, Actor: {actor}, Result: {result}, Positions: {len(versions)} ({len(versions) - count} stale)")
+
+
+    def train(self):
+        train_model(self.model, self.replay_buffer, self.optimizer, self.criterion, self.device)
+        self.untrained -= self.training.train_every
+        self.steps += 1
+
+        if self.checkpoints is not None:
+            self.checkpoints.step()
+        if self.steps - self.published >= self.config.publish_every:
+            self.publish()
+
+
+    def publish(self):
+        with self.lock:
+            for target, source in zip(self.shared_model.state_dict().values(), self.model.state_dict().values()):
+                target.copy_(source)
+            self.version.value = self.steps
+        self.published = self.steps
+
+
+    def check_actors(self):
+        for i, actor in enumerate(self.actors):
+            if actor.exitcode is not None:
+                raise RuntimeError(f"Self-play actor {i} exited with code {actor.exitcode}")
+
+
+    def close(self):
+        self.stop_event.set()
+        deadline = time.monotonic() + 30
+        for actor in self.actors:
+            if actor.pid is None:
+                continue
+            # Keep the queue drained, an actor blocked on a full queue never sees the stop event
+            while actor.is_alive() and time.monotonic() < deadline:
+                try:
+                    self.records.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+                actor.join(timeout=0)
+            if actor.is_alive():
+                actor.terminate()
+            actor.join()
+
+        self.records.cancel_join_thread()
+        get_logger().debug("Joined self-play actors")
+
+
+def refresh_weights(model: CheckMatrixModel, shared_model: CheckMatrixModel, version, lock, local_version: int) -> int:
+    """
+    Loads the published weights if they are newer than local_version, returns the version of model
+    """
+    if version.value == local_version:
+        return local_version
+
+    with lock:
+        model.load_state_dict(shared_model.state_dict())
+        return version.value
+
+
+def _run_actor(actor_id: int, shared_model: CheckMatrixModel, version, lock, records, stop_event, device, seed: int, spawned: bool):
+    if spawned:
+        init_logger()  # Forked processes inherit it
+    random.seed(seed)
+    torch.manual_seed(seed)
+
+    config = load_config().model
+    model = copy.deepcopy(shared_model).to(device).eval()  # Not shared, the learner writes the shared one
+    stockfish = Stockfish() if config.opponent in [Opponent.STOCKFISH, Opponent.MIXED] else None
+    local_version = -1
+
+    try:
+        while not stop_event.is_set():
+            boards, states, rewards, versions = [], [], [], []
+            game = self_play(model, device, config.mcts.iterations, config.mcts.workers, config.opponent, stockfish)
+            while True:
+                loaded = refresh_weights(model, shared_model, version, lock, local_version)
+                if loaded != local_version:
+                    refresh_inference()
+                    local_version = loaded
+                try:
+                    board, state, reward = next(game)
+                except StopIteration as stop:
+                    result = stop.value
+                    break
+
+                boards.append(board)
+                states.append(state)
+                rewards.append(reward)
+                versions.append(local_version)
+                if stop_event.is_set():
+                    return
+
+            record = (
+                actor_id, result, torch.cat(states), torch.tensor(rewards, dtype=torch.float32), torch.tensor(versions),
+                pack_positions(boards, rewards, result), collect_metrics()  # The actor's metrics since its last game, None when disabled
+            )
+            while not stop_event.is_set():
+                try:
+                    records.put(record, timeout=1)
+                    break
+                except queue.Full:
+                    continue
+    finally:
+        if stockfish is not None:
+            stockfish.close()
+        shutdown_pool()
+        shutdown_evaluator()
@@ -0,0 +1,241 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import chess
+import torch
+from board import evaluate_board, evaluate_boards, generate_board_states
+from config import Opponent, load_config
+from constants import BENCHMARK_POSITIONS_PATH, CONFIG_PATH_ENV_VAR
+from evaluator import shutdown_evaluator
+from game import select_move, self_play
+from logger import get_logger, init_logger
+from mcts.limits import SearchLimits
+from mcts.pool import shutdown_pool
+from model import create_model
+from reward import calculate_reward
+
+
+
+POSITIONS_VERSION = 1  # benchmarks/positions_v1.epd, results of different versions aren't compared
+RESULTS_VERSION = 1
+
+
+def load_positions(version: int = POSITIONS_VERSION) -> list[tuple[str, chess.Board]]:
+    """
+    The benchmark positions as (id, board), ids are "<phase>/<name>"
+    """
+    positions = []
+    with open(BENCHMARK_POSITIONS_PATH.format(version=version), "r") as f:
+        for line in f:
+            if not line.strip() or line.startswith(";"):
+                continue
+            board = chess.Board()
+            operations = board.set_epd(line)
+            positions.append((operations["id"], board))
+    return positions
+
+
+def time_per_call(function, min_time: float = 0.5) -> float:
+    """
+    Mean seconds per call, calling it until min_time passed (at least twice, the first call is a warm up)
+    """
+    function()
+    calls = 0
+    start_time = time.perf_counter()
+    while calls == 0 or time.perf_counter() - start_time < min_time:
+        function()
+        calls += 1
+    return (time.perf_counter() - start_time) / calls
+
+
+class Benchmarks:
+    """
+    The benchmarks of the engine on the benchmark positions, see run for the results
+
+    Search and self-play use the configured search mode, rollouts and evaluation, with
+    fewer iterations per move so that a run takes minutes. The model has random weights
+    of the configured profile, its values don't change the speed.
+    """
+
+    def __init__(self, device = "cpu", iterations: int = 64, workers: list[int] = None, plies: int = 4, min_time: float = 0.5) -> None:
+        config = load_config().model
+        self.device = torch.device(device)
+        self.iterations = iterations
+        self.workers = workers or [1, 2, 4]
+        self.plies = plies
+        self.min_time = min_time
+        self.positions = load_positions()
+        self.boards = [board for _, board in self.positions]
+
+        torch.manual_seed(0)
+        self.model = create_model(profile=config.profile).to(self.device).eval()
+        self.results = {}
+
+
+    def record(self, name: str, value: float, unit: str, higher_is_better: bool):
+        self.results[name] = {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+        get_logger().info(f"{name}: {value:.4g} {unit}")
+
+
+    def encode(self):
+        seconds = time_per_call(lambda: [generate_board_states(board) for board in self.boards], self.min_time)
+        self.record("encode", seconds / len(self.boards) * 1e6, "us/position", False)
+
+
+    def reward(self):
+        seconds = time_per_call(lambda: [calculate_reward(board) for board in self.boards], self.min_time)
+        self.record("reward", seconds / len(self.boards) * 1e6, "us/position", False)
+
+
+    def evaluate(self):
+        seconds = time_per_call(lambda: [evaluate_board(board, self.model, self.device) for board in self.boards[::5]], self.min_time)
+        self.record("evaluate_latency", seconds / len(self.boards[::5]) * 1e3, "ms/position", False)
+
+        batch_size = load_config().model.mcts.evaluation.max_batch_size
+        batch = (self.boards * (batch_size // len(self.boards) + 1))[:batch_size]
+        seconds = time_per_call(lambda: evaluate_boards(batch, self.model, self.device), self.min_time)
+        self.record("evaluate_throughput", batch_size / seconds, "positions/s", True)
+
+
+    def search(self):
+        phases = {}
+        for position_id, board in self.positions:
+            phases.setdefault(position_id.split("/")[0], board)  # The first position of every phase
+        boards = list(phases.values())
+        for workers in self.workers:
+            try:
+                select_move(self.model, boards[0].copy(), self.device, self.iterations, workers)  # Starts the pool and evaluator
+                nodes = 0
+                start_time = time.perf_counter()
+                for board in boards:
+                    # Every search runs all its iterations, early stops would change the work per run
+                    limits = SearchLimits(self.iterations, 0, early_stop=False)
+                    select_move(self.model, board.copy(), self.device, self.iterations, workers, limits=limits)
+                    nodes += limits.nodes_searched
+                seconds = time.perf_counter() - start_time
+            finally:
+                shutdown_pool()
+                shutdown_evaluator()
+            self.record(f"search_{workers}_workers", nodes / seconds, "nodes/s", True)
+
+
+    def self_play(self):
+        config = load_config().model.mcts
+        try:
+            game = self_play(self.model, self.device, self.iterations, config.workers, Opponent.SELF, None)
+            next(game)  # Starts the pool and evaluator
+            start_time = time.perf_counter()
+            plies = 0
+            for _ in range(self.plies):
+                try:
+                    next(game)
+                except StopIteration:
+                    break
+                plies += 1
+            seconds = time.perf_counter() - start_time
+        finally:
+            shutdown_pool()
+            shutdown_evaluator()
+        self.record("self_play", plies / seconds, "plies/s", True)
+
+
+    def run(self, only: list[str] = None) -> dict:
+        """
+        Runs the benchmarks (or only the named ones), returns the results document
+        """
+        benchmarks = {"encode": self.encode, "reward": self.reward, "evaluate": self.evaluate, "search": self.search, "self_play": self.self_play}
+        for name, benchmark in benchmarks.items():
+            if only is None or name in only:
+                benchmark()
+
+        config = load_config().model
+        return {
+            "results_version": RESULTS_VERSION,
+            "positions_version": POSITIONS_VERSION,
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "machine": {
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "torch": torch.__version__,
+                "threads": torch.get_num_threads(),
+                "device": str(self.device),
+            },
+            "settings": {
+                "profile": config.profile.value,
+                "search_mode": config.mcts.mode.value,
+                "iterations": self.iterations,
+                "self_play_workers": config.mcts.workers,
+            },
+            "results": self.results,
+        }
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.1, only: list[str] = None) -> list[str]:
+    """
+    Returns a line for every result more than threshold (relative) worse than the baseline,
+    and for every baseline result missing from the results (of the only groups if given)
+    """
+    if results["positions_version"] != baseline["positions_version"]:
+        raise ValueError(f"Results are on positions version {results['positions_version']}, the baseline on {baseline['positions_version']}")
+
+    regressions = []
+    for name in baseline["results"]:
+        if name not in results["results"] and (only is None or name.startswith(tuple(only))):
+            regressions.append(f"{name}: missing from the results")
+
+    for name, result in results["results"].items():
+        if name not in baseline["results"]:
+            continue
+        before, after = baseline["results"][name]["value"], result["value"]
+        change = (after - before) / before if before else 0.0
+        if (-change if result["higher_is_better"] else change) > threshold:
+            regressions.append(f"{name}: {before:.4g} -> {after:.4g} {result['unit']} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks CheckMatrix on a fixed set of positions")
+    parser.add_argument("--config", type=str, help="Path to config yaml file", required=False)
+    parser.add_argument("--output", type=str, help="JSON file to write the results to", required=False)
+    parser.add_argument("--compare", type=str, help="Baseline results, regressions make the exit code 1", required=False)
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown counted as a regression")
+    parser.add_argument("--only", type=str, nargs="+", choices=["encode", "reward", "evaluate", "search", "self_play"], required=False)
+    parser.add_argument("--iterations", type=int, default=64, help="MCTS iterations per move")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts of the search benchmark")
+    parser.add_argument("--plies", type=int, default=4, help="Plies of self-play")
+
+    args = parser.parse_args()
+
+
+    if args.config:
+        if not os.path.exists(args.config):
+            raise FileNotFoundError(f"Config file not found: {args.config}")
+
+        os.environ[CONFIG_PATH_ENV_VAR] = args.config
+
+
+    init_logger()
+
+    results = Benchmarks(iterations=args.iterations, workers=args.workers, plies=args.plies).run(args.only)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+        get_logger().info(f"Wrote results to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.only)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,15 +7,99 @@ from constants import PIECE_INDICES
 
 
 
+# Piece types in plane order
+PIECE_TYPES = sorted(chess.PIECE_TYPES, key=lambda piece_type: PIECE_INDICES[chess.piece_symbol(piece_type).upper()])
+
+
 def evaluate_board(board: chess.Board, model: CheckMatrixModel, device):
     """
     Evaluates a board state using the model
     """
     board_states_tensor = generate_board_states(board).to(device)
-    prediction = model(board_states_tensor)
+    with torch.inference_mode():
+        prediction = model(board_states_tensor)
     return prediction.item()
 
 
+def evaluate_boards(boards: list[chess.Board], model: CheckMatrixModel, device) -> list[float]:
+    """
+    Evaluates a batch of board states with a single forward pass
+    """
+    if not boards:
+        return []
+
+    board_states_tensor = encode_boards(boards).to(device)
+    with torch.inference_mode():
+        predictions = model(board_states_tensor)
+    return predictions.view(-1).tolist()
+
+
+def attack_mask(board: chess.Board, color: chess.Color) -> chess.Bitboard:
+    """
+    Returns the bitboard of every square attacked by the given color.
+    Matches board.is_attacked_by(color, square) for every square.
+    """
+    occupied = board.occupied
+    ours = board.occupied_co[color]
+
+    pawns = board.pawns & ours
+    if color == chess.WHITE:
+        attacks = ((pawns & ~chess.BB_FILE_A) << 7 | (pawns & ~chess.BB_FILE_H) << 9) & chess.BB_ALL
+    else:
+        attacks = (pawns & ~chess.BB_FILE_A) >> 9 | (pawns & ~chess.BB_FILE_H) >> 7
+
+    for square in chess.scan_reversed(board.knights & ours):
+        attacks |= chess.BB_KNIGHT_ATTACKS[square]
+    for square in chess.scan_reversed(board.kings & ours):
+        attacks |= chess.BB_KING_ATTACKS[square]
+
+    for square in chess.scan_reversed((board.rooks | board.queens) & ours):
+        attacks |= chess.BB_RANK_ATTACKS[square][chess.BB_RANK_MASKS[square] & occupied]
+        attacks |= chess.BB_FILE_ATTACKS[square][chess.BB_FILE_MASKS[square] & occupied]
+    for square in chess.scan_reversed((board.bishops | board.queens) & ours):
+        attacks |= chess.BB_DIAG_ATTACKS[square][chess.BB_DIAG_MASKS[square] & occupied]
+
+    return attacks
+
+
+def board_masks(board: chess.Board) -> list[chess.Bitboard]:
+    """
+    Returns the 14 bitboards the encoding is built from:
+    6 white piece masks, 6 black piece masks, white attacks, black attacks
+    """
+    return [board.pieces_mask(piece_type, chess.WHITE) for piece_type in PIECE_TYPES] + [
+        board.pieces_mask(piece_type, chess.BLACK) for piece_type in PIECE_TYPES
+    ] + [
+        attack_mask(board, chess.WHITE),
+        attack_mask(board, chess.BLACK),
+    ]
+
+
+def encode_boards(boards: list[chess.Board], out: torch.Tensor = None) -> torch.Tensor:
+    """
+    Encodes a list of boards into a Nx8x8x8 float32 tensor (see generate_board_states)
+
+    The planes are unpacked straight from the board bitboards. If given, out must be a
+    contiguous float32 CPU tensor with at least N rows, and is filled in place.
+    """
+    count = len(boards)
+    if out is None:
+        out = torch.empty((count, 8, 8, 8), dtype=torch.float32)
+    elif not out.is_contiguous() or out.dtype != torch.float32 or out.device.type != "cpu":
+        raise ValueError("out must be a contiguous float32 CPU tensor")
+
+    planes = out[:count].numpy().reshape(count, 8, 64)
+
+    # Little-endian so that byte k, bit j of each mask is square 8 * k + j
+    masks = np.array([board_masks(board) for board in boards], dtype="<u8").reshape(count, 14)
+    bits = np.unpackbits(masks.view(np.uint8), axis=-1, bitorder="little").reshape(count, 14, 64)
+
+    np.subtract(bits[:, 0:6], bits[:, 6:12], out=planes[:, 0:6], dtype=np.float32)
+    planes[:, 6:8] = bits[:, 12:14]
+
+    return out
+
+
 def board_to_tensor(board: chess.Board):
     """
     Converts a chess.Board object to a 6x8x8 tensor
@@ -29,15 +113,7 @@ def board_to_tensor(board: chess.Board):
 
     White pieces are represented by 1, black pieces are represented by -1
     """
-    
-    board_tensor = np.zeros((6, 8, 8), dtype=np.float32)
-    for i in range(64):
-        piece = board.piece_at(i)
-        if piece:
-            color = 1 if piece.color == chess.WHITE else -1
-            board_tensor[PIECE_INDICES[piece.symbol().upper()], i // 8, i % 8] = color
-    
-    return torch.tensor(board_tensor)
+    return encode_boards([board])[0, :6]
 
 
 def generate_board_states(board: chess.Board):
@@ -45,25 +121,4 @@ def generate_board_states(board: chess.Board):
     Generates a 1x8x8x8 tensor representing the board state
     State 1: board, State 2: white attackable squares, State 3: black attackable squares
     """
-    board_tensor = board_to_tensor(board)
-    board_tensor = board_tensor.view(1, 6, 8, 8)
-
-    white_attackable_squares_tensor = np.zeros((1, 8, 8), dtype=np.float32)
-    black_attackable_squares_tensor = np.zeros((1, 8, 8), dtype=np.float32)
-
-    for color in [chess.WHITE, chess.BLACK]:
-        for square in chess.SQUARES:
-            if board.is_attacked_by(color, square):
-                row, col = square // 8, square % 8
-                if color == chess.WHITE:
-                    white_attackable_squares_tensor[0, row, col] = 1.0
-                else:
-                    black_attackable_squares_tensor[0, row, col] = 1.0
-
-    white_attackable_squares_tensor = np.expand_dims(white_attackable_squares_tensor, axis=1)
-    black_attackable_squares_tensor = np.expand_dims(black_attackable_squares_tensor, axis=1)
-
-    board_states_tensor = np.concatenate((board_tensor, white_attackable_squares_tensor, black_attackable_squares_tensor), axis=1)
-    board_states_tensor = torch.tensor(board_states_tensor, dtype=torch.float32)
-
-    return board_states_tensor
+    return encode_boards([board])
@@ -0,0 +1,210 @@
+import glob
+import os
+import threading
+import time
+import torch
+from config import load_config
+from logger import get_logger
+from metrics import get_metrics
+
+
+
+def copy_state(state):
+    """
+    Copies the tensors of a (nested) state dict to the CPU, later updates don't change the copy
+    """
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return {key: copy_state(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(copy_state(value) for value in state)
+    return state
+
+
+def atomic_save(obj, path: str):
+    """
+    Writes to a temporary file first and renames it, path always holds a complete file
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class CheckpointManager:
+    """
+    Saves the model and optimizer from a background thread
+
+    step() is called after every training step. Once interval_steps steps or
+    interval_seconds seconds passed since the last checkpoint (0 disables either), the
+    weights and optimizer state are copied in memory and handed to the writer thread,
+    training goes on while they are written. A snapshot still waiting for the writer is
+    replaced by a newer one.
+
+    path always holds the weights only, so it loads with load_state_dict. The last keep
+    checkpoints are also kept next to it as model.<step>.pth, with the optimizer state.
+    """
+
+    def __init__(self, model: torch.nn.Module, optimizer: torch.optim.Optimizer, path: str = None, interval_steps: int = None, interval_seconds: float = None, keep: int = None) -> None:
+        config = load_config().model
+        self.model = model
+        self.optimizer = optimizer
+        self.path = path or config.path
+        self.interval_steps = config.checkpoint.interval_steps if interval_steps is None else interval_steps
+        self.interval_seconds = config.checkpoint.interval_seconds if interval_seconds is None else interval_seconds
+        self.keep = config.checkpoint.keep if keep is None else keep
+
+        self.steps = 0
+        self.saved_step = 0
+        self.saved_time = time.monotonic()
+        self.writes = 0
+        self.replaced = 0  # Snapshots dropped for a newer one before they were written
+        self.write_seconds = 0.0
+
+        self._condition = threading.Condition()
+        self._pending = None
+        self._writing = False
+        self._closed = False
+        self._thread = None
+
+
+    def step(self) -> bool:
+        """
+        Counts a training step, returns whether a checkpoint was taken
+        """
+        self.steps += 1
+        due_steps = self.interval_steps and self.steps - self.saved_step >= self.interval_steps
+        due_time = self.interval_seconds and time.monotonic() - self.saved_time >= self.interval_seconds
+        if due_steps or due_time:
+            self.save()
+            return True
+        return False
+
+
+    def save(self):
+        """
+        Takes a checkpoint now, it is written in the background
+        """
+        snapshot = {
+            "step": self.steps,
+            "model": copy_state(self.model.state_dict()),
+            "optimizer": copy_state(self.optimizer.state_dict()) if self.optimizer is not None else None,
+        }
+        self.saved_step = self.steps
+        self.saved_time = time.monotonic()
+
+        self._ensure_started()
+        with self._condition:
+            if self._pending is not None:
+                self.replaced += 1
+            self._pending = snapshot
+            self._condition.notify_all()
+
+
+    def flush(self):
+        """
+        Waits until every checkpoint taken so far is on disk
+        """
+        with self._condition:
+            while self._pending is not None or self._writing:
+                self._condition.wait()
+
+
+    def close(self):
+        """
+        Writes a final checkpoint and stops the writer thread
+        """
+        if self._closed:
+            return
+        self.save()
+        self.flush()
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._thread = None
+
+        get_logger().debug(f"Checkpoints: {self.writes} written in {self.write_seconds:.2f}s, {self.replaced} replaced before writing")
+
+
+    def versions(self) -> list[str]:
+        """
+        Paths of the kept checkpoints, oldest first
+        """
+        root, ext = os.path.splitext(self.path)
+        paths = [path for path in glob.glob(f"{glob.escape(root)}.*{ext}") if path[len(root) + 1:-len(ext) or None].isdigit()]
+        return sorted(paths, key=lambda path: int(path[len(root) + 1:-len(ext) or None]))
+
+
+    def restore(self) -> bool:
+        """
+        Loads the newest readable checkpoint with its optimizer state, or the weights at path
+        """
+        for version in reversed(self.versions()):
+            try:
+                checkpoint = torch.load(version)
+            except Exception as e:
+                get_logger().warning(f"Skipping unreadable checkpoint {version}: {e}")
+                continue
+
+            self.model.load_state_dict(checkpoint["model"])
+            if self.optimizer is not None and checkpoint["optimizer"] is not None:
+                self.optimizer.load_state_dict(checkpoint["optimizer"])
+            self.steps = self.saved_step = checkpoint["step"]
+            get_logger().info(f"Restored checkpoint {version}")
+            return True
+
+        if os.path.exists(self.path):
+            self.model.load_state_dict(torch.load(self.path))
+            get_logger().info(f"Restored weights from {self.path}")
+            return True
+        return False
+
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="checkmatrix-checkpoint", daemon=True)
+            self._thread.start()
+
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._pending is None:
+                    return
+                snapshot, self._pending = self._pending, None
+                self._writing = True
+
+            start_time = time.perf_counter()
+            try:
+                self._write(snapshot)
+            except Exception as e:
+                get_logger().error(f"An error occurred while writing a checkpoint: {e}")
+            finally:
+                seconds = time.perf_counter() - start_time
+                get_metrics().histogram("checkmatrix_checkpoint_write_seconds", "Seconds per checkpoint write").observe(seconds)
+                with self._condition:
+                    self._writing = False
+                    self.writes += 1
+                    self.write_seconds += seconds
+                    self._condition.notify_all()
+
+
+    def _write(self, snapshot: dict):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if self.keep > 0:
+            root, ext = os.path.splitext(self.path)
+            atomic_save(snapshot, f"{root}.{snapshot['step']}{ext}")
+            for version in self.versions()[:-self.keep]:
+                os.remove(version)
+
+        atomic_save(snapshot["model"], self.path)
@@ -1,7 +1,7 @@
 import yaml
 import json
 import jsonschema
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 from enum import Enum
 from constants import SCHEMA_BASE_PATH, CONFIG_PATH_ENV_VAR
 import dotenv
@@ -12,9 +12,144 @@ import os
 _cache = None
 
 
+class Evaluation(BaseModel):
+    max_batch_size: int = 64
+    flush_timeout: float = 0.002
+
+class SearchMode(Enum):
+    ROOT = "root"
+    TREE = "tree"
+
+class TranspositionTable(BaseModel):
+    max_size: int = 1048576
+    reuse: bool = True
+
+class MemoryPolicy(Enum):
+    PRUNE = "prune"
+    FREEZE = "freeze"
+
+class Memory(BaseModel):
+    max_nodes: int = 0
+    max_bytes: int = 268435456
+    policy: MemoryPolicy = MemoryPolicy.PRUNE
+    prune_to: float = 0.75
+
+class RolloutPolicy(Enum):
+    RANDOM = "random"
+    CAPTURE = "capture"
+
+class CutoffEvaluation(Enum):
+    VALUE = "value"
+    REWARD = "reward"
+
+class Rollout(BaseModel):
+    policy: RolloutPolicy = RolloutPolicy.RANDOM
+    max_depth: int = 0
+    cutoff: CutoffEvaluation = CutoffEvaluation.VALUE
+    fast_terminal: bool = True
+
+class Limits(BaseModel):
+    move_time: float = 0
+    early_stop: bool = True
+    check_interval: int = 16
+
+class TimeControl(BaseModel):
+    time: float = 0
+    increment: float = 0
+    moves_to_go: int = 0
+    expected_moves: int = 30
+    increment_share: float = 0.8
+    max_share: float = 0.2
+    overhead: float = 0.05
+
 class MCTS(BaseModel):
     iterations: int
     workers: int
+    mode: SearchMode = SearchMode.ROOT
+    virtual_loss: float = 1.0
+    evaluation: Evaluation = Evaluation()
+    transposition_table: TranspositionTable = TranspositionTable()
+    memory: Memory = Memory()
+    rollout: Rollout = Rollout()
+    limits: Limits = Limits()
+    time_control: TimeControl = TimeControl()
+
+    @model_validator(mode="after")
+    def check_limits(self):
+        # Without any the searches of self-play would never stop, only UCI's go infinite stops on command
+        if not self.iterations and not self.limits.move_time and not self.time_control.time:
+            raise ValueError("One of mcts.iterations, mcts.limits.move_time and mcts.time_control.time must be set")
+        return self
+
+class Eviction(Enum):
+    FIFO = "fifo"
+    PRIORITIZED = "prioritized"
+
+class Sampling(Enum):
+    UNIFORM = "uniform"
+    RECENCY = "recency"
+
+class Precision(Enum):
+    FLOAT32 = "float32"
+    BFLOAT16 = "bfloat16"
+    INT8 = "int8"
+
+class ReplayBuffer(BaseModel):
+    capacity: int = 100000
+    eviction: Eviction = Eviction.FIFO
+    sampling: Sampling = Sampling.UNIFORM
+    recency_half_life: int = 10000
+
+class Training(BaseModel):
+    batch_size: int = 256
+    train_every: int = 32
+    batches: int = 4
+    min_samples: int = 1024
+    position_store: str = ""
+    precision: Precision = Precision.FLOAT32
+    replay_buffer: ReplayBuffer = ReplayBuffer()
+
+class Checkpoint(BaseModel):
+    interval_steps: int = 100
+    interval_seconds: float = 600
+    keep: int = 3
+
+class SelfPlay(BaseModel):
+    actors: int = 0
+    concurrent_games: int = 1
+    publish_every: int = 10
+    max_staleness: int = 50
+    queue_size: int = 16
+
+class ModelProfile(Enum):
+    FULL = "full"
+    SMALL = "small"
+    TINY = "tiny"
+
+class Architecture(Enum):
+    TRANSFORMER = "transformer"
+    CNN = "cnn"
+
+class Student(BaseModel):
+    path: str = ""
+    architecture: Architecture = Architecture.CNN
+    profile: ModelProfile = ModelProfile.SMALL
+    root_depth: int = 1
+    steps: int = 2000
+    batch_size: int = 256
+    learning_rate: float = 0.001
+    validation_positions: int = 4096
+
+class CompileMode(Enum):
+    NONE = "none"
+    TRACE = "trace"
+    COMPILE = "compile"
+
+class Inference(BaseModel):
+    compile: CompileMode = CompileMode.NONE
+    threads: int = 0
+    precision: Precision = Precision.FLOAT32
+    validation_positions: int = 128
 
 class Device(Enum):
     CPU = "cpu"
@@ -32,21 +167,66 @@ class Model(BaseModel):
     epochs: int
     device: Device
     learning_rate: float
+    profile: ModelProfile = ModelProfile.FULL
     mcts: MCTS
+    training: Training = Training()
+    checkpoint: Checkpoint = Checkpoint()
+    self_play: SelfPlay = SelfPlay()
+    inference: Inference = Inference()
+    student: Student = Student()
     opponent: Opponent
 
 
+class EngineCache(BaseModel):
+    path: str = ""
+    max_entries: int = 1000000
+    prune_to: float = 0.9
+
 class Stockfish(BaseModel):
     path: str
     depth: int
     nodes: int
     time: float
+    engines: int = 1
+    threads: int = 1
+    hash: int = 16
+    timeout: float = 30
+    health_check_interval: float = 30
+    retries: int = 1
+    cache: EngineCache = EngineCache()
+
+
+class Label(Enum):
+    REWARD = "reward"
+    RESULT = "result"
+
+class Ingest(BaseModel):
+    output: str = ""
+    workers: int = 0
+    chunk_size: int = 4194304
+    label: Label = Label.REWARD
+
+
+class LogLevel(Enum):
+    DEBUG = "debug"
+    INFO = "info"
+    WARNING = "warning"
+    ERROR = "error"
+
+class Metrics(BaseModel):
+    enabled: bool = False
+    interval: float = 10
+    jsonl_path: str = "logs/metrics.jsonl"
+    prometheus_path: str = "logs/metrics.prom"
 
 
 class Config(BaseModel):
     log_path: str
+    log_level: LogLevel = LogLevel.DEBUG
     model: Model
     stockfish: Stockfish
+    ingest: Ingest = Ingest()
+    metrics: Metrics = Metrics()
 
 
 def validate_config(config: dict):
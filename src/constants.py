@@ -5,5 +5,6 @@ PIECE_VALUES = {"P": 1, "N": 3, "B": 3.1, "R": 5, "Q": 9, "K": 0}
 PIECE_INDICES = {"P": 0, "N": 1, "B": 2, "R": 3, "Q": 4, "K": 5}
 
 SCHEMA_BASE_PATH = "schemas/"
+BENCHMARK_POSITIONS_PATH = "benchmarks/positions_v{version}.epd"
 
 CONFIG_PATH_ENV_VAR = "CONFIG_PATH"
@@ -0,0 +1,119 @@
+import argparse
+import os
+import numpy as np
+import torch
+import torch.nn as nn
+from checkpoint import atomic_save
+from config import load_config
+from constants import CONFIG_PATH_ENV_VAR
+from inference import InferenceEngine, compare
+from logger import get_logger, init_logger
+from model import create_model
+from position_store import PositionDataset, PositionStore, encode_records
+
+
+
+def distill(
+        teacher: nn.Module,
+        student: nn.Module,
+        path: str,
+        device,
+        steps: int = None,
+        batch_size: int = None,
+        learning_rate: float = None,
+        validation_positions: int = None
+    ) -> dict:
+    """
+    Trains the student to match the teacher's values of the positions in a position store
+
+    The newest validation_positions positions (at most a fifth of the store) are held out,
+    the student is compared with the teacher on them afterwards, see inference.compare.
+    """
+    config = load_config().model.student
+    steps = steps or config.steps
+    batch_size = batch_size or config.batch_size
+    learning_rate = learning_rate or config.learning_rate
+    validation_positions = config.validation_positions if validation_positions is None else validation_positions
+
+    store = PositionStore(path)
+    count = len(store)
+    held_out = min(validation_positions, count // 5)
+    if count - held_out < 1:
+        raise ValueError(f"No positions to distill from in {path}")
+
+    device = torch.device(device)
+    teacher_engine = InferenceEngine(teacher, device)
+    student = student.to(device).train()
+    optimizer = torch.optim.Adam(student.parameters(), lr=learning_rate)
+    criterion = nn.MSELoss()
+    dataset = PositionDataset(path, batch_size, stop=count - held_out)
+
+    get_logger().info(f"Distilling from {count - held_out} positions, {held_out} held out")
+    step, total_loss = 0, 0.0
+    while step < steps:
+        for states, _ in dataset:
+            targets = teacher_engine.evaluate(states).clone()  # Out of inference mode, the loss keeps it for backward
+            optimizer.zero_grad()
+            loss = criterion(student(states.to(device)), targets)
+            loss.backward()
+            optimizer.step()
+
+            step += 1
+            total_loss += loss.item()
+            if step % 100 == 0:
+                get_logger().debug(f"Distillation step {step}, loss: {total_loss / 100}")
+                total_loss = 0.0
+            if step >= steps:
+                break
+
+    student.eval()
+    validation = np.array(store.records[count - held_out:] if held_out else store.records[:batch_size])
+    report = compare(teacher_engine, InferenceEngine(student, device), encode_records(validation))
+    get_logger().info(f"Distilled in {steps} steps: {report}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distills the model into the smaller student network")
+    parser.add_argument("--config", type=str, help="Path to config yaml file", required=False)
+    parser.add_argument("--positions", type=str, help="Position store, the configured one by default", required=False)
+    parser.add_argument("--output", type=str, help="Student weights, model.student.path by default", required=False)
+    parser.add_argument("--steps", type=int, help="Training steps", required=False)
+
+    args = parser.parse_args()
+
+
+    if args.config:
+        if not os.path.exists(args.config):
+            raise FileNotFoundError(f"Config file not found: {args.config}")
+
+        os.environ[CONFIG_PATH_ENV_VAR] = args.config
+
+
+    init_logger()
+
+    config = load_config().model
+    output = args.output or config.student.path
+    if not output:
+        raise ValueError("No output path, set model.student.path or pass --output")
+    if not os.path.exists(config.path):
+        raise FileNotFoundError(f"Model weights not found: {config.path}")
+
+    device = torch.device("cuda" if torch.cuda.is_available() and config.device.value != "cpu" else "cpu")
+    teacher = create_model(profile=config.profile)
+    teacher.load_state_dict(torch.load(config.path, map_location="cpu"))
+    student = create_model(config.student.architecture, config.student.profile)
+
+    report = distill(teacher, student, args.positions or config.training.position_store, device, args.steps)
+    for name, value in report.items():
+        print(f"{name}: {value:.4g}")
+
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    atomic_save(student.cpu().state_dict(), output)
+    get_logger().info(f"Saved student to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import os
+import sqlite3
+import threading
+import time
+import chess
+import chess.engine
+import chess.polyglot
+from config import load_config
+from logger import get_logger
+
+
+
+def limit_key(limit: chess.engine.Limit) -> str:
+    return f"depth={limit.depth},nodes={limit.nodes},time={limit.time}"
+
+
+def board_key(board: chess.Board) -> int:
+    # SQLite integers are signed 64 bit
+    key = chess.polyglot.zobrist_hash(board)
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+class EngineCache:
+    """
+    Persistent cache of engine evaluations and moves, keyed by Zobrist hash and search limit
+
+    Entries live in an SQLite database in WAL mode, so any number of processes can share
+    one file: each opens its own connection, readers don't block the writer and writers
+    wait for each other. Lookups and stores take many positions at once, one transaction
+    each. Past max_entries the least recently used entries are deleted, down to prune_to
+    of max_entries.
+    """
+
+    PRUNE_CHECK_INTERVAL = 1000  # Stores between size checks
+
+    def __init__(self, path: str = None, max_entries: int = None, prune_to: float = None) -> None:
+        config = load_config().stockfish.cache
+        self.path = path or config.path
+        self.max_entries = config.max_entries if max_entries is None else max_entries
+        self.prune_to = prune_to or config.prune_to
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evicted = 0
+
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self._unchecked = 0
+
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_lock"] = state["_connection"] = state["_pid"] = None
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections can't be shared with forked processes, every process opens its own
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key INTEGER NOT NULL, search_limit TEXT NOT NULL, score REAL, move TEXT, used REAL NOT NULL, "
+                "PRIMARY KEY (key, search_limit)) WITHOUT ROWID"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+
+    def lookup_many(self, boards: list[chess.Board], limit: chess.engine.Limit, column: str = "score") -> list:
+        """
+        Cached scores (or moves, with column="move") of the boards, None where there is none
+        """
+        if column not in ["score", "move"]:
+            raise ValueError(f"Unknown column: {column}")
+
+        keys = [board_key(board) for board in boards]
+        search_limit = limit_key(limit)
+        with self._lock:
+            connection = self._connect()
+            found = {}
+            for start in range(0, len(keys), 500):  # SQLite limits the number of parameters
+                chunk = keys[start:start + 500]
+                rows = connection.execute(
+                    f"SELECT key, {column} FROM entries WHERE search_limit = ? AND {column} IS NOT NULL AND key IN ({','.join('?' * len(chunk))})",
+                    [search_limit, *chunk]
+                ).fetchall()
+                if rows:
+                    connection.execute(
+                        f"UPDATE entries SET used = ? WHERE search_limit = ? AND key IN ({','.join('?' * len(rows))})",
+                        [time.time(), search_limit, *(key for key, _ in rows)]
+                    )
+                found.update(rows)
+
+        values = [found.get(key) for key in keys]
+        hits = sum(value is not None for value in values)
+        self.hits += hits
+        self.misses += len(values) - hits
+        if column == "move":
+            values = [chess.Move.from_uci(value) if value is not None else None for value in values]
+        return values
+
+
+    def store_many(self, boards: list[chess.Board], limit: chess.engine.Limit, scores: list[float] = None, moves: list[chess.Move] = None):
+        """
+        Stores the scores and/or moves of the boards, other columns of existing entries are kept
+        """
+        scores = scores if scores is not None else [None] * len(boards)
+        moves = moves if moves is not None else [None] * len(boards)
+        search_limit = limit_key(limit)
+        now = time.time()
+        rows = [
+            (board_key(board), search_limit, score, move.uci() if move is not None else None, now)
+            for board, score, move in zip(boards, scores, moves)
+        ]
+
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany(
+                    "INSERT INTO entries (key, search_limit, score, move, used) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (key, search_limit) DO UPDATE SET "
+                    "score = coalesce(excluded.score, score), move = coalesce(excluded.move, move), used = excluded.used",
+                    rows
+                )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+            self.stores += len(rows)
+            self._unchecked += len(rows)
+            if self.max_entries and self._unchecked >= self.PRUNE_CHECK_INTERVAL:
+                self._unchecked = 0
+                self._prune(connection)
+
+
+    def _prune(self, connection: sqlite3.Connection):
+        count = connection.execute("SELECT count(*) FROM entries").fetchone()[0]
+        if count <= self.max_entries:
+            return
+
+        excess = count - int(self.max_entries * self.prune_to)
+        connection.execute(
+            "DELETE FROM entries WHERE (key, search_limit) IN (SELECT key, search_limit FROM entries ORDER BY used LIMIT ?)",
+            [excess]
+        )
+        self.evicted += excess
+        get_logger().debug(f"Evicted {excess} engine cache entries")
+
+
+    def get_score(self, board: chess.Board, limit: chess.engine.Limit) -> float:
+        return self.lookup_many([board], limit)[0]
+
+
+    def get_move(self, board: chess.Board, limit: chess.engine.Limit) -> chess.Move:
+        return self.lookup_many([board], limit, column="move")[0]
+
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT count(*) FROM entries").fetchone()[0]
+
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+    def stats(self) -> str:
+        return f"hit rate {self.hit_rate:.3f} ({self.hits} hits, {self.misses} misses), {self.stores} stores, {self.evicted} evicted"
+
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
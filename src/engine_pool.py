@@ -0,0 +1,199 @@
+import asyncio
+import chess
+import chess.engine
+import threading
+from typing import Awaitable, Callable, TypeVar
+from config import load_config
+from logger import get_logger
+
+
+
+T = TypeVar("T")
+
+
+class EnginePool:
+    """
+    Pool of UCI engine processes on python-chess's asyncio engine API
+
+    The event loop runs in a background thread. The synchronous methods can be called from
+    any thread, the async ones from coroutines on the pool's loop. Requests wait in a
+    queue for an idle engine, so up to `engines` positions are searched at once.
+
+    An engine that died, failed or timed out is restarted and the request retried, up to
+    `retries` times. Every health_check_interval seconds idle engines are pinged and
+    restarted if they do not answer.
+    """
+
+    def __init__(
+            self,
+            command: str | list[str] = None,
+            engines: int = None,
+            threads: int = None,
+            hash_size: int = None,
+            limit: chess.engine.Limit = None,
+            timeout: float = None,
+            health_check_interval: float = None,
+            retries: int = None
+        ) -> None:
+        config = load_config().stockfish
+        self.command = command or config.path
+        self.num_engines = engines or config.engines
+        self.options = {"Threads": threads or config.threads, "Hash": hash_size or config.hash}
+        self.limit = limit or chess.engine.Limit(time=config.time, depth=config.depth, nodes=config.nodes)
+        self.timeout = timeout or config.timeout
+        self.health_check_interval = config.health_check_interval if health_check_interval is None else health_check_interval
+        self.retries = config.retries if retries is None else retries
+
+        self.requests = 0
+        self.failures = 0
+        self.restarts = 0
+
+        self._engines: list[chess.engine.UciProtocol] = [None] * self.num_engines
+        self._transports: list[asyncio.SubprocessTransport] = [None] * self.num_engines
+        self._idle: asyncio.Queue = None
+        self._health_task: asyncio.Task = None
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="checkmatrix-engines", daemon=True)
+        self._thread.start()
+        try:
+            self._call(self._start())
+        except Exception:
+            self.close()
+            raise
+
+
+    def _call(self, coroutine: Awaitable[T]) -> T:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+
+    async def _start(self):
+        self._idle = asyncio.Queue()
+        await asyncio.gather(*(self._open(index) for index in range(self.num_engines)))
+        for index in range(self.num_engines):
+            self._idle.put_nowait(index)
+
+        if self.health_check_interval:
+            self._health_task = asyncio.create_task(self._health_check())
+        get_logger().debug(f"Started {self.num_engines} engines: {self.command}")
+
+
+    async def _open(self, index: int):
+        transport, engine = await chess.engine.popen_uci(self.command)
+        options = {name: value for name, value in self.options.items() if name in engine.options}
+        await engine.configure(options)
+        self._transports[index], self._engines[index] = transport, engine
+
+
+    async def _restart(self, index: int):
+        self.restarts += 1
+        get_logger().warning(f"Restarting engine {index}")
+        if self._transports[index] is not None:
+            self._transports[index].close()  # Kills the process if it is still running
+        self._transports[index] = self._engines[index] = None
+        await self._open(index)
+
+
+    async def _request(self, method: Callable[[chess.engine.UciProtocol], Awaitable[T]]) -> T:
+        index = await self._idle.get()
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    engine = self._engines[index]
+                    if engine is None or engine.returncode.done():
+                        await self._restart(index)
+                        engine = self._engines[index]
+
+                    self.requests += 1
+                    return await asyncio.wait_for(method(engine), self.timeout)
+                except (chess.engine.EngineError, chess.engine.EngineTerminatedError, asyncio.TimeoutError) as e:
+                    self.failures += 1
+                    get_logger().warning(f"Engine {index} failed: {e!r}")
+                    if attempt == self.retries:
+                        raise
+                    if self._engines[index] is not None:
+                        await self._restart(index)
+        finally:
+            self._idle.put_nowait(index)
+
+
+    async def _health_check(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            for _ in range(self._idle.qsize()):
+                index = self._idle.get_nowait()
+                try:
+                    engine = self._engines[index]
+                    if engine is None or engine.returncode.done():
+                        await self._restart(index)
+                    else:
+                        await asyncio.wait_for(engine.ping(), self.timeout)
+                except Exception as e:
+                    get_logger().warning(f"Engine {index} failed the health check: {e!r}")
+                    try:
+                        await self._restart(index)
+                    except Exception as e:
+                        get_logger().error(f"Engine {index} could not be restarted: {e!r}")
+                finally:
+                    self._idle.put_nowait(index)
+
+
+    async def play(self, board: chess.Board, limit: chess.engine.Limit = None) -> chess.Move:
+        result = await self._request(lambda engine: engine.play(board, limit or self.limit))
+        return result.move
+
+
+    async def analyse(self, board: chess.Board, limit: chess.engine.Limit = None) -> chess.engine.InfoDict:
+        return await self._request(lambda engine: engine.analyse(board, limit or self.limit))
+
+
+    async def evaluate(self, board: chess.Board, limit: chess.engine.Limit = None) -> float:
+        """
+        Score of the position from white's side in centipawns, mates count as 1000
+        """
+        info = await self.analyse(board, limit)
+        if not info.get("score"):
+            return 0
+        return info["score"].white().score(mate_score=1000)
+
+
+    def get_move(self, board: chess.Board) -> chess.Move:
+        return self._call(self.play(board))
+
+
+    def get_evaluation(self, board: chess.Board) -> float:
+        return self._call(self.evaluate(board))
+
+
+    def evaluate_many(self, boards: list[chess.Board], limit: chess.engine.Limit = None) -> list[float]:
+        """
+        Evaluates the boards on all engines at once, the scores are in the order of the boards
+        """
+        async def evaluate_all():
+            return await asyncio.gather(*(self.evaluate(board, limit) for board in boards))
+        return list(self._call(evaluate_all()))
+
+
+    def stats(self) -> str:
+        return f"{self.requests} requests, {self.failures} failures, {self.restarts} restarts"
+
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+
+        async def quit_all():
+            if self._health_task is not None:
+                self._health_task.cancel()
+            for engine, transport in zip(self._engines, self._transports):
+                try:
+                    if engine is not None and not engine.returncode.done():
+                        await asyncio.wait_for(engine.quit(), self.timeout)
+                except Exception:
+                    transport.close()
+
+        self._call(quit_all())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        get_logger().debug(f"Engines closed: {self.stats()}")
@@ -0,0 +1,230 @@
+import chess
+import queue
+import torch.nn as nn
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from config import load_config
+from inference import InferenceEngine
+from logger import get_logger
+from metrics import SIZE_BUCKETS, get_metrics
+from model import CheckMatrixModel, load_student
+
+
+
+_evaluator = None
+
+
+class BatchEvaluator:
+    """
+    Evaluation service for MCTS leaves
+
+    Boards are submitted from any thread and queued. A background thread gathers
+    pending boards into batches of up to max_batch_size, waiting at most flush_timeout
+    seconds for a batch to fill, and runs one forward pass per batch on an InferenceEngine.
+    Its weights only follow the model when refresh is called.
+
+    Threads that keep submitting (such as the shared tree search's) register with
+    submitter. A batch is flushed without waiting once every registered thread, or the
+    only caller if none are, waits for a result in it, nothing more could come.
+
+    With a student model, boards submitted as leaves are evaluated by the student
+    instead, the rest of their batch still by the model.
+    """
+
+    def __init__(self, model: CheckMatrixModel, device, max_batch_size: int = None, flush_timeout: float = None, student: nn.Module = None) -> None:
+        self.config = load_config().model.mcts.evaluation
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size or self.config.max_batch_size
+        self.flush_timeout = self.config.flush_timeout if flush_timeout is None else flush_timeout
+        self.engine = InferenceEngine(model, device)
+        self.leaf_engine = InferenceEngine(student, device) if student is not None else None
+
+        self.positions = 0
+        self.leaf_positions = 0  # Evaluated by the student
+        self.batches = 0
+        self._init_worker()
+
+
+    def _init_worker(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._changed = threading.Condition()  # Notified on submits and on changes of the submitters
+        self._submitters = 0
+        self._waiting = set()  # Threads waiting for their results
+
+
+    def __getstate__(self):
+        # The queue and worker thread stay behind, they are restarted lazily on the other side
+        state = self.__dict__.copy()
+        for key in ["_queue", "_lock", "_thread", "_changed", "_submitters", "_waiting"]:
+            del state[key]
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_worker()
+
+
+    def submit(self, board: chess.Board, leaf: bool = False) -> Future:
+        future = Future()
+        self._ensure_started()
+        with self._changed:
+            self._queue.put((board, leaf and self.leaf_engine is not None, future, threading.get_ident()))
+            self._changed.notify()
+        return future
+
+
+    def evaluate(self, board: chess.Board, leaf: bool = False) -> float:
+        return self._results([self.submit(board, leaf)])[0]
+
+
+    def evaluate_many(self, boards: list[chess.Board], leaf: bool = False) -> list[float]:
+        return self._results([self.submit(board, leaf) for board in boards])
+
+
+    @contextmanager
+    def submitter(self):
+        """
+        Registers the calling thread as one that keeps submitting, batches wait for its boards
+        """
+        with self._changed:
+            self._submitters += 1
+        try:
+            yield
+        finally:
+            with self._changed:
+                self._submitters -= 1
+                self._changed.notify()
+
+
+    def _results(self, futures: list[Future]) -> list[float]:
+        thread = threading.get_ident()
+        with self._changed:
+            self._waiting.add(thread)
+            self._changed.notify()
+        try:
+            return [future.result() for future in futures]
+        finally:
+            with self._changed:
+                self._waiting.discard(thread)
+
+
+    def refresh(self):
+        """
+        Loads the current weights of the model, call after training it
+        """
+        self.engine.refresh()
+
+
+    def close(self):
+        with self._lock:
+            if self._thread is None:
+                return
+            with self._changed:
+                self._queue.put(None)
+                self._changed.notify()
+            self._thread.join()
+            self._thread = None
+
+        get_logger().debug(f"Evaluator closed after {self.positions} positions in {self.batches} batches")
+
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="checkmatrix-evaluator", daemon=True)
+                self._thread.start()
+
+
+    def _next_batch(self):
+        request = self._queue.get()
+        if request is None:
+            return None
+
+        batch = [request]
+        threads = {request[3]}
+        deadline = time.monotonic() + self.flush_timeout
+        while len(batch) < self.max_batch_size:
+            with self._changed:
+                while self._queue.empty():
+                    # A thread waiting with a board in the batch has submitted everything it will
+                    if len(self._waiting & threads) >= max(self._submitters, 1):
+                        return batch
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        return batch
+                    self._changed.wait(timeout)
+                request = self._queue.get_nowait()
+
+            if request is None:
+                self._queue.put(None)  # Finish this batch, stop on the next one
+                break
+            batch.append(request)
+            threads.add(request[3])
+
+        return batch
+
+
+    def _run(self):
+        metrics = get_metrics()
+        batch_sizes = metrics.histogram("checkmatrix_evaluation_batch_size", "Positions per evaluation batch", SIZE_BUCKETS)
+        latency = metrics.histogram("checkmatrix_evaluation_seconds", "Seconds per forward pass of a batch")
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            for leaf, engine in [(False, self.engine), (True, self.leaf_engine)]:
+                requests = [(board, future) for board, is_leaf, future, _ in batch if is_leaf == leaf]
+                if not requests:
+                    continue
+                try:
+                    start_time = time.perf_counter() if metrics.enabled else 0
+                    values = engine.evaluate_boards([board for board, _ in requests])
+                    if metrics.enabled:
+                        latency.observe(time.perf_counter() - start_time)
+                        batch_sizes.observe(len(requests))
+                except Exception as e:
+                    get_logger().error(f"An error occurred during batch evaluation: {e}")
+                    for _, future in requests:
+                        future.set_exception(e)
+                    continue
+
+                self.positions += len(requests)
+                self.leaf_positions += len(requests) if leaf else 0
+                for (_, future), value in zip(requests, values):
+                    future.set_result(value)
+            self.batches += 1
+
+
+def get_evaluator(model: CheckMatrixModel, device) -> BatchEvaluator:
+    """
+    Returns the evaluator of the main process, it is started on first use and reused across moves
+    """
+    global _evaluator
+    if _evaluator is not None and (_evaluator.model is not model or _evaluator.device != device):
+        shutdown_evaluator()
+
+    if _evaluator is None:
+        _evaluator = BatchEvaluator(model, device, student=load_student(device))
+    return _evaluator
+
+
+def refresh_evaluator():
+    if _evaluator is not None:
+        _evaluator.refresh()
+
+
+def shutdown_evaluator():
+    global _evaluator
+    if _evaluator is not None:
+        _evaluator.close()
+        _evaluator = None
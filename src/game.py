@@ -1,45 +1,111 @@
 import chess
-import chess.engine
+import logging
 import random
+import time
 import torch.nn as nn
 import torch.optim as optim
 from logger import get_logger
-from mcts.node import MCTSNode
 from mcts.MCTS import MCTS
+from mcts.limits import Clock, SearchLimits
+from mcts.pool import get_pool, refresh_pool
+from mcts.shared_tree import shared_tree_search
+from mcts.search_tree import SearchTree
+from evaluator import get_evaluator, refresh_evaluator
 from board import generate_board_states
 from reward import calculate_reward
 from model import CheckMatrixModel, train_model
-from config import Opponent, Device, load_config
+from replay_buffer import ReplayBuffer
+from checkpoint import CheckpointManager
+from engine_pool import EnginePool
+from engine_cache import EngineCache
+from position_store import PositionStore
+from metrics import get_metrics
+from config import Opponent, Device, SearchMode, load_config
 
 
 
 class Stockfish:
+    """
+    Stockfish opponent and evaluator, requests are spread over a pool of engine processes
+    and the results kept in the persistent engine cache, if it is enabled
+    """
+
     def __init__(self, path: str = "") -> None:
         self.config = load_config().stockfish
-        self.engine = chess.engine.SimpleEngine.popen_uci(self.config.path or path)
-        self.limit = chess.engine.Limit(time=self.config.time, depth=self.config.depth, nodes=self.config.nodes)
+        self.pool = EnginePool(self.config.path or path)
+        self.limit = self.pool.limit
+        self.cache = EngineCache() if self.config.cache.path else None
 
 
     def get_move(self, board):
-        result = self.engine.play(board, self.limit)
-        return result.move
+        move = self.cache.get_move(board, self.limit) if self.cache is not None else None
+        if move is None:
+            move = self.pool.get_move(board)
+            if self.cache is not None:
+                self.cache.store_many([board], self.limit, moves=[move])
+        return move
 
     def get_evaluation(self, board):
-        with self.engine.analysis(board, self.limit) as analysis:
-            for info in analysis:
-                if not info.get("score"):
-                    continue
-                
-                score = info["score"].white().score(mate_score=1000)
-                return score
-        
-        return 0
-
-
-def select_move(model: CheckMatrixModel, board: chess.Board, device: Device, mcts_iterations=300, num_workers=6):
-    root = MCTSNode(board, model, device)
-    MCTS(root, iterations=mcts_iterations, num_workers=num_workers)
-    best_move = max(root.children, key=lambda child: child.visits).board.peek()  # Select move with the highest visits
+        return self.evaluate_many([board])[0]
+
+    def evaluate_many(self, boards):
+        if self.cache is None:
+            return self.pool.evaluate_many(boards)
+
+        scores = self.cache.lookup_many(boards, self.limit)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            evaluated = self.pool.evaluate_many([boards[i] for i in missing])
+            self.cache.store_many([boards[i] for i in missing], self.limit, scores=evaluated)
+            for i, score in zip(missing, evaluated):
+                scores[i] = score
+        return scores
+
+    def close(self):
+        self.pool.close()
+        if self.cache is not None:
+            get_logger().debug(f"Stockfish cache: {self.cache.stats()}")
+            self.cache.close()
+
+
+def select_move(
+        model: CheckMatrixModel,
+        board: chess.Board,
+        device: Device,
+        mcts_iterations=300,
+        num_workers=6,
+        tree: SearchTree = None,
+        search_mode: SearchMode = None,
+        limits: SearchLimits = None
+    ):
+    """
+    Searches the board and returns the most visited move, see SearchLimits for when the
+    search stops (mcts_iterations iterations, limited by the configured move time, by default)
+    """
+    config = load_config().model.mcts
+    limits = limits or SearchLimits(mcts_iterations)
+    tree = tree or SearchTree()  # Pass the game's tree to reuse it between moves
+    root = tree.get_root(board, get_evaluator(model, device))
+    root.expand()  # Every root child gets searched, evaluate them in one batch
+
+    metrics = get_metrics()
+    start_time = time.perf_counter()
+    match search_mode or config.mode:
+        case SearchMode.ROOT:
+            MCTS(root, limits.nodes, get_pool(model, device, num_workers), limits)
+        case SearchMode.TREE:
+            shared_tree_search(root, limits.nodes, num_workers, config.virtual_loss, limits)
+
+    seconds = time.perf_counter() - start_time
+    get_logger().debug("Search stopped (%s) after %d iterations in %.3fs", limits.reason, limits.nodes_searched, seconds)
+    if metrics.enabled:
+        metrics.counter("checkmatrix_search_nodes_total", "MCTS iterations").inc(limits.nodes_searched)
+        metrics.gauge("checkmatrix_search_nodes_per_second", "MCTS iterations per second of the last search").set(limits.nodes_searched / seconds)
+        metrics.histogram("checkmatrix_search_seconds", "Seconds per search").observe(seconds)
+        metrics.gauge("checkmatrix_transposition_table_hit_rate", "Share of transposition table lookups that hit").set(tree.transposition_table.hit_rate)
+    if get_logger().isEnabledFor(logging.DEBUG):
+        get_logger().debug(f"Search tree: {root.tree.stats()}")
+    best_move = max(root.children, key=lambda child: child.visits).move  # Select move with the highest visits
     return best_move
 
 
@@ -54,20 +120,23 @@ def make_move(
         mcts_iterations: int,
         num_workers: int,
         opponent = Opponent.SELF,
-        stockfish: Stockfish = None
+        stockfish: Stockfish = None,
+        tree: SearchTree = None,
+        search_mode: SearchMode = None,
+        limits: SearchLimits = None
     ):
     move = None
 
     match opponent:
         case Opponent.SELF:
-            move = select_move(model, board, device, mcts_iterations, num_workers)
+            move = select_move(model, board, device, mcts_iterations, num_workers, tree, search_mode, limits)
         case Opponent.STOCKFISH:
             move = stockfish.get_move(board)
         case Opponent.USER:
             move = input("Enter move: ")
         case Opponent.MIXED:
             if random.random() < 0.5:
-                move = select_move(model, board, device, mcts_iterations, num_workers)
+                move = select_move(model, board, device, mcts_iterations, num_workers, tree, search_mode, limits)
             else:
                 move = stockfish.get_move(board)
 
@@ -78,40 +147,102 @@ def make_move(
         except (chess.InvalidMoveError, ValueError) as e:
             get_logger().error(f"Invalid move: {e}")
             print("Invalid move, try again")
-            return make_move(model, board, device, mcts_iterations, num_workers, opponent, stockfish)
+            return make_move(model, board, device, mcts_iterations, num_workers, opponent, stockfish, tree, search_mode, limits)
 
     return move
 
 
-def play_game(
+def self_play(
         model: CheckMatrixModel,
-        optimizer: optim.Optimizer,
-        criterion: nn.Module,
         device: Device,
         mcts_iterations: int,
         num_workers: int,
         opponent = Opponent.SELF,
-        stockfish: Stockfish = None
+        stockfish: Stockfish = None,
+        search_mode: SearchMode = None
     ):
+    """
+    Plays one game, yields the board (without its move stack), the board state and the
+    reward after every move.
+    The game result is the return value of the generator.
+
+    With a configured time control, both sides play on a clock and every search gets the
+    time allocated from it, a side out of time loses.
+    """
     board = chess.Board()
     is_ai_turn = random.choice([True, False])  # Randomize who starts
     board.turn = chess.WHITE if is_ai_turn else chess.BLACK
+    tree = SearchTree()
+    clock = Clock() if load_config().model.mcts.time_control.time > 0 else None
 
     while not board.is_game_over(claim_draw=True):
-        if board.turn == chess.WHITE:
-            move = select_move(model, board, device, mcts_iterations, num_workers)
+        turn = board.turn
+        limits = clock.limits(turn, mcts_iterations) if clock is not None else None
+        start_time = time.monotonic()
+        if turn == chess.WHITE:
+            move = select_move(model, board, device, mcts_iterations, num_workers, tree, search_mode, limits)
         else:
-            move = make_move(model, board, device, mcts_iterations, num_workers, opponent, stockfish)
+            move = make_move(model, board, device, mcts_iterations, num_workers, opponent, stockfish, tree, search_mode, limits)
+
+        if clock is not None:
+            clock.punch(turn, time.monotonic() - start_time)
+            if clock.flagged(turn):
+                get_logger().info(f"{'White' if turn == chess.WHITE else 'Black'} lost on time")
+                return "0-1" if turn == chess.WHITE else "1-0"
 
         get_logger().debug(f"{'White' if board.turn == chess.WHITE else 'Black'} move: {move}")
 
         board.push(move)
-        game_state = generate_board_states(board)
-        turn_data = [(game_state, calculate_reward(board))]
-        print(board)
+        if opponent == Opponent.USER:
+            print(board)  # The user plays on it, such games never run concurrently
         get_logger().debug(f"Board: {board.fen()}")
 
-        train_model(model, turn_data, optimizer, criterion, device)
+        yield board.copy(stack=False), generate_board_states(board), calculate_reward(board)
+
+    get_logger().debug(f"Reused {sum(tree.reused_visits)} visits over {len(tree.reused_visits)} searches")
 
-    result = board.result(claim_draw=True)
-    return result
+    return board.result(claim_draw=True)
+
+
+def refresh_inference():
+    """
+    Loads the trained weights into the inference copies of this process's evaluator and MCTS pool
+    """
+    refresh_evaluator()
+    refresh_pool()
+
+
+def play_game(
+        model: CheckMatrixModel,
+        optimizer: optim.Optimizer,
+        criterion: nn.Module,
+        device: Device,
+        mcts_iterations: int,
+        num_workers: int,
+        opponent = Opponent.SELF,
+        stockfish: Stockfish = None,
+        replay_buffer: ReplayBuffer = None,
+        checkpoints: CheckpointManager = None,
+        position_store: PositionStore = None
+    ):
+    config = load_config().model.training
+    replay_buffer = replay_buffer if replay_buffer is not None else ReplayBuffer()
+    game = self_play(model, device, mcts_iterations, num_workers, opponent, stockfish)
+    boards, rewards = [], []
+
+    while True:
+        try:
+            board, game_state, reward = next(game)
+        except StopIteration as stop:
+            if position_store is not None:
+                position_store.append_game(boards, rewards, stop.value)
+            return stop.value  # The result
+
+        boards.append(board)
+        rewards.append(reward)
+        replay_buffer.add(game_state, reward)
+        if len(replay_buffer) >= config.min_samples and replay_buffer.added % config.train_every == 0:
+            train_model(model, replay_buffer, optimizer, criterion, device)
+            refresh_inference()
+            if checkpoints is not None:
+                checkpoints.step()
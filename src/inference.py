@@ -0,0 +1,206 @@
+import copy
+import random
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+import chess
+import numpy as np
+import torch
+import torch.nn as nn
+from board import encode_boards
+from config import CompileMode, Precision, load_config
+from logger import get_logger
+from model import CheckMatrixModel
+
+
+
+_fastpath_lock = threading.Lock()
+_fastpath_state = [0, True]  # Passes running without the fast path, the switch before the first
+
+
+class InferenceEngine:
+    """
+    Evaluates positions with a frozen copy of a model
+
+    The copy is in eval mode (no dropout), has no gradients and runs under inference
+    mode, so training the source model doesn't change its values until refresh is called.
+    Optionally the copy is traced to TorchScript or compiled with torch.compile, both
+    keep using the copy's parameters, which refresh updates in place.
+
+    With bfloat16 precision the forward pass runs under autocast. With int8 the Linear
+    layers of the copy are dynamically quantized (CPU only), refresh quantizes the new
+    weights again. The transformer fast path reads Linear.weight as a tensor, quantized
+    Linears have a weight() method, so int8 passes run with it disabled.
+    """
+
+    def __init__(self, model: CheckMatrixModel, device, compile_mode: CompileMode = None, threads: int = None, precision: Precision = None) -> None:
+        config = load_config().model.inference
+        self.source = model
+        self.device = torch.device(device)
+        self.compile_mode = compile_mode or config.compile
+        self.threads = config.threads if threads is None else threads
+        self.precision = precision or config.precision
+        self.version = 0  # Refreshes so far
+
+        if self.threads:
+            torch.set_num_threads(self.threads)  # Intra-op threads of this process
+        if self.precision == Precision.INT8 and self.device.type != "cpu":
+            get_logger().warning(f"int8 quantization is CPU only, evaluating in float32 on {self.device}")
+            self.precision = Precision.FLOAT32
+
+        self.model = self._prepare(model)
+        self.forward = self._build()
+        self._lock = threading.Lock()
+
+
+    def _prepare(self, model: CheckMatrixModel) -> nn.Module:
+        model = copy.deepcopy(model).to(self.device).eval().requires_grad_(False)
+        if self.precision == Precision.INT8:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")  # Deprecation notice, torchao is its successor
+                model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+        return model
+
+
+    def _build(self):
+        if self.compile_mode == CompileMode.TRACE:
+            example = torch.zeros(2, 8, 8, 8, device=self.device)
+            with warnings.catch_warnings(), fastpath_disabled(self.precision == Precision.INT8):
+                warnings.simplefilter("ignore")  # Deprecation notice
+                return torch.jit.trace(self.model, example, check_trace=False)
+        if self.compile_mode == CompileMode.COMPILE:
+            return torch.compile(self.model, dynamic=True)  # Compiled on the first call
+        return self.model
+
+
+    def __getstate__(self):
+        # Traced and compiled graphs are rebuilt on the other side
+        state = self.__dict__.copy()
+        del state["forward"], state["_lock"]
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.forward = self._build()
+        self._lock = threading.Lock()
+
+
+    def evaluate(self, states: torch.Tensor) -> torch.Tensor:
+        """
+        Values of a Nx8x8x8 batch of board states, as float32
+        """
+        with self._lock, torch.inference_mode(), torch.autocast(self.device.type, torch.bfloat16, enabled=self.precision == Precision.BFLOAT16), fastpath_disabled(self.precision == Precision.INT8):
+            return self.forward(states.to(self.device)).float()
+
+
+    def evaluate_boards(self, boards: list[chess.Board]) -> list[float]:
+        if not boards:
+            return []
+        return self.evaluate(encode_boards(boards)).view(-1).tolist()
+
+
+    def refresh(self, model: CheckMatrixModel = None):
+        """
+        Copies the weights of the source model (or the given one) into the frozen copy, call after training
+        """
+        model = model or self.source
+        with self._lock, torch.no_grad():
+            if self.precision == Precision.INT8:
+                self.model = self._prepare(model)
+                self.forward = self._build()
+            else:
+                for target, source in zip(self.model.state_dict().values(), model.state_dict().values()):
+                    target.copy_(source)
+        self.version += 1
+        get_logger().debug(f"Inference weights refreshed ({self.version})")
+
+
+@contextmanager
+def fastpath_disabled(disabled: bool = True):
+    """
+    Runs without the fast path of the transformer layers, the switch is global and restored
+    once no other thread runs without it
+    """
+    if not disabled:
+        yield
+        return
+
+    with _fastpath_lock:
+        if _fastpath_state[0] == 0:
+            _fastpath_state[1] = torch.backends.mha.get_fastpath_enabled()
+            torch.backends.mha.set_fastpath_enabled(False)
+        _fastpath_state[0] += 1
+    try:
+        yield
+    finally:
+        with _fastpath_lock:
+            _fastpath_state[0] -= 1
+            if _fastpath_state[0] == 0:
+                torch.backends.mha.set_fastpath_enabled(_fastpath_state[1])
+
+
+def fixed_positions(count: int = 256, seed: int = 0) -> list[chess.Board]:
+    """
+    The same positions on every call: the positions of random games played with the seed
+    """
+    rng = random.Random(seed)
+    boards = []
+    board = chess.Board()
+    while len(boards) < count:
+        if board.is_game_over() or board.ply() >= 80:
+            board = chess.Board()
+        board.push(rng.choice(sorted(board.legal_moves, key=chess.Move.uci)))
+        boards.append(board.copy(stack=False))
+    return boards
+
+
+def positions_per_second(engine: InferenceEngine, states: torch.Tensor, repeats: int = 3) -> float:
+    engine.evaluate(states)  # Warm up
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        engine.evaluate(states)
+    return len(states) * repeats / (time.perf_counter() - start_time)
+
+
+def compare(reference: InferenceEngine, engine: InferenceEngine, states: torch.Tensor, batch_size: int = None) -> dict:
+    """
+    How far the engine's values are from the reference's on the states, and the speed of
+    both in batches of batch_size (the evaluator's batch size by default)
+    """
+    batch_size = batch_size or load_config().model.mcts.evaluation.max_batch_size
+    expected = reference.evaluate(states).view(-1).numpy()
+    values = engine.evaluate(states).view(-1).numpy()
+    errors = np.abs(values - expected)
+
+    reference_speed = positions_per_second(reference, states[:batch_size])
+    speed = positions_per_second(engine, states[:batch_size])
+    return {
+        "positions": len(states),
+        "mae": float(errors.mean()),
+        "max_error": float(errors.max()),
+        "correlation": float(np.corrcoef(values, expected)[0, 1]) if values.std() > 0 and expected.std() > 0 else 0.0,
+        "sign_agreement": float((np.sign(values) == np.sign(expected)).mean()),  # Which side is better
+        "reference_positions_per_second": reference_speed,
+        "positions_per_second": speed,
+        "speedup": speed / reference_speed,
+    }
+
+
+def validate_precision(model: CheckMatrixModel, device, precision: Precision = None, positions: int = None) -> dict:
+    """
+    Compares evaluation at the configured precision with float32 on fixed positions, see compare
+    """
+    config = load_config().model.inference
+    precision = precision or config.precision
+    positions = positions or config.validation_positions
+
+    states = encode_boards(fixed_positions(positions))
+    reference = InferenceEngine(model, device, CompileMode.NONE, precision=Precision.FLOAT32)
+    report = compare(reference, InferenceEngine(model, device, precision=precision), states)
+    get_logger().info(
+        f"{precision.value} evaluation against float32 on {positions} positions: mean drift {report['mae']:.5f}, "
+        f"max drift {report['max_error']:.5f}, {report['positions_per_second']:.0f} positions/s ({report['speedup']:.2f}x)"
+    )
+    return report
@@ -0,0 +1,261 @@
+import argparse
+import io
+import json
+import multiprocessing as mp
+import os
+import time
+import chess
+import chess.pgn
+import numpy as np
+from config import Label, load_config
+from constants import CONFIG_PATH_ENV_VAR
+from logger import get_logger, init_logger
+from position_store import RESULT_UNKNOWN, RESULTS, RECORD, PositionStore, pack_positions
+from reward import calculate_reward
+
+
+
+def detect_format(path: str) -> str:
+    return "epd" if os.path.splitext(path)[1].lower() in [".epd", ".fen"] else "pgn"
+
+
+def chunk_ranges(path: str, chunk_size: int, start: int = 0, file_format: str = "pgn"):
+    """
+    Splits the file into byte ranges of about chunk_size, yields (start, end)
+
+    Ranges end on a line break, and for PGN files right before the tags of the next game (a
+    tag line after a blank line, movetext lines can start with "[" in comments), so every
+    range can be parsed on its own. Only the lines around the boundaries are read.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        while start < size:
+            f.seek(start + chunk_size)
+            f.readline()  # The rest of the line the seek landed in
+            end = f.tell()
+            if file_format == "pgn":
+                previous_blank = False  # The line the seek landed in is unknown, a game can't start after it
+                while True:
+                    line = f.readline()
+                    if not line or line.startswith(b"[") and previous_blank:
+                        break
+                    end = f.tell()
+                    previous_blank = not line.strip()
+            end = min(end, size)
+            yield start, end
+            start = end
+
+
+def read_range(path: str, start: int, end: int) -> io.StringIO:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return io.StringIO(f.read(end - start).decode("utf-8", errors="replace"))
+
+
+def label_reward(board: chess.Board, result: str, label: Label) -> float:
+    if label == Label.RESULT:
+        return RESULTS[result]
+    return calculate_reward(board)
+
+
+def ingest_pgn(text: io.StringIO, label: Label) -> tuple[np.ndarray, int]:
+    """
+    Replays the games in the text, returns the records of the positions after every move and the number of games
+    """
+    records, games = [], 0
+    while True:
+        game = chess.pgn.read_game(text)
+        if game is None:
+            break
+        result = game.headers.get("Result", "*")
+        if label == Label.RESULT and result not in RESULTS:
+            continue  # Nothing to learn from an unfinished game
+
+        board = game.board()
+        boards, rewards = [], []
+        for move in game.mainline_moves():
+            board.push(move)
+            boards.append(board.copy(stack=False))
+            rewards.append(label_reward(board, result, label))
+        records.append(pack_positions(boards, rewards, result))
+        games += 1
+
+    return np.concatenate(records) if records else np.zeros(0, dtype=RECORD), games
+
+
+def ingest_epd(text: io.StringIO, label: Label) -> tuple[np.ndarray, int]:
+    """
+    Reads one position per line, the result is taken from the c9 opcode where there is one
+    """
+    boards, rewards, results = [], [], []
+    for line in text:
+        line = line.strip()
+        if not line:
+            continue
+        board = chess.Board()
+        try:
+            operations = board.set_epd(line)
+        except ValueError:
+            get_logger().warning(f"Skipped invalid EPD: {line}")
+            continue
+
+        result = operations.get("c9", "*")
+        if label == Label.RESULT and result not in RESULTS:
+            continue
+        boards.append(board)
+        rewards.append(label_reward(board, result, label))
+        results.append(RESULTS.get(result, RESULT_UNKNOWN))
+
+    records = pack_positions(boards, rewards)
+    records["result"] = results
+    return records, len(boards)
+
+
+def _ingest_range(task: tuple[str, int, int, str, Label]) -> tuple[int, np.ndarray, int]:
+    path, start, end, file_format, label = task
+    text = read_range(path, start, end)
+    records, games = ingest_pgn(text, label) if file_format == "pgn" else ingest_epd(text, label)
+    return end, records, games
+
+
+class Ingestion:
+    """
+    Turns a PGN or EPD file into training positions in a position store
+
+    The file is split into byte ranges (see chunk_ranges) that a pool of processes parse
+    and label, the records are appended in file order. After every range the progress is
+    written to a state file next to the store, keyed by input file. A run that was stopped
+    resumes from there and drops the records of the range it was appending, if any. Records
+    other writers appended since are never dropped, resuming is refused then.
+    """
+
+    def __init__(self, path: str, output: str = None, workers: int = None, chunk_size: int = None, label: Label = None, file_format: str = None) -> None:
+        config = load_config()
+        output = output or config.ingest.output or config.model.training.position_store
+        if not output:
+            raise ValueError("No position store to ingest into, set ingest.output or model.training.position_store")
+
+        self.path = path
+        self.store = PositionStore(output)
+        self.workers = workers or config.ingest.workers or os.cpu_count()
+        self.chunk_size = chunk_size or config.ingest.chunk_size
+        self.label = label or config.ingest.label
+        self.file_format = file_format or detect_format(path)
+        self.state_path = self.store.path + ".ingest.json"
+
+        self.offset = 0
+        self.positions = 0
+        self.games = 0
+
+
+    def read_states(self) -> dict:
+        """
+        The saved states of every input file ingested into the store, by absolute path
+        """
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, "r") as f:
+            return json.load(f)["inputs"]
+
+
+    def load_state(self) -> bool:
+        """
+        Continues from the saved state if it belongs to this file, returns whether it did
+        """
+        state = self.read_states().get(os.path.abspath(self.path))
+        if state is None or state["size"] != os.path.getsize(self.path) or state["label"] != self.label.value:
+            return False
+
+        self.offset, self.positions, self.games = state["offset"], state["positions"], state["games"]
+        if self.offset >= state["size"]:
+            return True  # Finished, nothing to resume or drop
+
+        count = len(self.store)
+        pending = state["pending"]  # Store length before and after the range that was being appended
+        if pending is not None and pending[0] <= count <= pending[1]:
+            self.store.truncate(pending[0])
+        elif count != state["records"]:
+            raise ValueError(
+                f"{self.store.path} has {count} records, {state['records']} when ingesting {self.path} stopped, "
+                "other writers appended to it. Restart the ingestion to ingest the file again"
+            )
+        return True
+
+
+    def save_state(self, pending: tuple[int, int] = None):
+        """
+        Saves the progress, pending is the store length before and after a range about to be appended
+        """
+        states = self.read_states()
+        states[os.path.abspath(self.path)] = {
+            "size": os.path.getsize(self.path),
+            "label": self.label.value,
+            "offset": self.offset,
+            "records": len(self.store),
+            "pending": pending,
+            "positions": self.positions,
+            "games": self.games,
+        }
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump({"inputs": states}, f)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+
+    def run(self, resume: bool = True) -> int:
+        """
+        Ingests the rest of the file, returns the number of positions added by this run
+        """
+        if not (resume and self.load_state()):
+            self.offset = self.positions = self.games = 0
+        if self.offset:
+            get_logger().info(f"Resuming {self.path} at byte {self.offset}, {self.positions} positions so far")
+
+        size = os.path.getsize(self.path)
+        tasks = ((self.path, start, end, self.file_format, self.label) for start, end in chunk_ranges(self.path, self.chunk_size, self.offset, self.file_format))
+        start_time = time.time()
+        added = 0
+        with mp.get_context().Pool(self.workers) as pool:
+            for end, records, games in pool.imap(_ingest_range, tasks):
+                self.save_state(pending=(len(self.store), len(self.store) + len(records)))
+                self.store.append(records)
+                self.offset = end
+                self.positions += len(records)
+                self.games += games
+                added += len(records)
+                self.save_state()
+
+                duration = time.time() - start_time
+                print(f"{self.offset / size:.1%}, {self.positions} positions, {added / duration:.0f} positions/s")
+
+        duration = time.time() - start_time
+        get_logger().info(f"Ingested {self.path}: {added} positions from {self.games} games in {duration:.1f}s ({added / duration if duration else 0:.0f} positions/s)")
+        return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Adds the positions of a PGN or EPD file to the position store")
+    parser.add_argument("input", type=str, help="PGN or EPD file")
+    parser.add_argument("--config", type=str, help="Path to config yaml file", required=False)
+    parser.add_argument("--output", type=str, help="Position store, the configured one by default", required=False)
+    parser.add_argument("--workers", type=int, help="Processes, all cores by default", required=False)
+    parser.add_argument("--label", type=str, choices=[label.value for label in Label], help="Target of the positions", required=False)
+    parser.add_argument("--restart", action="store_true", help="Start from the beginning of the file instead of resuming")
+
+    args = parser.parse_args()
+
+
+    if args.config:
+        if not os.path.exists(args.config):
+            raise FileNotFoundError(f"Config file not found: {args.config}")
+
+        os.environ[CONFIG_PATH_ENV_VAR] = args.config
+
+
+    init_logger()
+
+    ingestion = Ingestion(args.input, args.output, args.workers, label=Label(args.label) if args.label else None)
+    ingestion.run(resume=not args.restart)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,9 +6,10 @@ from config import load_config
 def init_logger():
     logger = logging.getLogger("checkmatrix")
 
-    logger.setLevel(logging.DEBUG)
+    config = load_config()
+    logger.setLevel(config.log_level.value.upper())
 
-    file_handler = logging.FileHandler(load_config().log_path)
+    file_handler = logging.FileHandler(config.log_path)
     stream_handler = logging.StreamHandler()
 
     formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
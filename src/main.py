@@ -3,12 +3,21 @@ import torch.optim as optim
 import os
 import time
 from logger import init_logger, get_logger
-from model import CheckMatrixModel
+from model import create_model
 from game import play_game
-from config import load_config, Device, Opponent
+from config import load_config, Device, Opponent, Precision
 import argparse
 from constants import CONFIG_PATH_ENV_VAR
 from game import Stockfish
+from mcts.pool import shutdown_pool
+from evaluator import shutdown_evaluator
+from replay_buffer import ReplayBuffer
+from checkpoint import CheckpointManager
+from actor_learner import ActorLearner
+from multi_game import play_games
+from position_store import PositionStore
+from inference import validate_precision
+from metrics import start_metrics, shutdown_metrics
 
 
 
@@ -37,22 +46,49 @@ def main():
     device = torch.device(device_type.value)
     print(f"Using {config.device.value} device")
 
-    model = CheckMatrixModel().to(device)
-    if os.path.exists(config.path) and True:
-        model.load_state_dict(torch.load(config.path))
-
-
+    model = create_model(profile=config.profile).to(device)
     optimizer = optim.Adam(model.parameters(), lr=config.learning_rate)
     criterion = torch.nn.SmoothL1Loss()
 
+    checkpoints = CheckpointManager(model, optimizer)
+    checkpoints.restore()
+
+    if config.inference.precision != Precision.FLOAT32 and config.inference.validation_positions:
+        validate_precision(model, device)  # Logs how far the evaluations drift from float32
+
+    start_metrics()
     get_logger().info("Started")
 
     stockfish = None
     if config.opponent in [Opponent.STOCKFISH, Opponent.MIXED]:
         stockfish = Stockfish()
 
+    replay_buffer = ReplayBuffer()  # Shared by all games
+    position_store = PositionStore() if config.training.position_store else None  # Every played position, for offline training
+    learner = None
+
     running = True
     try:
+        if config.self_play.actors > 0:
+            learner = ActorLearner(model, optimizer, criterion, device, replay_buffer, checkpoints, position_store)
+            learner.run(config.epochs)
+            running = False
+        elif config.self_play.concurrent_games > 1:
+            play_games(
+                model,
+                optimizer,
+                criterion,
+                device,
+                config.mcts.iterations,
+                config.mcts.workers,
+                config.opponent,
+                stockfish,
+                replay_buffer,
+                checkpoints,
+                position_store,
+                games=config.epochs)
+            running = False
+
         epoch = 0
         while running:
             epoch += 1
@@ -66,7 +102,10 @@ def main():
                 config.mcts.iterations,
                 config.mcts.workers,
                 config.opponent,
-                stockfish)
+                stockfish,
+                replay_buffer,
+                checkpoints,
+                position_store)
             print(f"Game {epoch}, Result: {result}")
             end_time = time.time()
 
@@ -82,8 +121,15 @@ def main():
         running = False
         raise e
     finally:
+        if learner is not None:
+            learner.close()
+        if stockfish is not None:
+            stockfish.close()
+        shutdown_pool()
+        shutdown_evaluator()
         get_logger().info("Stopped")
-        torch.save(model.state_dict(), config.path)
+        checkpoints.close()  # Writes the final weights
+        shutdown_metrics()  # After the last checkpoint write is measured
 
 
 if __name__ == "__main__":
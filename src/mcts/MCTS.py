@@ -1,31 +1,20 @@
-from multiprocessing import Pool
 from logger import get_logger
+from mcts.limits import SearchLimits
 from mcts.node import MCTSNode
-from mcts.simulation import run_simulation
+from mcts.pool import WorkerPool
 import chess
 
 
 
-def MCTS(root: MCTSNode, iterations: int, num_workers: int):
+def MCTS(root: MCTSNode, iterations: int, pool: WorkerPool, limits: SearchLimits = None):
+    all_results = []
+    limits = limits or SearchLimits(iterations, 0, early_stop=False)  # Their node limit replaces iterations
     try:
-        pool = Pool(num_workers)
-        get_logger().debug(f"Running MCTS with {num_workers} workers")
-        worker_iterations = iterations // num_workers
-        get_logger().debug(f"Running {worker_iterations} iterations per worker")
-        tasks = [(root, worker_iterations) for _ in range(num_workers)]
-        get_logger().debug(f"Running {len(tasks)} tasks")
-
-        all_results = pool.map(run_simulation, tasks)
-        get_logger().debug(f"Finished running {len(tasks)} tasks")
+        get_logger().debug("Running MCTS with %d workers", pool.num_workers)
+        all_results = pool.search(root, limits)
+        get_logger().debug("Finished running %d tasks", pool.num_workers)
     except Exception as e:
         get_logger().error(f"An error occurred during MCTS: {e}")
-    finally:
-        pool.close()
-        get_logger().debug("Closed pool")
-        pool.terminate()
-        get_logger().debug("Terminated pool")
-        pool.join()
-        get_logger().debug("Joined pool")
 
     
     # Aggregate results
@@ -35,20 +24,17 @@ def MCTS(root: MCTSNode, iterations: int, num_workers: int):
 
 
 def apply_move_result_to_tree(root: MCTSNode, move: chess.Move, result: int):
-    if root.board.is_legal(move):
-        node = find_or_create_node(root, move)
-        if node:
-            node.update(result)
+    node = find_or_create_node(root, move)
+    if node:
+        node.update(result)
 
 
 def find_or_create_node(root: MCTSNode, move: chess.Move):
-    for child in root.children:
-        if child.board.peek() == move: # Check the last move of the child
-            return child
+    child = root.tree.find_child(root.index, move)
+    if child >= 0:
+        return MCTSNode(root.tree, child)
 
     # If the node doesn't exist, create it
-    new_board = root.board.copy()
-    new_board.push(move)
-    new_node = MCTSNode(new_board, root.model, root.device, parent=root)
-    root.children.append(new_node)
-    return new_node
+    if move in root.untried_moves:
+        return root.add_child(move)
+    return None
@@ -0,0 +1,155 @@
+import math
+import threading
+import time
+import chess
+import numpy as np
+from config import load_config
+
+
+
+class SearchLimits:
+    """
+    When a search stops: after nodes iterations, after seconds of wall time, or when stop is
+    called (from any thread), whichever comes first. None means no limit, a search without
+    any runs until it is stopped.
+
+    The search is anytime, when it stops the most visited move so far is played. With
+    early_stop it also stops once the most visited root move leads the runner-up by more
+    visits than the rest of the budget could add, the move can't change anymore.
+    """
+
+    def __init__(self, nodes: int = None, seconds: float = None, early_stop: bool = None) -> None:
+        config = load_config().model.mcts.limits
+        self.nodes = nodes or None
+        self.seconds = (config.move_time if seconds is None else seconds) or None
+        self.early_stop = config.early_stop if early_stop is None else early_stop
+        self.check_interval = max(config.check_interval, 1)  # 0 checks every iteration
+        self._stopped = threading.Event()
+        self.start()
+
+
+    def start(self):
+        self.start_time = time.monotonic()
+        self.nodes_searched = 0  # Iterations started, kept up to date by the search
+        self.reason = None  # Why the search stopped: "stopped", "nodes", "time" or "decided"
+
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start_time
+
+
+    def stop(self):
+        """
+        Ends the search after the iterations in flight
+        """
+        self._stopped.set()
+
+
+    def restrict(self, nodes: int = None, seconds: float = None, early_stop: bool = None):
+        """
+        Limits a running search from now on, nodes more iterations and seconds more time,
+        such as a ponder search that becomes the search of our move
+        """
+        if nodes:
+            self.nodes = self.nodes_searched + nodes
+        if seconds:
+            self.seconds = self.elapsed + seconds
+        if early_stop is not None:
+            self.early_stop = early_stop
+
+
+    def remaining(self) -> float:
+        """
+        Iterations the budget has left, the time left at the speed so far
+        """
+        left = math.inf
+        if self.nodes:
+            left = self.nodes - self.nodes_searched
+        if self.seconds:
+            elapsed = self.elapsed
+            left = min(left, self.nodes_searched / max(elapsed, 1e-6) * (self.seconds - elapsed))
+        return left
+
+
+    def decided(self, visits: np.ndarray) -> bool:
+        """
+        Whether the most visited of the root moves' visits can't be overtaken anymore
+        """
+        if len(visits) <= 1:
+            return len(visits) == 1  # The only move
+        top = np.sort(visits)[-2:]
+        return top[1] - top[0] > self.remaining()
+
+
+    def check(self, visits: np.ndarray = None) -> bool:
+        """
+        Whether the search should stop, pass the visits of the root moves to check for early stopping
+        """
+        if self.reason is None:
+            if self._stopped.is_set():
+                self.reason = "stopped"
+            elif self.nodes and self.nodes_searched >= self.nodes:
+                self.reason = "nodes"
+            elif self.seconds and self.elapsed >= self.seconds:
+                self.reason = "time"
+            elif self.early_stop and visits is not None and self.nodes_searched >= self.check_interval and self.decided(visits):
+                self.reason = "decided"
+        return self.reason is not None
+
+
+def allocate_time(remaining: float, increment: float = 0, moves_to_go: int = 0) -> float:
+    """
+    Seconds to search a move with remaining seconds on the clock
+
+    The remaining time is spread over moves_to_go moves (expected_moves in sudden death),
+    most of the increment comes on top. A move never gets more than max_share of the
+    remaining time, and overhead seconds are kept for everything but the search.
+    """
+    config = load_config().model.mcts.time_control
+    seconds = remaining / (moves_to_go or config.expected_moves) + increment * config.increment_share
+    seconds = min(seconds, remaining * config.max_share) - config.overhead
+    return max(seconds, 0.01)
+
+
+class Clock:
+    """
+    Game clock of both sides, for time controls of seconds per side plus an increment per
+    move, the time being added again every moves_to_go moves (if set)
+    """
+
+    def __init__(self, seconds: float = None, increment: float = None, moves_to_go: int = None) -> None:
+        config = load_config().model.mcts.time_control
+        self.seconds = seconds or config.time
+        self.increment = config.increment if increment is None else increment
+        self.moves_to_go = config.moves_to_go if moves_to_go is None else moves_to_go
+        self.remaining = {chess.WHITE: self.seconds, chess.BLACK: self.seconds}
+        self.moves = {chess.WHITE: 0, chess.BLACK: 0}
+
+
+    def allocate(self, color: chess.Color) -> float:
+        moves_to_go = self.moves_to_go - self.moves[color] % self.moves_to_go if self.moves_to_go else 0
+        return allocate_time(self.remaining[color], self.increment, moves_to_go)
+
+
+    def limits(self, color: chess.Color, nodes: int = None) -> SearchLimits:
+        """
+        Limits of the next search of color, its allocated time (and the node limit)
+        """
+        return SearchLimits(nodes, self.allocate(color))
+
+
+    def punch(self, color: chess.Color, seconds: float):
+        """
+        Charges color for a move that took seconds
+        """
+        self.remaining[color] -= seconds
+        self.moves[color] += 1
+        if self.remaining[color] >= 0:
+            self.remaining[color] += self.increment
+            if self.moves_to_go and self.moves[color] % self.moves_to_go == 0:
+                self.remaining[color] += self.seconds
+
+
+    def flagged(self, color: chess.Color) -> bool:
+        return self.remaining[color] < 0
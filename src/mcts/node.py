@@ -1,52 +1,113 @@
 import math
 import chess
-from board import evaluate_board
-from model import CheckMatrixModel
+from evaluator import BatchEvaluator
+from mcts.tree import Tree
 from transposition_table import TranspositionTable
 
 
 
 class MCTSNode:
-    def __init__(self, board: chess.Board, model: CheckMatrixModel, device, parent=None):
-        self.board = board
-        self.model = model
-        self.device = device
-        self.parent = parent
-        self.children: list[MCTSNode] = []
-        self.wins = 0
-        self.visits = 0
-        self.untried_moves = list(board.legal_moves)
-        self.transposition_table = TranspositionTable()
-        self.board_value = self.evaluate_board()
-
-
-    def evaluate_board(self):
-        fen = self.board.fen()
-        if self.transposition_table.lookup(fen):
-            return self.transposition_table.lookup(fen)
-        value = evaluate_board(self.board, self.model, self.device)
-        self.transposition_table.store(fen, value)
-        return value
+    """
+    View of one node of a Tree, nodes are created on the fly and hold no state of their own
+    """
+
+    __slots__ = ("tree", "index")
+
+    def __init__(self, tree: Tree, index: int = 0):
+        self.tree = tree
+        self.index = int(index)
+
+
+    def __eq__(self, other):
+        return isinstance(other, MCTSNode) and self.tree is other.tree and self.index == other.index
+
+
+    def __hash__(self):
+        return hash((id(self.tree), self.index))
+
+
+    @property
+    def board(self) -> chess.Board:
+        return self.tree.board(self.index)
+
+    @property
+    def move(self) -> chess.Move:
+        return self.tree.get_move(self.index) if self.index > 0 else None
+
+    @property
+    def evaluator(self) -> BatchEvaluator:
+        return self.tree.evaluator
+
+    @property
+    def transposition_table(self) -> TranspositionTable:
+        return self.tree.transposition_table
+
+    @property
+    def parent(self):
+        parent = self.tree.parent[self.index]
+        return MCTSNode(self.tree, parent) if parent >= 0 else None
+
+    @property
+    def children(self) -> list["MCTSNode"]:
+        return [MCTSNode(self.tree, i) for i in self.tree.children(self.index) if not math.isnan(self.tree.value[i])]
+
+    @property
+    def untried_moves(self) -> list[chess.Move]:
+        if self.tree.first_child[self.index] < 0:
+            self.tree.generate_children(self.index, self.board)
+        return [self.tree.get_move(i) for i in self.tree.untried_slots(self.index)]
+
+    @property
+    def visits(self) -> int:
+        return int(self.tree.visits[self.index])
+
+    @property
+    def wins(self) -> float:
+        return float(self.tree.wins[self.index])
+
+    @property
+    def board_value(self) -> float:
+        return float(self.tree.value[self.index])
+
+    @property
+    def virtual_loss(self) -> float:
+        return float(self.tree.virtual_loss[self.index])
+
+    @virtual_loss.setter
+    def virtual_loss(self, value: float):
+        self.tree.virtual_loss[self.index] = value
 
 
     def select_child(self):
-        # UCB1 = (win rate) + C * sqrt(ln(total visits) / child visits)
-        C = 1.4  # Exploration parameter
-        return max(self.children, key=lambda child: child.board_value + C * math.sqrt(math.log(self.visits + 1) / (child.visits + 1)))
+        child = self.tree.select_child(self.index)
+        if child < 0:
+            raise ValueError(f"Node {self.index} has no evaluated children")
+        return MCTSNode(self.tree, child)
 
 
     def add_child(self, move):
-        new_board = self.board.copy()
-        new_board.push(move)
-        if self.transposition_table.lookup(new_board.fen()):
-            return  # Skip if already in transposition table
-        
-        child_node = MCTSNode(new_board, self.model, self.device, parent=self)
-        self.untried_moves.remove(move)
-        self.children.append(child_node)
-        return child_node
+        board = self.board
+        self.tree.generate_children(self.index, board)
+        slot = self.tree.reserve_child(self.index, move)
+        board.push(move)
+        self.tree.evaluate_children([slot], [board])
+        return MCTSNode(self.tree, slot)
+
+
+    def expand(self):
+        """
+        Tries every untried move, the children are evaluated in one batch
+        """
+        board = self.board
+        slots, boards = [], []
+        for _ in range(self.tree.untried(self.index, board)):
+            slots.append(self.tree.reserve_child(self.index))
+            boards.append(board.copy(stack=False))
+            boards[-1].push(self.tree.get_move(slots[-1]))
+
+        self.tree.evaluate_children(slots, boards)
+        return self.children
 
 
     def update(self, result: int):
-        self.visits += 1
-        self.wins += result
+        self.tree.update(self.index, result)
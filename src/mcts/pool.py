@@ -0,0 +1,162 @@
+import chess
+import numpy as np
+import random
+import torch
+import torch.multiprocessing as mp
+from evaluator import BatchEvaluator
+from logger import get_logger
+from metrics import collect_metrics, merge_metrics
+from mcts.limits import SearchLimits
+from model import CheckMatrixModel, load_student
+from mcts.node import MCTSNode
+from mcts.tree import Tree
+from mcts.simulation import run_simulation
+
+
+
+_pool = None
+_worker_evaluator: BatchEvaluator = None
+_worker_version = 0
+_worker_stop = None
+
+POLL_INTERVAL = 0.005  # Seconds between checks of the search limits
+
+
+class WorkerPool:
+    """
+    Long lived pool of MCTS worker processes
+
+    The model parameters are moved to shared memory once and every worker maps them, so
+    no weights are serialized per move. Workers evaluate with a frozen copy and load the
+    optimizer's in place updates from the shared parameters before their next task when
+    the pool is refreshed. Tasks only carry a compact description of the root (see
+    describe_root) and the weights version.
+
+    Workers count their iterations per root move in a shared array. While they search,
+    the main process checks the limits against it and sets the shared stop event once
+    they are reached.
+    """
+
+    def __init__(self, model: CheckMatrixModel, device, num_workers: int) -> None:
+        self.model = model
+        self.device = torch.device(device)
+        self.num_workers = num_workers
+        self.version = 0  # Bumped by refresh, workers with an older copy reload it
+
+        model.share_memory()
+        # CUDA tensors can only be shared with spawned processes
+        context = mp.get_context("spawn" if self.device.type == "cuda" else None)
+        self.stop = context.Event()
+        self.pool = context.Pool(num_workers, initializer=_init_worker, initargs=(model, self.device, self.stop))
+        get_logger().debug(f"Started MCTS pool with {num_workers} workers")
+
+
+    def search(self, root: MCTSNode, limits: SearchLimits) -> list[list[tuple[chess.Move, int]]]:
+        worker_iterations = limits.nodes // self.num_workers if limits.nodes else None
+        get_logger().debug("Running %s iterations per worker", worker_iterations)
+
+        moves = list(root.board.legal_moves)
+        visits = np.zeros(len(moves))  # Reused visits of the root moves
+        for child in root.children:
+            visits[moves.index(child.move)] = child.visits
+        progress = torch.zeros(self.num_workers, len(moves), dtype=torch.int64).share_memory_()
+
+        description = describe_root(root)
+        tasks = [(description, worker_iterations, random.getrandbits(64), self.version, progress, i) for i in range(self.num_workers)]
+        self.stop.clear()
+        pending = self.pool.map_async(_run_task, tasks)
+        while not pending.ready():
+            counts = progress.numpy().sum(0)
+            limits.nodes_searched = int(counts.sum())
+            if not self.stop.is_set() and limits.check(visits + counts):
+                self.stop.set()
+            pending.wait(POLL_INTERVAL)
+
+        results = []
+        for worker_results, worker_metrics in pending.get():
+            merge_metrics(worker_metrics)
+            results.append(worker_results)
+        limits.nodes_searched = int(progress.sum())
+        return results
+
+
+    def refresh(self):
+        self.version += 1
+
+
+    def shutdown(self):
+        self.pool.close()
+        self.pool.join()
+        get_logger().debug("Joined pool")
+
+
+def get_pool(model: CheckMatrixModel, device, num_workers: int) -> WorkerPool:
+    """
+    Returns the shared worker pool, it is started on first use and reused across moves and games
+    """
+    global _pool
+    if _pool is not None and (_pool.model is not model or _pool.device != torch.device(device) or _pool.num_workers != num_workers):
+        shutdown_pool()
+
+    if _pool is None:
+        _pool = WorkerPool(model, device, num_workers)
+    return _pool
+
+
+def refresh_pool():
+    if _pool is not None:
+        _pool.refresh()
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def describe_root(root: MCTSNode):
+    """
+    Compact, picklable description of a root: the position as a start FEN plus the moves
+    played (kept for repetition detection), the root value, its evaluated children and the
+    transposition table, which is moved to shared memory and not copied
+    """
+    board = root.board
+    return (
+        board.root().fen(),
+        [move.uci() for move in board.move_stack],
+        root.board_value,
+        [(child.move.uci(), child.board_value) for child in root.children],
+        root.transposition_table.share_memory()
+    )
+
+
+def build_root(description, evaluator: BatchEvaluator) -> MCTSNode:
+    fen, moves, board_value, children, transposition_table = description
+    board = chess.Board(fen)
+    for move in moves:
+        board.push_uci(move)
+
+    tree = Tree(board, evaluator, transposition_table, board_value=board_value)
+    tree.generate_children(0, board)
+    for move, value in children:
+        slot = tree.reserve_child(0, chess.Move.from_uci(move))
+        tree.value[slot] = value
+    return MCTSNode(tree)
+
+
+def _init_worker(model: CheckMatrixModel, device, stop):
+    global _worker_evaluator, _worker_stop
+    _worker_evaluator = BatchEvaluator(model, device, student=load_student(device))
+    _worker_stop = stop
+
+
+def _run_task(task):
+    global _worker_version
+    description, iterations, seed, version, progress, worker = task
+    if version != _worker_version:
+        _worker_evaluator.refresh()
+        _worker_version = version
+    random.seed(seed)  # Forked workers would otherwise all play the same rollouts
+    results = run_simulation(build_root(description, _worker_evaluator), iterations, _worker_stop, progress[worker].numpy())
+    return results, collect_metrics()  # The worker's metrics since its last task, None when disabled
@@ -0,0 +1,101 @@
+import chess
+import random
+import time
+from typing import Callable
+from config import CutoffEvaluation, RolloutPolicy, load_config
+from metrics import DEPTH_BUCKETS, get_metrics
+from reward import calculate_reward
+
+
+
+class Rollout:
+    """
+    Plays out a position for MCTS, returns 1 if white won and 0 otherwise
+
+    The moves come from the configured policy, "random" or "capture" (a random capture if
+    there is one, a random move otherwise). After max_depth plies the rollout stops, and
+    the position's value, from evaluate (the value network) or calculate_reward, is mapped
+    to white's chance to win and returned instead.
+
+    With fast_terminal, the end of the game is detected from the move generation the
+    policy does anyway, plus the insufficient material and 75-move rules. Repetitions are
+    not checked.
+    """
+
+    def __init__(self, evaluate: Callable[[chess.Board], float] = None) -> None:
+        self.config = load_config().model.mcts.rollout
+        self.evaluate = evaluate
+        self.rollouts = 0
+        self.plies = 0
+        self.cutoffs = 0
+        self.seconds = 0.0
+        self.depths = get_metrics().histogram("checkmatrix_rollout_depth", "Plies played per rollout", DEPTH_BUCKETS)
+
+
+    def __call__(self, board: chess.Board) -> float:
+        start_time = time.perf_counter()
+        plies = self.plies
+        result = self._play(board)
+        self.seconds += time.perf_counter() - start_time
+        self.rollouts += 1
+        self.depths.observe(self.plies - plies)
+        return result
+
+
+    def _play(self, board: chess.Board) -> float:
+        max_depth = self.config.max_depth
+        depth = 0
+        while not max_depth or depth < max_depth:
+            if not self.config.fast_terminal and board.is_game_over():
+                return 1 if board.result() == "1-0" else 0
+            if self.config.fast_terminal and (board.is_insufficient_material() or board.halfmove_clock >= 150):
+                return 0
+
+            move = self.select_move(board)
+            if move is None:
+                # Checkmate or stalemate, white only wins if black is mated
+                return 1 if board.turn == chess.BLACK and board.is_check() else 0
+
+            board.push(move)
+            depth += 1
+            self.plies += 1
+
+        self.cutoffs += 1
+        return self.cutoff_value(board)
+
+
+    def select_move(self, board: chess.Board) -> chess.Move:
+        if self.config.policy == RolloutPolicy.CAPTURE:
+            captures = list(board.generate_legal_captures())
+            if captures:
+                return random.choice(captures)
+
+        moves = list(board.generate_legal_moves())
+        return random.choice(moves) if moves else None
+
+
+    def cutoff_value(self, board: chess.Board) -> float:
+        if board.is_checkmate():
+            return 1 if board.turn == chess.BLACK else 0
+
+        if self.config.cutoff == CutoffEvaluation.VALUE and self.evaluate is not None:
+            value = self.evaluate(board)
+        else:
+            value = calculate_reward(board)
+
+        return (max(-1.0, min(1.0, value)) + 1) / 2  # From white's evaluation to white's chance to win
+
+
+    def stats(self) -> str:
+        return format_stats([self])
+
+
+def format_stats(rollouts: list[Rollout]) -> str:
+    count = sum(rollout.rollouts for rollout in rollouts)
+    plies = sum(rollout.plies for rollout in rollouts)
+    cutoffs = sum(rollout.cutoffs for rollout in rollouts)
+    seconds = sum(rollout.seconds for rollout in rollouts)
+    return (
+        f"{count} rollouts, {count / seconds if seconds else 0:.1f} rollouts/s, "
+        f"{plies / count if count else 0:.1f} plies per rollout, {cutoffs} cut off"
+    )
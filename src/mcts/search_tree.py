@@ -0,0 +1,64 @@
+import chess
+from evaluator import BatchEvaluator
+from config import load_config
+from logger import get_logger
+from mcts.node import MCTSNode
+from mcts.tree import Tree
+from transposition_table import TranspositionTable
+
+
+
+class SearchTree:
+    """
+    Keeps the search tree and transposition table of a game between moves
+
+    When the next search starts, the node matching the moves played since the last search
+    (our move and the reply, whoever made it) becomes the new root, with its statistics.
+    The rest of the old tree is dropped.
+    """
+
+    def __init__(self) -> None:
+        self.config = load_config().model.mcts.transposition_table
+        self.tree: Tree = None
+        self.reused_visits: list[int] = []  # Visits carried over into each search
+        self.transposition_table = TranspositionTable(self.config.max_size)
+
+
+    def get_root(self, board: chess.Board, evaluator: BatchEvaluator) -> MCTSNode:
+        table = self.transposition_table
+        if self.tree is not None:
+            get_logger().debug("Transposition table hit rate: %.3f, collisions: %d", table.hit_rate, table.collisions)
+            if not self.config.reuse:
+                table.clear()
+
+        node = self.find(board)
+        if node is None:
+            self.tree = Tree(board, evaluator, table)
+        elif node.index > 0:
+            self.tree = self.tree.subtree(node.index)  # Compacted, the rest of the old tree gets freed
+        self.tree.evaluator = evaluator
+
+        root = MCTSNode(self.tree)
+        self.reused_visits.append(root.visits)
+        get_logger().debug("Search starts with %d reused visits", root.visits)
+        return root
+
+
+    def find(self, board: chess.Board) -> MCTSNode:
+        """
+        Returns the node of the current tree matching the board, or None
+        """
+        if self.tree is None:
+            return None
+
+        played = self.tree.root_board.move_stack
+        if board.move_stack[:len(played)] != played or board.root() != self.tree.root_board.root():
+            return None
+
+        index = 0
+        for move in board.move_stack[len(played):]:
+            index = self.tree.find_child(index, move)
+            if index < 0:
+                return None
+
+        return MCTSNode(self.tree, index)
@@ -0,0 +1,104 @@
+import logging
+import threading
+from logger import get_logger
+from mcts.limits import SearchLimits
+from mcts.node import MCTSNode
+from mcts.rollout import Rollout, format_stats
+
+
+
+def shared_tree_search(root: MCTSNode, iterations: int, num_workers: int, virtual_loss: float = 1.0, limits: SearchLimits = None):
+    """
+    Runs MCTS with num_workers threads descending the same tree
+
+    Tree updates happen under one lock, evaluations and rollouts happen outside of it, so
+    leaf evaluations from different threads end up in the same batch. Every node on a path
+    being searched carries a virtual loss until its result is backpropagated, which steers
+    the other threads towards different paths.
+
+    Without limits the search runs iterations iterations, with them it runs until they are
+    reached (their node limit replaces iterations). The threads check them before every
+    iteration, the root visits for early stopping every check_interval iterations.
+    """
+    tree = root.tree
+    lock = threading.Condition()
+    limits = limits or SearchLimits(iterations, 0, early_stop=False)
+    in_flight = [0]
+
+    rollouts = [Rollout(tree.evaluate_board) for _ in range(num_workers)]
+
+    def worker(rollout: Rollout):
+        with tree.evaluator.submitter():
+            search(rollout)
+
+    def search(rollout: Rollout):
+        while True:
+            with lock:
+                visits = None
+                if limits.early_stop and limits.nodes_searched % limits.check_interval == 0:
+                    children = tree.children(root.index)
+                    visits = tree.visits[children.start:children.stop]
+                if limits.check(visits):
+                    return
+                limits.nodes_searched += 1
+
+                # Pruning moves nodes, wait until no other thread holds an index
+                if tree.needs_pruning() and root.index == 0:
+                    lock.wait_for(lambda: in_flight[0] == 0)
+                    if tree.needs_pruning():
+                        tree.prune()
+                in_flight[0] += 1
+
+            try:
+                search_iteration(root, lock, virtual_loss, rollout)
+            finally:
+                with lock:
+                    in_flight[0] -= 1
+                    lock.notify_all()
+
+    get_logger().debug("Running shared tree MCTS with %d threads", num_workers)
+    threads = [threading.Thread(target=worker, args=(rollouts[i],), name=f"checkmatrix-mcts-{i}") for i in range(num_workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if get_logger().isEnabledFor(logging.DEBUG):
+        get_logger().debug(f"Finished shared tree MCTS, root visits: {root.visits}, tree: {tree.stats()}")
+        get_logger().debug(f"Rollouts: {format_stats(rollouts)}")
+
+
+def search_iteration(root: MCTSNode, lock: threading.Condition, virtual_loss: float, rollout: Rollout):
+    tree = root.tree
+
+    # Selection, the path is reserved with a virtual loss
+    with lock:
+        index = root.index
+        board = tree.board(index)
+        tree.virtual_loss[index] += virtual_loss
+        while tree.untried(index, board) == 0:
+            child = tree.select_child(index)
+            if child < 0:
+                break  # Terminal, or all children are still being evaluated
+            index = child
+            board.push(tree.get_move(index))
+            tree.virtual_loss[index] += virtual_loss
+
+        # Reserve a move to expand, so no other thread expands it as well
+        slot = -1
+        if tree.untried(index, board) > 0:
+            slot = tree.reserve_child(index)
+            board.push(tree.get_move(slot))
+
+    # Expansion, the child is evaluated outside the lock
+    if slot >= 0:
+        value = tree.evaluate_board(board)
+
+    # Simulation
+    result = rollout(board)
+
+    # Backpropagation, releasing the virtual loss
+    with lock:
+        if slot >= 0:
+            tree.value[slot] = value
+            tree.update(slot, result)
+        tree.backpropagate(index, result, virtual_loss)
@@ -1,42 +1,65 @@
-import copy
-import random
+import itertools
+import logging
+import numpy as np
 from logger import get_logger
 from mcts.node import MCTSNode
+from mcts.rollout import Rollout
 
 
 
-def run_simulation(args):
-    node, iterations = args
-    local_node: MCTSNode = copy.deepcopy(node)
+def run_simulation(local_node: MCTSNode, iterations: int, stop = None, progress: np.ndarray = None):
+    """
+    Runs MCTS iterations on a worker's own tree, returns the (root move, result) of each
+
+    With iterations None it runs until the stop event is set, which also ends it early.
+    Every iteration is counted in progress, by root move in the order of the root's legal moves.
+    """
     results = []
 
-    get_logger().debug(f"Running {iterations} iterations on worker")
+    get_logger().debug("Running %s iterations on worker", iterations)
+
+    tree = local_node.tree
+    rollout = Rollout(tree.evaluate_board)
+    columns = {move: i for i, move in enumerate(local_node.board.legal_moves)} if progress is not None else None
+    for _ in range(iterations) if iterations is not None else itertools.count():
+        if stop is not None and stop.is_set():
+            break
+        if tree.needs_pruning() and local_node.index == 0:
+            tree.prune()
 
-    for _ in range(iterations):
-        current_node: MCTSNode = local_node
-        board_copy = local_node.board.copy()
+        index = local_node.index
+        board_copy = tree.board(index)
+        move = None  # Move played from the root, reported back to the main tree
 
         # Selection
-        while current_node.untried_moves == [] and current_node.children != []:
-            current_node = current_node.select_child()
-            board_copy.push(current_node.board.move_stack[-1])
+        while tree.untried(index, board_copy) == 0:
+            child = tree.select_child(index)
+            if child < 0:
+                break  # Terminal
+            index = child
+            board_copy.push(tree.get_move(index))
+            move = move or board_copy.peek()
 
         # Expansion
-        if current_node.untried_moves != []:
-            move = random.choice(current_node.untried_moves)
-            board_copy.push(move)
-            current_node = current_node.add_child(move)
+        if tree.untried(index, board_copy) > 0:
+            index = tree.reserve_child(index)
+            board_copy.push(tree.get_move(index))
+            move = move or board_copy.peek()
+            tree.evaluate_children([index], [board_copy])
 
         # Simulation
-        while not board_copy.is_game_over():
-            board_copy.push(random.choice(list(board_copy.legal_moves)))
+        result = rollout(board_copy)
 
         # Backpropagation
-        result = 1 if board_copy.result() == "1-0" else 0
-        while current_node is not None:
-            current_node.update(result)
-            current_node = current_node.parent
+        tree.backpropagate(index, result)
 
-        results.append((move, result))
-    
+        if move is not None:
+            results.append((move, result))
+            if progress is not None:
+                progress[columns[move]] += 1
+
+    if get_logger().isEnabledFor(logging.DEBUG):
+        get_logger().debug(f"Worker tree: {tree.stats()}")
+        get_logger().debug(f"Worker rollouts: {rollout.stats()}")
     return results
+
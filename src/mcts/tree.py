@@ -0,0 +1,332 @@
+import copy
+import chess
+import chess.polyglot
+import random
+import numpy as np
+from config import MemoryPolicy, load_config
+from evaluator import BatchEvaluator
+from transposition_table import TranspositionTable
+
+
+
+C = 1.4  # Exploration parameter
+LEAF_KEY = 0x9E3779B97F4A7C15  # Mixed into the keys of student evaluations, they don't replace the model's
+
+# Per node arrays of a Tree
+FIELDS = {
+    "parent": np.int32,
+    "first_child": np.int32,  # -1 until the children are generated
+    "num_children": np.int16,
+    "num_tried": np.int16,  # Children that were selected for expansion, they come first in the block
+    "move": np.uint16,  # Move leading to the node, see pack_move
+    "visits": np.int32,
+    "wins": np.float64,
+    "value": np.float32,  # Board evaluation, NaN until the node is evaluated
+    "virtual_loss": np.float32,  # Pending visits of parallel searches, see mcts.shared_tree
+}
+NODE_BYTES = sum(np.dtype(dtype).itemsize for dtype in FIELDS.values())
+
+
+def pack_move(move: chess.Move) -> int:
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def unpack_move(packed: int) -> chess.Move:
+    return chess.Move(packed & 0x3F, packed >> 6 & 0x3F, packed >> 12 or None)
+
+
+class Tree:
+    """
+    Search tree stored as a struct of NumPy arrays, node 0 is the root
+
+    The children of a node are one contiguous block of slots, generated in random order
+    the first time the node is expanded. Until a child is tried it is only a packed move,
+    trying it evaluates it. Boards are not stored, they are rebuilt by replaying the moves
+    from the root board.
+    """
+
+    def __init__(self, board: chess.Board, evaluator: BatchEvaluator, transposition_table: TranspositionTable = None, board_value: float = None, capacity: int = 1024) -> None:
+        self.root_board = board.copy()
+        self.evaluator = evaluator
+        self.transposition_table = transposition_table or TranspositionTable()
+        self.root_depth = load_config().model.student.root_depth
+        self._init_budget(load_config().model.mcts.memory)
+        self.size = 0
+        self.capacity = 0
+        self._allocate(min(capacity, self.max_nodes or capacity))
+
+        self._init_slots(0, 1, parent=-1)
+        self.size = 1
+        self.value[0] = self.evaluate_board(self.root_board) if board_value is None else board_value
+
+
+    def _init_budget(self, config):
+        limits = [limit for limit in [config.max_nodes, config.max_bytes // NODE_BYTES] if limit > 0]
+        self.max_nodes = min(limits) if limits else 0  # 0 for no limit
+        self.policy = config.policy
+        self.prune_to = config.prune_to
+        self.full = False  # Set when an expansion was refused, until the next prune
+        self.refused = 0
+        self.pruned = 0
+
+
+    def _allocate(self, capacity: int):
+        for name, dtype in FIELDS.items():
+            array = np.empty(capacity, dtype=dtype)
+            if self.size:
+                array[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, array)
+        self.capacity = capacity
+
+
+    def _init_slots(self, start: int, count: int, parent: int):
+        end = start + count
+        self.parent[start:end] = parent
+        self.first_child[start:end] = -1
+        self.num_children[start:end] = 0
+        self.num_tried[start:end] = 0
+        self.move[start:end] = 0
+        self.visits[start:end] = 0
+        self.wins[start:end] = 0
+        self.value[start:end] = np.nan
+        self.virtual_loss[start:end] = 0
+
+
+    def _add_block(self, parent: int, count: int) -> int:
+        if self.size + count > self.capacity:
+            capacity = max(self.capacity * 2, self.size + count)
+            self._allocate(min(capacity, max(self.max_nodes, self.size + count)) if self.max_nodes else capacity)
+
+        start = self.size
+        self._init_slots(start, count, parent)
+        self.size += count
+        return start
+
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in FIELDS)
+
+
+    def stats(self) -> str:
+        return f"{self.size} nodes, {self.nbytes} bytes, {self.pruned} pruned, {self.refused} expansions refused"
+
+
+    def get_move(self, index: int) -> chess.Move:
+        return unpack_move(int(self.move[index]))
+
+
+    def moves_to(self, index: int) -> list[chess.Move]:
+        moves = []
+        while index > 0:
+            moves.append(self.get_move(index))
+            index = self.parent[index]
+        moves.reverse()
+        return moves
+
+
+    def board(self, index: int) -> chess.Board:
+        board = self.root_board.copy()
+        for move in self.moves_to(index):
+            board.push(move)
+        return board
+
+
+    def generate_children(self, index: int, board: chess.Board):
+        """
+        Adds an untried child slot for every legal move, board must be the node's board
+
+        Nothing is added if the node budget does not allow it, the node stays a leaf.
+        """
+        if self.first_child[index] >= 0:
+            return
+
+        moves = list(board.legal_moves)
+        if self.max_nodes and self.size + len(moves) > self.max_nodes:
+            self.full = True
+            self.refused += 1
+            return
+
+        random.shuffle(moves)  # Trying slots in order is trying random untried moves
+        start = self._add_block(index, len(moves))
+        self.move[start:start + len(moves)] = [pack_move(move) for move in moves]
+        self.first_child[index] = start
+        self.num_children[index] = len(moves)
+
+
+    def untried(self, index: int, board: chess.Board) -> int:
+        """
+        Number of untried children, board must be the node's board
+        """
+        self.generate_children(index, board)
+        return int(self.num_children[index] - self.num_tried[index])
+
+
+    def children(self, index: int) -> range:
+        """
+        Slots of the tried children, their value is NaN while they are being evaluated
+        """
+        start = int(self.first_child[index])
+        return range(start, start + self.num_tried[index]) if start >= 0 else range(0)
+
+
+    def untried_slots(self, index: int) -> range:
+        start = int(self.first_child[index])
+        return range(start + self.num_tried[index], start + self.num_children[index]) if start >= 0 else range(0)
+
+
+    def reserve_child(self, index: int, move: chess.Move = None) -> int:
+        """
+        Marks the next untried child, or the one of the given move, as tried and returns its slot
+        """
+        slot = int(self.first_child[index] + self.num_tried[index])
+        if move is not None:
+            packed = pack_move(move)
+            found = next((i for i in self.untried_slots(index) if self.move[i] == packed), None)
+            if found is None:
+                raise ValueError(f"Move {move} is not an untried move of node {index}")
+            self.move[slot], self.move[found] = self.move[found], self.move[slot]
+
+        self.num_tried[index] += 1
+        return slot
+
+
+    def find_child(self, index: int, move: chess.Move) -> int:
+        packed = pack_move(move)
+        return next((i for i in self.children(index) if self.move[i] == packed), -1)
+
+
+    def is_leaf(self, board: chess.Board) -> bool:
+        """
+        Whether the board is deep enough below the root to be evaluated by the student, if there is one
+        """
+        return self.evaluator.leaf_engine is not None and board.ply() - self.root_board.ply() > self.root_depth
+
+
+    def evaluate_board(self, board: chess.Board) -> float:
+        leaf = self.is_leaf(board)
+        key = chess.polyglot.zobrist_hash(board) ^ (LEAF_KEY if leaf else 0)
+        value = self.transposition_table.lookup(key)
+        if value is None:
+            value = self.evaluator.evaluate(board, leaf)
+            self.transposition_table.store(key, value)
+        return value
+
+
+    def evaluate_children(self, slots: list[int], boards: list[chess.Board]):
+        """
+        Evaluates reserved children in one batch, boards are the children's boards (all at the same depth)
+        """
+        leaf = bool(boards) and self.is_leaf(boards[0])
+        keys = [chess.polyglot.zobrist_hash(board) ^ (LEAF_KEY if leaf else 0) for board in boards]
+        values = [self.transposition_table.lookup(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        for i, value in zip(missing, self.evaluator.evaluate_many([boards[i] for i in missing], leaf)):
+            values[i] = value
+            self.transposition_table.store(keys[i], value)
+
+        self.value[slots] = values
+
+
+    def select_child(self, index: int) -> int:
+        """
+        Returns the evaluated child with the highest UCB1 score, or -1 if there is none
+        """
+        children = self.children(index)
+        if not children:
+            return -1
+
+        # UCB1 = (win rate) + C * sqrt(ln(total visits) / child visits)
+        # Virtual losses count as visits that lost, this spreads parallel searches out
+        start, end = children.start, children.stop
+        values = self.value[start:end].astype(np.float64)
+        virtual_loss = self.virtual_loss[start:end]
+        visits = self.visits[start:end] + virtual_loss + 1
+        parent_visits = self.visits[index] + self.virtual_loss[index]
+        scores = values - virtual_loss / visits + C * np.sqrt(np.log(parent_visits + 1) / visits)
+        scores[np.isnan(values)] = -np.inf  # Still being evaluated
+
+        best = int(np.argmax(scores))
+        return start + best if scores[best] != -np.inf else -1
+
+
+    def update(self, index: int, result: int):
+        self.visits[index] += 1
+        self.wins[index] += result
+
+
+    def backpropagate(self, index: int, result: int, virtual_loss: float = 0):
+        while index >= 0:
+            self.visits[index] += 1
+            self.wins[index] += result
+            self.virtual_loss[index] -= virtual_loss
+            index = self.parent[index]
+
+
+    def needs_pruning(self) -> bool:
+        return self.full and self.policy == MemoryPolicy.PRUNE
+
+
+    def prune(self):
+        """
+        Drops the children of the least visited expanded nodes, until about prune_to of the
+        node budget is used. Those nodes keep their statistics and become leaves again.
+        The tree is compacted in place, only the root keeps its index.
+        """
+        self.full = False
+        expanded = np.flatnonzero(self.first_child[1:self.size] >= 0) + 1
+        excess = self.size - int(self.max_nodes * self.prune_to)
+        if excess <= 0 or len(expanded) == 0:
+            return
+
+        # Descendants of a node have no more visits than it, so they are mostly in the
+        # dropped set already, counting only the children is a close estimate
+        order = expanded[np.argsort(self.visits[expanded], kind="stable")]
+        count = int(np.searchsorted(np.cumsum(self.num_children[order]), excess)) + 1
+        dropped = np.zeros(self.size, dtype=bool)
+        dropped[order[:count]] = True
+
+        source = copy.copy(self)
+        size = self.size
+        self.size = 0
+        self.capacity = 0
+        self._allocate(source.capacity)
+        self._copy_nodes(source, 0, dropped)
+        self.pruned += size - self.size
+
+
+    def subtree(self, index: int) -> "Tree":
+        """
+        Copies the subtree of a node into a new tree, with the node as its root
+        """
+        tree = copy.copy(self)
+        tree.root_board = self.board(index)
+        tree.size = 0
+        tree.capacity = 0
+        tree.pruned = tree.refused = 0
+        tree._allocate(max(1024, self.capacity // 2))
+        tree._copy_nodes(self, index)
+        return tree
+
+
+    def _copy_nodes(self, source: "Tree", index: int, dropped: np.ndarray = None):
+        self.size = 1
+        for name in FIELDS:
+            getattr(self, name)[0] = getattr(source, name)[index]
+        self.parent[0] = -1
+
+        queue = [(index, 0)]
+        while queue:
+            old, new = queue.pop()
+            start, count = int(source.first_child[old]), int(source.num_children[old])
+            if start < 0 or (dropped is not None and dropped[old]):
+                self.first_child[new] = -1
+                self.num_children[new] = self.num_tried[new] = 0
+                continue
+
+            block = self._add_block(new, count)
+            for name in FIELDS:
+                getattr(self, name)[block:block + count] = getattr(source, name)[start:start + count]
+            self.parent[block:block + count] = new
+            self.first_child[new] = block
+            queue.extend((start + i, block + i) for i in range(source.num_tried[old]))
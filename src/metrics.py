@@ -0,0 +1,358 @@
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from config import load_config
+from logger import get_logger
+
+
+
+_registry = None
+
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+DEPTH_BUCKETS = [0, 1, 2, 4, 8, 16, 32, 64, 128, 256]
+
+
+class Counter:
+    """
+    A value that only goes up, such as nodes searched
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, description: str) -> None:
+        self.name = name
+        self.description = description
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+    def drain(self):
+        with self._lock:
+            value, self.value = self.value, 0.0
+        return value
+
+
+    def merge(self, value):
+        self.inc(value)
+
+
+    def snapshot(self):
+        return self.value
+
+
+    def prometheus(self) -> list[str]:
+        return [f"{self.name} {self.value:g}"]
+
+
+class Gauge:
+    """
+    A value that is set, such as the last search's nodes per second
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str) -> None:
+        self.name = name
+        self.description = description
+        self.value = 0.0
+
+
+    def set(self, value: float):
+        self.value = value
+
+
+    def drain(self):
+        return self.value
+
+
+    def merge(self, value):
+        self.set(value)
+
+
+    def snapshot(self):
+        return self.value
+
+
+    def prometheus(self) -> list[str]:
+        return [f"{self.name} {self.value:g}"]
+
+
+class Histogram:
+    """
+    Counts of observed values per bucket (the upper bounds, plus one past the last), with their sum
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, buckets: list[float]) -> None:
+        self.name = name
+        self.description = description
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+
+    def drain(self):
+        with self._lock:
+            state = (self.counts, self.count, self.sum)
+            self.counts, self.count, self.sum = [0] * (len(self.buckets) + 1), 0, 0.0
+        return state
+
+
+    def merge(self, state):
+        counts, count, total = state
+        with self._lock:
+            self.counts = [a + b for a, b in zip(self.counts, counts)]
+            self.count += count
+            self.sum += total
+
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "buckets": {f"{bound:g}": count for bound, count in zip(self.buckets + [math.inf], self.counts)},
+        }
+
+
+    def prometheus(self) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + [math.inf], self.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{"+Inf" if bound == math.inf else f"{bound:g}"}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {self.sum:g}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+
+class NullMetric:
+    """
+    Stands in for every metric when metrics are disabled, updates do nothing
+    """
+
+    def inc(self, amount: float = 1):
+        pass
+
+
+    def set(self, value: float):
+        pass
+
+
+    def observe(self, value: float):
+        pass
+
+
+NULL_METRIC = NullMetric()
+
+
+class Registry:
+    """
+    The metrics of this process, by name
+
+    Metrics are created on first use. A writer thread (see start) appends a snapshot to
+    the JSON-lines file and rewrites the Prometheus text file every interval seconds.
+    Processes other than the main one (MCTS pool workers, self-play actors) don't write,
+    their metrics are drained after each task or game and merged into the main process's
+    registry.
+    """
+    enabled = True
+
+    def __init__(self, jsonl_path: str = None, prometheus_path: str = None, interval: float = None) -> None:
+        config = load_config().metrics
+        self.jsonl_path = config.jsonl_path if jsonl_path is None else jsonl_path
+        self.prometheus_path = config.prometheus_path if prometheus_path is None else prometheus_path
+        self.interval = interval or config.interval
+        self.pid = os.getpid()
+        self.metrics = {}
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+
+    def _get(self, cls, name: str, *args):
+        metric = self.metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self.metrics.setdefault(name, cls(name, *args))
+        return metric
+
+
+    def counter(self, name: str, description: str = "") -> Counter:
+        return self._get(Counter, name, description)
+
+
+    def gauge(self, name: str, description: str = "") -> Gauge:
+        return self._get(Gauge, name, description)
+
+
+    def histogram(self, name: str, description: str = "", buckets: list[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, description, buckets)
+
+
+    def drain(self) -> dict:
+        """
+        The state of every metric, counters and histograms start over from zero
+        """
+        return {name: (metric.kind, metric.description, getattr(metric, "buckets", None), metric.drain()) for name, metric in self._items()}
+
+
+    def merge(self, drained: dict):
+        """
+        Adds the drained metrics of another process
+        """
+        for name, (kind, description, buckets, state) in drained.items():
+            match kind:
+                case "counter":
+                    metric = self.counter(name, description)
+                case "gauge":
+                    metric = self.gauge(name, description)
+                case "histogram":
+                    metric = self.histogram(name, description, buckets)
+            metric.merge(state)
+
+
+    def _items(self) -> list:
+        # Other threads add metrics on first use, iterate over a copy
+        with self._lock:
+            return sorted(self.metrics.items())
+
+
+    def snapshot(self) -> dict:
+        return {"time": time.time(), "metrics": {name: metric.snapshot() for name, metric in self._items()}}
+
+
+    def prometheus(self) -> str:
+        lines = []
+        for name, metric in self._items():
+            lines.append(f"# HELP {name} {metric.description}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.prometheus())
+        return "\n".join(lines) + "\n"
+
+
+    def write(self):
+        """
+        Appends a snapshot to the JSON-lines file and replaces the Prometheus file
+        """
+        for path in [self.jsonl_path, self.prometheus_path]:
+            directory = os.path.dirname(path)
+            if path and directory:
+                os.makedirs(directory, exist_ok=True)
+
+        if self.jsonl_path:
+            with open(self.jsonl_path, "a") as f:
+                f.write(json.dumps(self.snapshot()) + "\n")
+        if self.prometheus_path:
+            # Written next to it and renamed, scrapers never read half a file
+            temporary = f"{self.prometheus_path}.tmp"
+            with open(temporary, "w") as f:
+                f.write(self.prometheus())
+            os.replace(temporary, self.prometheus_path)
+
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="checkmatrix-metrics", daemon=True)
+        self._thread.start()
+
+
+    def close(self):
+        """
+        Stops the writer thread and writes a last time
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.write()
+
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e:
+                get_logger().error(f"An error occurred while writing metrics: {e}")
+
+
+class NullRegistry:
+    """
+    The registry when metrics are disabled, every metric is NULL_METRIC
+    """
+    enabled = False
+
+    def counter(self, name: str, description: str = "") -> NullMetric:
+        return NULL_METRIC
+
+
+    def gauge(self, name: str, description: str = "") -> NullMetric:
+        return NULL_METRIC
+
+
+    def histogram(self, name: str, description: str = "", buckets: list[float] = None) -> NullMetric:
+        return NULL_METRIC
+
+
+NULL_REGISTRY = NullRegistry()
+
+
+def get_metrics() -> Registry:
+    """
+    Returns the registry of this process, or NULL_REGISTRY when metrics are disabled
+
+    Hot paths fetch their metrics once and skip timing work unless the registry is enabled.
+    """
+    global _registry
+    if _registry is None or (_registry.enabled and _registry.pid != os.getpid()):
+        # A forked process starts with an empty registry of its own
+        _registry = Registry() if load_config().metrics.enabled else NULL_REGISTRY
+    return _registry
+
+
+def start_metrics():
+    """
+    Starts writing the metrics of the main process, if they are enabled
+    """
+    metrics = get_metrics()
+    if metrics.enabled:
+        metrics.start()
+
+
+def collect_metrics() -> dict:
+    """
+    The drained metrics of a worker process, None when metrics are disabled
+    """
+    metrics = get_metrics()
+    return metrics.drain() if metrics.enabled else None
+
+
+def merge_metrics(drained: dict):
+    if drained:
+        get_metrics().merge(drained)
+
+
+def shutdown_metrics():
+    global _registry
+    if _registry is not None and _registry.enabled and _registry.pid == os.getpid():
+        _registry.close()
+    _registry = None
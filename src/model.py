@@ -1,8 +1,12 @@
 import torch.nn as nn
 import torch
 import math
+import os
+import time
 from logger import get_logger
-from config import load_config
+from metrics import get_metrics
+from config import Architecture, ModelProfile, Precision, load_config
+from replay_buffer import ReplayBuffer
 
 
 
@@ -42,32 +46,116 @@ class PositionalEncoding(nn.Module):
         self.register_buffer("pe", pe)
 
     def forward(self, x):
-        x = x + self.pe[:x.size(0), :]
+        # x is [batch_size, 64, d_model], every square gets its own encoding
+        x = x + self.pe[:x.size(1), :].transpose(0, 1)
         return self.dropout(x)
-    
+
+
+class CheckMatrixCNN(nn.Module):
+    """
+    Residual convolutions over the 8 planes, a much cheaper evaluator than the transformer
+    """
+
+    def __init__(self, channels=64, blocks=4):
+        super(CheckMatrixCNN, self).__init__()
+        self.stem = nn.Conv2d(8, channels, 3, padding=1)
+        self.blocks = nn.ModuleList([ResidualBlock(channels) for _ in range(blocks)])
+        self.head = nn.Conv2d(channels, 1, 1)
+        self.decoder = nn.Sequential(nn.Linear(64, 64), nn.ReLU(), nn.Linear(64, 1))
+
+    def forward(self, x):
+        x = torch.relu(self.stem(x)) # [batch_size, channels, 8, 8]
+        for block in self.blocks:
+            x = block(x)
+        x = self.head(x).flatten(1) # [batch_size, 64]
+        return torch.tanh(self.decoder(x))
+
+
+class ResidualBlock(nn.Module):
+    def __init__(self, channels):
+        super(ResidualBlock, self).__init__()
+        self.conv1 = nn.Conv2d(channels, channels, 3, padding=1)
+        self.conv2 = nn.Conv2d(channels, channels, 3, padding=1)
+
+    def forward(self, x):
+        return torch.relu(x + self.conv2(torch.relu(self.conv1(x))))
+
+
+# Constructor arguments of every size
+PROFILES = {
+    Architecture.TRANSFORMER: {
+        ModelProfile.FULL: dict(num_layers=4, d_model=512, nhead=8, dim_feedforward=2048),
+        ModelProfile.SMALL: dict(num_layers=2, d_model=128, nhead=4, dim_feedforward=512),
+        ModelProfile.TINY: dict(num_layers=1, d_model=32, nhead=4, dim_feedforward=64),
+    },
+    Architecture.CNN: {
+        ModelProfile.FULL: dict(channels=128, blocks=6),
+        ModelProfile.SMALL: dict(channels=64, blocks=4),
+        ModelProfile.TINY: dict(channels=32, blocks=2),
+    },
+}
+
+
+def create_model(architecture: Architecture = Architecture.TRANSFORMER, profile: ModelProfile = ModelProfile.FULL) -> nn.Module:
+    model_class = CheckMatrixModel if architecture == Architecture.TRANSFORMER else CheckMatrixCNN
+    return model_class(**PROFILES[architecture][profile])
+
+
+def load_student(device) -> nn.Module:
+    """
+    Returns the distilled student in eval mode, or None if there is none
+    """
+    config = load_config().model.student
+    if not config.path or not os.path.exists(config.path):
+        return None
+
+    student = create_model(config.architecture, config.profile)
+    student.load_state_dict(torch.load(config.path, map_location="cpu"))
+    get_logger().info(f"Loaded student {config.architecture.value}/{config.profile.value} from {config.path}")
+    return student.to(device).eval()
+
 
 def train_model(
         model: CheckMatrixModel,
-        training_data: list[tuple[torch.Tensor, int]],
+        replay_buffer: ReplayBuffer,
         optimizer: torch.optim.Optimizer,
         criterion: torch.nn.Module,
-        device: torch.device
+        device: torch.device,
+        batches: int = None
     ):
+    """
+    Trains on shuffled mini-batches sampled from the replay buffer, returns the mean loss
+    """
     config = load_config().model
+    batches = batches or config.training.batches
+    if config.training.precision == Precision.INT8:
+        raise ValueError("int8 is an inference precision, train in float32 or bfloat16")
+    autocast = config.training.precision == Precision.BFLOAT16
     get_logger().debug("Training model")
+    metrics = get_metrics()
+    step_time = metrics.histogram("checkmatrix_training_step_seconds", "Seconds per training step")
 
     model.train()
-    for board_tensor, outcome in training_data:
+    total_loss = 0.0
+    for _ in range(batches):
+        start_time = time.perf_counter() if metrics.enabled else 0
+        indices = replay_buffer.sample(config.training.batch_size)
+        states, targets = replay_buffer.batch(indices)
+        states, targets = states.to(device), targets.to(device)
+
         optimizer.zero_grad()
-        board_tensor = board_tensor.to(device)  # move tensor to device
-        prediction = model(board_tensor)
-        outcome_tensor = torch.tensor([[outcome]], dtype=torch.float32).to(device)  # move tensor to device
-        loss = criterion(prediction, outcome_tensor)
+        with torch.autocast(torch.device(device).type, torch.bfloat16, enabled=autocast):
+            prediction = model(states).float()
+            loss = criterion(prediction, targets)
         loss.backward()
-        get_logger().debug(f"Loss: {loss.item()}")
         optimizer.step()
-        model.zero_grad()
 
-        torch.save(model.state_dict(), config.path)
+        replay_buffer.update_priorities(indices, (prediction.detach() - targets).abs().squeeze(1).cpu())
+        total_loss += loss.item()
+        if metrics.enabled:
+            step_time.observe(time.perf_counter() - start_time)
 
-    get_logger().debug("Finished training model")
+    metrics.counter("checkmatrix_training_steps_total", "Training steps").inc(batches)
+    metrics.gauge("checkmatrix_training_loss", "Mean loss of the last training").set(total_loss / batches)
+    get_logger().debug("Finished training model, loss: %s", total_loss / batches)
+    return total_loss / batches
@@ -0,0 +1,109 @@
+import queue
+import threading
+import time
+import torch.nn as nn
+import torch.optim as optim
+from concurrent.futures import ThreadPoolExecutor
+from checkpoint import CheckpointManager
+from config import Device, Opponent, SearchMode, load_config
+from evaluator import get_evaluator
+from game import Stockfish, refresh_inference, self_play
+from logger import get_logger
+from model import CheckMatrixModel, train_model
+from position_store import PositionStore
+from replay_buffer import ReplayBuffer
+
+
+
+def play_games(
+        model: CheckMatrixModel,
+        optimizer: optim.Optimizer,
+        criterion: nn.Module,
+        device: Device,
+        mcts_iterations: int,
+        num_workers: int,
+        opponent = Opponent.SELF,
+        stockfish: Stockfish = None,
+        replay_buffer: ReplayBuffer = None,
+        checkpoints: CheckpointManager = None,
+        position_store: PositionStore = None,
+        concurrent_games: int = None,
+        games: int = -1
+    ) -> list[str]:
+    """
+    Plays concurrent_games games at once until the given number of games is played (-1 for
+    no limit), returns the results
+
+    Every game runs in its own thread and searches in this process with the shared tree
+    search, so the leaf evaluations of all games are batched by the one BatchEvaluator.
+    Positions are trained on in this thread, at the cadence of play_game.
+    """
+    config = load_config().model
+    concurrent_games = concurrent_games or config.self_play.concurrent_games
+    if opponent == Opponent.USER and concurrent_games > 1:
+        raise ValueError("Games against the user can not be played concurrently")
+
+    replay_buffer = replay_buffer if replay_buffer is not None else ReplayBuffer()
+    evaluator = get_evaluator(model, device)  # Started here, the game threads all use it
+    events = queue.Queue()
+    stop_event = threading.Event()
+
+    def play(number: int):
+        try:
+            game = self_play(model, device, mcts_iterations, num_workers, opponent, stockfish, SearchMode.TREE)
+            while not stop_event.is_set():
+                try:
+                    board, state, reward = next(game)
+                except StopIteration as stop:
+                    events.put(("result", number, stop.value))
+                    return
+                events.put(("move", number, (board, state, reward)))
+        except Exception as e:
+            events.put(("error", number, e))
+
+    results = []
+    started, running = 0, 0
+    start_times = {}
+    played = {}  # Boards and rewards of the running games
+    positions, batches = evaluator.positions, evaluator.batches
+    with ThreadPoolExecutor(concurrent_games, thread_name_prefix="checkmatrix-game") as executor:
+        try:
+            while True:
+                while running < concurrent_games and (games == -1 or started < games):
+                    started += 1
+                    running += 1
+                    start_times[started] = time.time()
+                    played[started] = ([], [])
+                    executor.submit(play, started)
+                if running == 0:
+                    break
+
+                event, number, value = events.get()
+                if event == "error":
+                    raise value
+                boards, rewards = played[number]
+                if event == "result":
+                    running -= 1
+                    results.append(value)
+                    if position_store is not None:
+                        position_store.append_game(boards, rewards, value)
+                    del played[number]
+                    print(f"Game {number}, Result: {value}")
+                    get_logger().info(f"Game {number}, Result: {value}, Duration: {time.time() - start_times.pop(number)}")
+                    continue
+
+                board, state, reward = value
+                boards.append(board)
+                rewards.append(reward)
+                replay_buffer.add(state, reward)
+                if len(replay_buffer) >= config.training.min_samples and replay_buffer.added % config.training.train_every == 0:
+                    train_model(model, replay_buffer, optimizer, criterion, device)
+                    refresh_inference()
+                    if checkpoints is not None:
+                        checkpoints.step()
+        finally:
+            stop_event.set()  # Unfinished games stop after their current move
+
+    positions, batches = evaluator.positions - positions, evaluator.batches - batches
+    get_logger().info(f"{len(results)} games, {positions} evaluations in {batches} batches ({positions / batches if batches else 0:.1f} per batch)")
+    return results
@@ -0,0 +1,180 @@
+import os
+import random
+import chess
+import numpy as np
+import torch
+from board import PIECE_TYPES, encode_boards
+from config import load_config
+
+
+
+MAGIC = b"CMPOS001"
+HEADER_SIZE = 16  # Magic and record size, padded
+
+# One position, 64 bytes against 2 KB for its 8x8x8 float32 encoding
+RECORD = np.dtype([
+    ("pieces", "<u8", (6,)),  # Masks in PIECE_TYPES order, both colors
+    ("white", "<u8"),  # White pieces, the other pieces are black
+    ("turn", "u1"),
+    ("castling", "u1"),  # Bits: white king side, white queen side, black king side, black queen side
+    ("ep_square", "i1"),  # -1 for none
+    ("result", "i1"),  # From white's side: 1 win, 0 draw, -1 loss, RESULT_UNKNOWN
+    ("reward", "<f4"),
+])
+
+RESULT_UNKNOWN = -128
+RESULTS = {"1-0": 1, "0-1": -1, "1/2-1/2": 0}
+CASTLING_SQUARES = [chess.BB_H1, chess.BB_A1, chess.BB_H8, chess.BB_A8]
+
+
+def pack_positions(boards: list[chess.Board], rewards: list[float], result: str = "*") -> np.ndarray:
+    """
+    Packs boards into records, result is the game result ("1-0", "0-1", "1/2-1/2" or "*")
+    """
+    records = np.zeros(len(boards), dtype=RECORD)
+    records["pieces"] = [[board.pieces_mask(piece_type, chess.WHITE) | board.pieces_mask(piece_type, chess.BLACK) for piece_type in PIECE_TYPES] for board in boards]
+    records["white"] = [board.occupied_co[chess.WHITE] for board in boards]
+    records["turn"] = [board.turn for board in boards]
+    records["castling"] = [sum(1 << i for i, square in enumerate(CASTLING_SQUARES) if board.castling_rights & square) for board in boards]
+    records["ep_square"] = [board.ep_square if board.ep_square is not None else -1 for board in boards]
+    records["result"] = RESULTS.get(result, RESULT_UNKNOWN)
+    records["reward"] = rewards
+    return records
+
+
+def unpack_boards(records: np.ndarray) -> list[chess.Board]:
+    boards = []
+    for pieces, white, turn, castling, ep_square in zip(
+            records["pieces"].tolist(), records["white"].tolist(), records["turn"].tolist(), records["castling"].tolist(), records["ep_square"].tolist()):
+        board = chess.Board(None)
+        board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings = (pieces[PIECE_TYPES.index(piece_type)] for piece_type in chess.PIECE_TYPES)
+        board.occupied = board.pawns | board.knights | board.bishops | board.rooks | board.queens | board.kings
+        board.occupied_co[chess.WHITE] = white
+        board.occupied_co[chess.BLACK] = board.occupied & ~white
+        board.turn = bool(turn)
+        board.castling_rights = sum(square for i, square in enumerate(CASTLING_SQUARES) if castling & 1 << i)
+        board.ep_square = ep_square if ep_square >= 0 else None
+        boards.append(board)
+    return boards
+
+
+def encode_records(records: np.ndarray, out: torch.Tensor = None) -> torch.Tensor:
+    """
+    Encodes records into a Nx8x8x8 float32 tensor, like encode_boards does for boards
+    """
+    return encode_boards(unpack_boards(records), out)
+
+
+class PositionStore:
+    """
+    Append-only file of packed positions
+
+    The file is a 16 byte header followed by fixed width records (see RECORD), so it can
+    be memory-mapped and sliced without reading it. A record cut short by a crash is
+    ignored, and overwritten by the next append.
+    """
+
+    def __init__(self, path: str = None) -> None:
+        self.path = path or load_config().model.training.position_store
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < HEADER_SIZE:
+            with open(self.path, "wb") as f:
+                f.write(MAGIC + RECORD.itemsize.to_bytes(4, "little") + bytes(HEADER_SIZE - len(MAGIC) - 4))
+        else:
+            with open(self.path, "rb") as f:
+                header = f.read(HEADER_SIZE)
+            if header[:len(MAGIC)] != MAGIC or int.from_bytes(header[len(MAGIC):len(MAGIC) + 4], "little") != RECORD.itemsize:
+                raise ValueError(f"{self.path} is not a position store of this version")
+
+        self._records = None
+
+
+    def __len__(self) -> int:
+        return (os.path.getsize(self.path) - HEADER_SIZE) // RECORD.itemsize
+
+
+    def append(self, records: np.ndarray):
+        with open(self.path, "r+b") as f:
+            f.seek(HEADER_SIZE + len(self) * RECORD.itemsize)
+            f.write(records.astype(RECORD, copy=False).tobytes())
+            f.truncate()
+        self._records = None
+
+
+    def append_game(self, boards: list[chess.Board], rewards: list[float], result: str):
+        self.append(pack_positions(boards, rewards, result))
+
+
+    def truncate(self, count: int):
+        """
+        Drops the records after the first count
+        """
+        with open(self.path, "r+b") as f:
+            f.truncate(HEADER_SIZE + min(count, len(self)) * RECORD.itemsize)
+        self._records = None
+
+
+    @property
+    def records(self) -> np.ndarray:
+        """
+        Memory-mapped records, read only
+        """
+        count = len(self)
+        if self._records is None or len(self._records) != count:
+            self._records = np.memmap(self.path, dtype=RECORD, mode="r", offset=HEADER_SIZE, shape=(count,)) if count else np.zeros(0, dtype=RECORD)
+        return self._records
+
+
+class PositionDataset(torch.utils.data.IterableDataset):
+    """
+    Streams shuffled batches of (states, targets) from a position store
+
+    The records are read in chunks of chunk_size in random order and shuffled within each
+    chunk, only the chunk being decoded is in memory. With several DataLoader workers
+    every worker takes its own share of the chunks. The target is the stored reward or
+    the game result (positions of unfinished games are skipped), as a Nx1 tensor. Use it
+    with DataLoader(dataset, batch_size=None), batches are already formed. start and stop
+    limit it to a range of the records, e.g. to hold some out.
+    """
+
+    def __init__(self, path: str, batch_size: int = 256, target: str = "reward", shuffle: bool = True, chunk_size: int = 65536, seed: int = None, start: int = 0, stop: int = None) -> None:
+        if target not in ["reward", "result"]:
+            raise ValueError(f"Unknown target: {target}")
+        self.path = path
+        self.batch_size = batch_size
+        self.target = target
+        self.shuffle = shuffle
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.start = start
+        self.stop = stop
+        self.epoch = 0
+
+
+    def __iter__(self):
+        records = PositionStore(self.path).records[self.start:self.stop]
+        starts = list(range(0, len(records), self.chunk_size))
+
+        worker = torch.utils.data.get_worker_info()
+        if worker is not None:
+            starts = starts[worker.id::worker.num_workers]
+
+        rng = random.Random(None if self.seed is None else self.seed + self.epoch)
+        self.epoch += 1
+        if self.shuffle:
+            rng.shuffle(starts)
+
+        for start in starts:
+            chunk = np.array(records[start:start + self.chunk_size])  # Copied out of the map
+            if self.target == "result":
+                chunk = chunk[chunk["result"] != RESULT_UNKNOWN]
+            if self.shuffle:
+                chunk = chunk[np.random.default_rng(rng.getrandbits(64)).permutation(len(chunk))]
+
+            for batch_start in range(0, len(chunk), self.batch_size):
+                batch = chunk[batch_start:batch_start + self.batch_size]
+                targets = torch.from_numpy(batch[self.target].astype(np.float32)).unsqueeze(1)
+                yield encode_records(batch), targets
@@ -0,0 +1,104 @@
+import heapq
+import torch
+from config import Eviction, Sampling, load_config
+
+
+
+class ReplayBuffer:
+    """
+    Fixed capacity store of (board state, target) pairs for training
+
+    States and targets live in tensors allocated once. When the buffer is full a new sample
+    replaces the oldest one (fifo) or the one with the lowest priority (prioritized). The
+    priority of a sample is its last training loss, new samples get the highest priority
+    seen so they are trained on before they can be evicted. The lowest priority is found
+    with a min-heap of (priority, slot), entries that no longer match the slot's priority
+    are skipped and the heap is rebuilt once they make up half of it.
+
+    Samples are drawn without replacement, uniformly or weighted by recency, each weight
+    halving every recency_half_life samples added after it.
+    """
+
+    def __init__(self, capacity: int = None, eviction: Eviction = None, sampling: Sampling = None, recency_half_life: int = None, state_shape=(8, 8, 8)) -> None:
+        config = load_config().model.training.replay_buffer
+        self.capacity = capacity or config.capacity
+        self.eviction = eviction or config.eviction
+        self.sampling = sampling or config.sampling
+        self.recency_half_life = recency_half_life or config.recency_half_life
+
+        self.states = torch.zeros((self.capacity, *state_shape), dtype=torch.float32)
+        self.targets = torch.zeros(self.capacity, dtype=torch.float32)
+        self.priorities = torch.zeros(self.capacity, dtype=torch.float32)
+        self.added_at = torch.zeros(self.capacity, dtype=torch.int64)  # Value of added when the sample was stored
+        self.size = 0
+        self.added = 0
+        self.max_priority = 1.0
+        self._heap = []  # (priority, slot), prioritized eviction only
+
+
+    def __len__(self) -> int:
+        return self.size
+
+
+    def _slot(self) -> int:
+        if self.size < self.capacity:
+            self.size += 1
+            return self.size - 1
+        if self.eviction == Eviction.PRIORITIZED:
+            while True:
+                priority, slot = heapq.heappop(self._heap)
+                if priority == float(self.priorities[slot]):
+                    return slot
+        return self.added % self.capacity  # Slots fill in order, so this is the oldest
+
+
+    def add(self, state: torch.Tensor, target: float):
+        """
+        Stores one sample, state may have a leading batch dimension of 1
+        """
+        slot = self._slot()
+        self.states[slot] = state.reshape(self.states.shape[1:])
+        self.targets[slot] = target
+        self.priorities[slot] = self.max_priority
+        self.added_at[slot] = self.added
+        self.added += 1
+        if self.eviction == Eviction.PRIORITIZED:
+            self._push([slot])
+
+
+    def add_many(self, states: torch.Tensor, targets: list[float]):
+        for state, target in zip(states, targets):
+            self.add(state, target)
+
+
+    def sample(self, batch_size: int) -> torch.Tensor:
+        """
+        Returns the slots of a shuffled batch, at most the buffer size
+        """
+        batch_size = min(batch_size, self.size)
+        if self.sampling == Sampling.RECENCY:
+            age = (self.added - 1 - self.added_at[:self.size]).double()
+            weights = torch.pow(0.5, age / self.recency_half_life)
+            return torch.multinomial(weights, batch_size, replacement=False)
+        return torch.randperm(self.size)[:batch_size]
+
+
+    def batch(self, indices: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+        return self.states[indices], self.targets[indices].unsqueeze(1)
+
+
+    def update_priorities(self, indices: torch.Tensor, losses: torch.Tensor):
+        self.priorities[indices] = losses.to(torch.float32)
+        self.max_priority = max(self.max_priority, float(losses.max()))
+        if self.eviction == Eviction.PRIORITIZED:
+            self._push(indices.tolist())
+
+
+    def _push(self, slots: list[int]):
+        if len(self._heap) + len(slots) > 2 * self.capacity:
+            # Mostly outdated entries, start over from the current priorities
+            self._heap = list(zip(self.priorities[:self.size].tolist(), range(self.size)))
+            heapq.heapify(self._heap)
+            return
+        for priority, slot in zip(self.priorities[slots].tolist(), slots):
+            heapq.heappush(self._heap, (priority, slot))
@@ -1,47 +1,74 @@
 import chess
+import numpy as np
+from board import attack_mask
 from constants import PIECE_VALUES
 
 
 
-def calculate_control(board: chess.Board):
+CENTER_SQUARES = chess.BB_E4 | chess.BB_D4 | chess.BB_E5 | chess.BB_D5
+
+ACTIVITY_VALUES = {chess.PAWN: 0.1, chess.KNIGHT: 0.3, chess.BISHOP: 0.3, chess.ROOK: 0.5, chess.QUEEN: 0.9, chess.KING: 0}
+
+
+def _king_safety_tables():
     """
-    Calculate the control of the center squares for both players on a given chess board.
+    Squares around the king and the lines from it, per king square
+
+    These follow the original square arithmetic (square + i + 8 * j, square += direction),
+    which wraps around the board edges, so the scores stay the same.
     """
-    control = 0
-    center_squares = [chess.E4, chess.D4, chess.E5, chess.D5]
+    neighbours = []
+    lines = []
+    for king_square in chess.SQUARES:
+        mask = 0
+        for i in range(-1, 2):
+            for j in range(-1, 2):
+                square = king_square + i + 8 * j
+                if (i != 0 or j != 0) and 0 <= square < 64:
+                    mask |= chess.BB_SQUARES[square]
+        neighbours.append(mask)
+
+        square_lines = []
+        for direction in [8, -8, -1, 1]:
+            mask = 0
+            square = king_square + direction
+            while 0 <= square < 64:
+                mask |= chess.BB_SQUARES[square]
+                square += direction
+            square_lines.append((mask, direction > 0))
+        lines.append(square_lines)
+
+    return neighbours, lines
 
-    for square in chess.SQUARES:
-        if board.is_attacked_by(chess.WHITE, square):
-            control += 1 if square in center_squares else 0.5
-        if board.is_attacked_by(chess.BLACK, square):
-            control -= 1 if square in center_squares else 0.5
 
-    return control
+KING_NEIGHBOURS, KING_LINES = _king_safety_tables()
 
 
-def calculate_piece_activity(board: chess.Board):
+def calculate_control(board: chess.Board):
     """
-    Calculate the activity of all pieces on a given chess board.
+    Calculate the control of the center squares for both players on a given chess board.
     """
-    activity_score = 0
+    white, black = attack_mask(board, chess.WHITE), attack_mask(board, chess.BLACK)
+    return (
+        chess.popcount(white & CENTER_SQUARES) + 0.5 * chess.popcount(white & ~CENTER_SQUARES)
+        - chess.popcount(black & CENTER_SQUARES) - 0.5 * chess.popcount(black & ~CENTER_SQUARES)
+    )
 
-    for square in chess.SQUARES:
-        piece = board.piece_at(square)
-        if piece:
-            value = 0
-            if piece.piece_type == chess.PAWN:
-                value = 0.1
-            elif piece.piece_type in [chess.KNIGHT, chess.BISHOP]:
-                value = 0.3
-            elif piece.piece_type == chess.ROOK:
-                value = 0.5
-            elif piece.piece_type == chess.QUEEN:
-                value = 0.9
 
-            legal_moves_count = sum(1 for move in board.legal_moves if move.from_square == square)
-            activity_score += value * legal_moves_count
+def calculate_piece_activity(board: chess.Board, legal_moves: list[chess.Move] = None):
+    """
+    Calculate the activity of all pieces on a given chess board.
+    Only the side to move has legal moves, so only its pieces count.
+    """
+    if legal_moves is None:
+        legal_moves = list(board.generate_legal_moves())
+
+    moves_per_square = np.bincount([move.from_square for move in legal_moves], minlength=64)
+    activity_score = 0
+    for square in np.flatnonzero(moves_per_square):
+        activity_score += ACTIVITY_VALUES[board.piece_type_at(square)] * moves_per_square[square]
 
-    return activity_score
+    return float(activity_score)
 
 
 def calculate_king_safety(board: chess.Board, color: chess.Color):
@@ -49,32 +76,18 @@ def calculate_king_safety(board: chess.Board, color: chess.Color):
     Calculate the safety of the king for a given color on a given chess board.
     """
     king_square = board.king(color)
-    
-    # Basic factors contributing to king's safety
-    safety_score = 0
-
-    # Check the number of friendly pieces around the king
-    friendly_pieces_around = 0
-    for i in range(-1, 2):
-        for j in range(-1, 2):
-            if i == 0 and j == 0:
-                continue
-            square = king_square + i + 8 * j
-            if square in range(64) and board.color_at(square) == color:
-                friendly_pieces_around += 1
+    friendly = board.occupied_co[color]
 
     # Add points for each friendly piece surrounding the king
-    safety_score += friendly_pieces_around * 10
-
-    # Deduct points for open lines towards the king (e.g., no pawns in front)
-    for direction in [8, -8, -1, 1]:  # up, down, left, right
-        square = king_square + direction
-        while square in range(64):
-            if board.piece_at(square):
-                if board.color_at(square) != color:
-                    safety_score -= 5
-                break
-            square += direction
+    safety_score = chess.popcount(KING_NEIGHBOURS[king_square] & friendly) * 10
+
+    # Deduct points for open lines towards the king, when the first piece on them is an enemy
+    for line, increasing in KING_LINES[king_square]:
+        blockers = line & board.occupied
+        if blockers:
+            square = chess.lsb(blockers) if increasing else chess.msb(blockers)
+            if not friendly & chess.BB_SQUARES[square]:
+                safety_score -= 5
 
     return safety_score
 
@@ -83,71 +96,81 @@ def calculate_pawn_structure_score(board: chess.Board, color: chess.Color):
     """
     Calculate a score for the pawn structure for a given color on a chess board.
     """
-    pawn_structure_score = 0
+    pawns = board.pieces_mask(chess.PAWN, color)
+    opponent_pawns = board.pieces_mask(chess.PAWN, not color)
+    pawn_count = chess.popcount(pawns)
 
-    # Iterate over all squares and evaluate pawns
-    for square in range(64):
-        piece = board.piece_at(square)
-        if piece and piece.piece_type == chess.PAWN and piece.color == color:
-            pawn_structure_score += evaluate_pawn_position(board, square)
+    pawn_structure_score = 0
+    for square in chess.scan_forward(pawns):
+        pawn_structure_score += evaluate_pawn_position(square, pawn_count, opponent_pawns)
 
     return pawn_structure_score
 
 
-def evaluate_pawn_position(board: chess.Board, square: chess.Square):
+def evaluate_pawn_position(square: chess.Square, pawn_count: int, opponent_pawns: chess.Bitboard):
     """
     Evaluate the position of a single pawn.
+
+    Files are matched against SquareSet.tolist(), a list of 64 booleans, so file 0 counts
+    the empty squares and file 1 the pawns of that color, other files never match.
     """
     score = 0
     file_index = chess.square_file(square)
     rank_index = chess.square_rank(square)
 
     # Check for doubled pawns
-    if board.pieces(chess.PAWN, board.color_at(square)).tolist().count(file_index) > 1:
+    if (file_index == 0 and 64 - pawn_count > 1) or (file_index == 1 and pawn_count > 1):
         score -= 5
 
-    # Check for isolated pawns
-    isolated = True
-    for adjacent_file in [file_index - 1, file_index + 1]:
-        if 0 <= adjacent_file <= 7:  # Ensure within board limits
-            if board.pieces(chess.PAWN, board.color_at(square)).tolist().count(adjacent_file) > 0:
-                isolated = False
-                break
-    if isolated:
+    # Check for isolated pawns, an adjacent file of 0 or 1 always matches
+    if file_index >= 3:
         score -= 10
 
-    # Check for passed pawns
-    passed = True
-    opponent_color = not board.color_at(square)
-    for rank in range(rank_index + 1, 8):
-        for file in range(8):
-            if file == file_index and board.piece_at(chess.square(file, rank)) and board.piece_at(chess.square(file, rank)).color == opponent_color and board.piece_at(chess.square(file, rank)).piece_type == chess.PAWN:
-                passed = False
-                break
-        if not passed:
-            break
-    if passed:
+    # Check for passed pawns, no opponent pawn on a higher rank of the same file
+    ahead = chess.BB_FILES[file_index] & (chess.BB_ALL << 8 * (rank_index + 1)) & chess.BB_ALL
+    if not opponent_pawns & ahead:
         score += 20
 
     return score
 
 
-def calculate_reward(board: chess.Board):
-    material_balance = sum(PIECE_VALUES[piece.symbol().upper()] for piece in board.piece_map().values())
+def calculate_material(board: chess.Board):
+    """
+    Material of both players added together
+    """
+    material = 0
+    for piece_type in chess.PIECE_TYPES:
+        material += PIECE_VALUES[chess.piece_symbol(piece_type).upper()] * chess.popcount(board.pieces_mask(piece_type, chess.WHITE) | board.pieces_mask(piece_type, chess.BLACK))
+    return material
+
+
+def can_claim_draw(board: chess.Board):
+    # A threefold repetition needs at least 4 reversible plies, skip the expensive check before that
+    return board.can_claim_fifty_moves() or (board.halfmove_clock >= 4 and board.can_claim_threefold_repetition())
+
 
+def calculate_reward(board: chess.Board):
+    # Calculate reward, all terms share one move generation
+    legal_moves = list(board.generate_legal_moves())
+    if not legal_moves:
+        return 1.0 if board.is_check() else 0.0  # Checkmate or stalemate
+    if board.is_insufficient_material() or can_claim_draw(board):
+        return 0.0
+
+    material_balance = calculate_material(board)
     control_balance = calculate_control(board)
-    activity_balance = calculate_piece_activity(board)
+    activity_balance = calculate_piece_activity(board, legal_moves)
     king_safty_balance = calculate_king_safety(board, chess.WHITE) - calculate_king_safety(board, chess.BLACK)
     pawn_structure_balance = calculate_pawn_structure_score(board, chess.WHITE) - calculate_pawn_structure_score(board, chess.BLACK)
 
+    return (material_balance + control_balance + activity_balance + king_safty_balance + pawn_structure_balance) / 39.0
 
-    # Calculate reward
-    reward = 0
-    if board.is_checkmate():
-        reward = 1.0
-    elif board.is_stalemate() or board.is_insufficient_material() or board.can_claim_draw():
-        reward = 0.0
-    else:
-        reward = (material_balance + control_balance + activity_balance + king_safty_balance + pawn_structure_balance) / 39.0
 
-    return reward
+def calculate_rewards(boards: list[chess.Board]) -> np.ndarray:
+    """
+    Rewards of many positions, for labelling datasets
+    """
+    rewards = np.empty(len(boards), dtype=np.float64)
+    for i, board in enumerate(boards):
+        rewards[i] = calculate_reward(board)
+    return rewards
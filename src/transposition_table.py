@@ -1,19 +1,123 @@
-
+import struct
+import numpy as np
+import torch
 
 
 
 class TranspositionTable:
+    """
+    Fixed size table of board evaluations keyed by Zobrist hash
+
+    Entries live in an int64 tensor, in buckets of two slots. Each entry holds the value and
+    the number of times it was looked up, packed into one 64 bit word, plus the key XOR that
+    word. A torn write from another process therefore reads as a miss, not a wrong value.
+    When a bucket is full the entry with the fewest lookups is replaced (visit-preferred).
+
+    After share_memory() the table can be sent to worker processes without copying, they
+    read and write the same entries. Counters are shared as well, but only approximate
+    when several processes update them at once.
+    """
+
+    BUCKET_SIZE = 2
+
     def __init__(self, max_size=100000):
-        self.table = {}
         self.max_size = max_size
+        self.num_buckets = max(max_size // self.BUCKET_SIZE, 1)
+        self.entries = torch.zeros((self.num_buckets * self.BUCKET_SIZE, 2), dtype=torch.int64)
+        self.counters = torch.zeros(4, dtype=torch.int64)  # Hits, misses, stores, collisions
+        self._init_views()
+
+
+    def _init_views(self):
+        self._entries = self.entries.numpy().view(np.uint64)
+        self._counters = self.counters.numpy()
+
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_entries"], state["_counters"]
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_views()
+
+
+    def share_memory(self):
+        self.entries.share_memory_()
+        self.counters.share_memory_()
+        self._init_views()  # The storage moved, the old views are stale
+        return self
+
+
+    def store(self, key: int, value: float):
+        start = (key % self.num_buckets) * self.BUCKET_SIZE
+        entries = self._entries
+
+        replace, visits = None, 0
+        for slot in range(start, start + self.BUCKET_SIZE):
+            check, data = int(entries[slot, 0]), int(entries[slot, 1])
+            if check == 0 and data == 0:
+                replace = slot
+                break
+            if check ^ data == key:
+                replace, visits = slot, data >> 32
+                break
+            if replace is None or data >> 32 <= int(entries[replace, 1]) >> 32:
+                replace = slot
+        else:
+            self._counters[3] += 1
+
+        data = visits << 32 | struct.unpack("<I", struct.pack("<f", value))[0]
+        entries[replace, 0] = key ^ data
+        entries[replace, 1] = data
+        self._counters[2] += 1
+
+
+    def lookup(self, key: int):
+        start = (key % self.num_buckets) * self.BUCKET_SIZE
+        entries = self._entries
+
+        for slot in range(start, start + self.BUCKET_SIZE):
+            check, data = int(entries[slot, 0]), int(entries[slot, 1])
+            if check ^ data == key and (check != 0 or data != 0):
+                if data >> 32 < 0xFFFFFFFF:
+                    data += 1 << 32  # Count the visit
+                entries[slot, 0] = key ^ data
+                entries[slot, 1] = data
+                self._counters[0] += 1
+                return struct.unpack("<f", struct.pack("<I", data & 0xFFFFFFFF))[0]
+
+        self._counters[1] += 1
+        return None
+
+
+    def clear(self):
+        self.entries.zero_()
+        self.counters.zero_()
+
+
+    @property
+    def hits(self) -> int:
+        return int(self._counters[0])
 
+    @property
+    def misses(self) -> int:
+        return int(self._counters[1])
 
-    def store(self, key, value):
-        if len(self.table) >= self.max_size:
-            self.table.pop(next(iter(self.table)))  # Remove the oldest entry
-        
-        self.table[key] = value
+    @property
+    def stores(self) -> int:
+        return int(self._counters[2])
 
+    @property
+    def collisions(self) -> int:
+        """
+        Stores that evicted the entry of another position
+        """
+        return int(self._counters[3])
 
-    def lookup(self, key):
-        return self.table.get(key)
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
@@ -0,0 +1,285 @@
+import argparse
+import os
+import sys
+import threading
+import chess
+import torch
+from config import Device, load_config
+from constants import CONFIG_PATH_ENV_VAR
+from evaluator import shutdown_evaluator
+from game import select_move
+from logger import get_logger, init_logger
+from mcts.limits import SearchLimits, allocate_time
+from mcts.node import MCTSNode
+from mcts.pool import shutdown_pool
+from mcts.search_tree import SearchTree
+from model import CheckMatrixModel, create_model
+
+
+
+ENGINE_NAME = "CheckMatrix"
+ENGINE_AUTHOR = "0x01100101"
+
+
+class UCIEngine:
+    """
+    Plays CheckMatrix over the UCI protocol, one command per call of handle
+
+    Searches run in a background thread, so stop and ponderhit are handled while they
+    run. The search tree is kept across the moves of a game (see SearchTree), so the
+    work on the position after our move and the reply is reused.
+
+    Pondering follows the protocol: after "go ponder" the position with the expected
+    reply (sent as the last move) is searched without limits. On ponderhit the same search
+    continues under the limits of the go command, on stop its move is thrown away and the
+    next search reuses what it can of the tree. The info time and nps after a ponderhit are
+    those since the ponderhit, the time spent on our clock.
+    """
+
+    def __init__(self, model: CheckMatrixModel, device, output = None) -> None:
+        self.config = load_config().model.mcts
+        self.model = model
+        self.device = device
+        self.output = output or (lambda line: print(line, flush=True))
+        self.board = chess.Board()
+        self.tree = SearchTree()
+
+        self.limits: SearchLimits = None
+        self.pondering = False
+        self._ponder_limits = None  # Limits of the go ponder command, applied on ponderhit
+        self._ponderhit = (0.0, 0)  # Seconds and nodes searched at the ponderhit
+        self._thread = None
+
+
+    def handle(self, line: str) -> bool:
+        """
+        Runs a command, returns False on quit
+        """
+        tokens = line.split()
+        if not tokens:
+            return True
+
+        match tokens[0]:
+            case "uci":
+                self.output(f"id name {ENGINE_NAME}")
+                self.output(f"id author {ENGINE_AUTHOR}")
+                self.output("option name Ponder type check default false")
+                self.output("uciok")
+            case "isready":
+                self.output("readyok")
+            case "ucinewgame":
+                self.wait()
+                self.tree = SearchTree()
+            case "position":
+                self.wait()
+                try:
+                    self.board = parse_position(tokens[1:])
+                except ValueError as e:
+                    # The command is ignored, the previous position is kept
+                    get_logger().error(f"Invalid UCI position: {line.strip()}: {e}")
+            case "go":
+                self.wait()
+                try:
+                    options = parse_go(tokens[1:])
+                except ValueError as e:
+                    # A bestmove is still due, search with the configured limits
+                    get_logger().error(f"Invalid UCI go command: {line.strip()}: {e}")
+                    options = {flag: True for flag in ["ponder", "infinite"] if flag in tokens}
+                self.go(options)
+            case "stop":
+                self.pondering = False
+                if self.limits is not None:
+                    self.limits.stop()
+                self.wait()
+            case "ponderhit":
+                self.ponderhit()
+            case "quit":
+                self.close()
+                return False
+            case "setoption" | "debug" | "register":
+                pass
+            case _:
+                get_logger().warning(f"Unknown UCI command: {line}")
+        return True
+
+
+    def go(self, options: dict):
+        limits = self.search_limits(options)
+        self.pondering = "ponder" in options
+        self._ponderhit = (0.0, 0)
+        if self.pondering:
+            # No limits until ponderhit, the opponent's time is ours to use
+            self._ponder_limits = limits
+            limits = SearchLimits(seconds=0, early_stop=False)
+
+        self.limits = limits
+        self._thread = threading.Thread(target=self._search, args=(self.board.copy(), limits), name="checkmatrix-uci-search", daemon=True)
+        self._thread.start()
+
+
+    def search_limits(self, options: dict) -> SearchLimits:
+        """
+        The limits of a go command, the configured ones if it has none
+        """
+        if "infinite" in options:
+            return SearchLimits(seconds=0, early_stop=False)
+
+        seconds = options["movetime"] / 1000 if "movetime" in options else 0
+        remaining = options.get("wtime" if self.board.turn == chess.WHITE else "btime")
+        if remaining is not None and not seconds:
+            increment = options.get("winc" if self.board.turn == chess.WHITE else "binc", 0)
+            seconds = allocate_time(remaining / 1000, increment / 1000, options.get("movestogo", 0))
+
+        nodes = options.get("nodes")
+        if not nodes and not seconds:
+            return SearchLimits(self.config.iterations)
+        return SearchLimits(nodes, seconds)
+
+
+    def ponderhit(self):
+        """
+        The expected reply was played, the ponder search becomes the search of our move
+        """
+        if not self.pondering or self.limits is None:
+            return
+        self.pondering = False
+        self._ponderhit = (self.limits.elapsed, self.limits.nodes_searched)
+        limits = self._ponder_limits  # None of them after go ponder infinite, the search goes on until stop
+        self.limits.restrict(limits.nodes, limits.seconds, limits.early_stop)
+
+
+    def _search(self, board: chess.Board, limits: SearchLimits):
+        move, ponder = None, None
+        try:
+            move = select_move(self.model, board, self.device, limits.nodes, self.config.workers, self.tree, limits=limits)
+            ponder = ponder_move(self.tree, move)
+        except Exception as e:
+            get_logger().error(f"An error occurred during the UCI search: {e}")
+            move = next(iter(board.legal_moves), None)
+
+        pondered_seconds, pondered_nodes = self._ponderhit
+        seconds = limits.elapsed - pondered_seconds
+        nps = (limits.nodes_searched - pondered_nodes) / max(seconds, 1e-6)
+        self.output(f"info nodes {limits.nodes_searched} time {int(seconds * 1000)} nps {int(nps)}")
+        if move is None:
+            self.output("bestmove 0000")
+        elif ponder is not None:
+            self.output(f"bestmove {move.uci()} ponder {ponder.uci()}")
+        else:
+            self.output(f"bestmove {move.uci()}")
+
+
+    def wait(self):
+        """
+        Waits for the running search, a ponder or infinite search is stopped first
+        """
+        if self._thread is None:
+            return
+        if self.pondering or (self.limits.nodes is None and self.limits.seconds is None):
+            self.pondering = False
+            self.limits.stop()
+        self._thread.join()
+        self._thread = None
+
+
+    def close(self):
+        if self.limits is not None:
+            self.limits.stop()
+        self.wait()
+        shutdown_pool()
+        shutdown_evaluator()
+
+
+def parse_position(tokens: list[str]) -> chess.Board:
+    """
+    The board of a position command: "startpos" or "fen <fen>", then "moves <moves>"
+    """
+    moves = tokens.index("moves") if "moves" in tokens else len(tokens)
+    if tokens[:1] == ["startpos"]:
+        board = chess.Board()
+    elif tokens[:1] == ["fen"]:
+        board = chess.Board(" ".join(tokens[1:moves]))
+    else:
+        raise ValueError(f"Invalid position: {' '.join(tokens)}")
+
+    for move in tokens[moves + 1:]:
+        board.push_uci(move)
+    return board
+
+
+def parse_go(tokens: list[str]) -> dict:
+    """
+    The arguments of a go command, flags (ponder, infinite) map to True
+    """
+    options = {}
+    i = 0
+    while i < len(tokens):
+        if tokens[i] in ["ponder", "infinite"]:
+            options[tokens[i]] = True
+        elif tokens[i] == "searchmoves":
+            break  # Not supported, the moves up to the end are skipped
+        elif i + 1 < len(tokens):
+            options[tokens[i]] = int(tokens[i + 1])
+            i += 1
+        i += 1
+    return options
+
+
+def ponder_move(tree: SearchTree, move: chess.Move) -> chess.Move:
+    """
+    The reply expected to move, the most visited one in the tree, otherwise the best one by
+    the evaluations of the replies, or None if the game ends with move
+    """
+    root = MCTSNode(tree.tree)
+    child = next((child for child in root.children if child.move == move), None)
+    if child is None or child.board.is_game_over():
+        return None
+
+    replies = [reply for reply in child.children if reply.visits > 0]
+    if replies:
+        return max(replies, key=lambda reply: reply.visits).move
+
+    # The root mode's main tree ends at the root moves, evaluate the replies
+    sign = 1 if child.board.turn == chess.WHITE else -1  # Values are from white's side
+    replies = child.expand()
+    return max(replies, key=lambda reply: sign * reply.board_value).move if replies else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs CheckMatrix as a UCI engine on stdin and stdout")
+    parser.add_argument("--config", type=str, help="Path to config yaml file", required=False)
+
+    args = parser.parse_args()
+
+
+    if args.config:
+        if not os.path.exists(args.config):
+            raise FileNotFoundError(f"Config file not found: {args.config}")
+
+        os.environ[CONFIG_PATH_ENV_VAR] = args.config
+
+
+    init_logger()  # Logs go to stderr and the log file, stdout is the protocol's
+
+    config = load_config().model
+    device = torch.device("cuda" if torch.cuda.is_available() and config.device != Device.CPU else "cpu")
+    model = create_model(profile=config.profile)
+    if os.path.exists(config.path):
+        model.load_state_dict(torch.load(config.path, map_location="cpu"))
+    else:
+        get_logger().warning(f"Model weights not found: {config.path}, playing with random weights")
+    model = model.to(device).eval()
+
+    engine = UCIEngine(model, device)
+    # Forked MCTS workers close sys.stdin, which waits for the lock of a pending read of it
+    commands = open(sys.stdin.fileno(), "r", closefd=False)
+    try:
+        for line in commands:
+            if not engine.handle(line):
+                break
+    finally:
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
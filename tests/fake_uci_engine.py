@@ -0,0 +1,69 @@
+"""
+Minimal UCI engine for tests, started with the Python interpreter
+
+The score is the material balance from the side to move in centipawns, the best move the
+first legal move. With FAKE_UCI_CRASH_AFTER=n the process exits on its n-th search.
+Tests start it with FAKE_ENGINE and check evaluations against white_material.
+"""
+import os
+import sys
+import chess
+
+
+
+FAKE_ENGINE = [sys.executable, os.path.abspath(__file__)]
+VALUES = {chess.PAWN: 100, chess.KNIGHT: 300, chess.BISHOP: 300, chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0}
+
+
+def material(board: chess.Board) -> int:
+    score = 0
+    for piece in board.piece_map().values():
+        score += VALUES[piece.piece_type] if piece.color == board.turn else -VALUES[piece.piece_type]
+    return score
+
+
+def white_material(board: chess.Board) -> int:
+    """
+    The evaluation of the engine from white's side
+    """
+    return material(board) if board.turn == chess.WHITE else -material(board)
+
+
+def main():
+    board = chess.Board()
+    crash_after = int(os.environ.get("FAKE_UCI_CRASH_AFTER", 0))
+    searches = 0
+
+    for line in sys.stdin:
+        tokens = line.split()
+        if not tokens:
+            continue
+
+        match tokens[0]:
+            case "uci":
+                print("id name FakeEngine")
+                print("option name Threads type spin default 1 min 1 max 64")
+                print("option name Hash type spin default 16 min 1 max 1024")
+                print("uciok")
+            case "isready":
+                print("readyok")
+            case "position":
+                moves = tokens.index("moves") if "moves" in tokens else len(tokens)
+                board = chess.Board() if tokens[1] == "startpos" else chess.Board(" ".join(tokens[2:moves]))
+                for move in tokens[moves + 1:]:
+                    board.push_uci(move)
+            case "go":
+                searches += 1
+                if searches == crash_after:
+                    sys.exit(1)
+                move = next(iter(board.legal_moves), None)
+                print(f"info depth 1 score cp {material(board)} nodes 1 pv {move.uci() if move else ''}".strip())
+                print(f"bestmove {move.uci() if move else '(none)'}")
+            case "quit":
+                return
+
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
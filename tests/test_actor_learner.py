@@ -0,0 +1,83 @@
+import chess
+import pytest
+import torch
+import metrics
+from actor_learner import ActorLearner, refresh_weights
+from config import CutoffEvaluation, SearchMode, load_config
+from metrics import get_metrics, shutdown_metrics
+from model import CheckMatrixModel
+from position_store import PositionStore, pack_positions
+from replay_buffer import ReplayBuffer
+
+
+
+@pytest.fixture
+def learner(monkeypatch):
+    config = load_config().model
+    monkeypatch.setattr(config.mcts, "mode", SearchMode.TREE)
+    monkeypatch.setattr(config.mcts, "iterations", 2)
+    monkeypatch.setattr(config.mcts, "workers", 1)
+    monkeypatch.setattr(config.mcts.rollout, "max_depth", 2)
+    monkeypatch.setattr(config.mcts.rollout, "cutoff", CutoffEvaluation.REWARD)
+    monkeypatch.setattr(config.training, "min_samples", 8)
+    monkeypatch.setattr(config.training, "train_every", 8)
+    monkeypatch.setattr(config.training, "batch_size", 8)
+    monkeypatch.setattr(config.training, "batches", 1)
+    monkeypatch.setattr(config.self_play, "publish_every", 2)
+    monkeypatch.setattr(config.self_play, "max_staleness", 3)
+
+    model = CheckMatrixModel(num_layers=1, d_model=16, nhead=2, dim_feedforward=32)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
+    learner = ActorLearner(model, optimizer, torch.nn.SmoothL1Loss(), torch.device("cpu"), ReplayBuffer(capacity=4096), num_actors=1)
+    yield learner
+    learner.close()
+
+
+def test_stale_positions_are_dropped(learner: ActorLearner, tmp_path):
+    learner.position_store = PositionStore(str(tmp_path / "positions.bin"))
+    learner.steps = 10
+    positions = pack_positions([chess.Board()] * 4, [0, 1, 2, 3], "1-0")
+    learner.consume((0, "1-0", torch.zeros(4, 8, 8, 8), torch.arange(4, dtype=torch.float32), torch.tensor([6, 7, 8, 10]), positions, None))
+
+    assert learner.games == 1 and learner.positions == 3 and learner.dropped == 1
+    assert sorted(learner.replay_buffer.targets[:len(learner.replay_buffer)].tolist()) == [1, 2, 3]
+    assert len(learner.position_store) == 4  # Stale positions are stored anyway
+
+
+def test_publish(learner: ActorLearner):
+    local = CheckMatrixModel(num_layers=1, d_model=16, nhead=2, dim_feedforward=32)
+    version = refresh_weights(local, learner.shared_model, learner.version, learner.lock, -1)
+    assert version == 0
+
+    with torch.no_grad():
+        learner.model.decoder.bias.fill_(0.5)
+    assert refresh_weights(local, learner.shared_model, learner.version, learner.lock, version) == 0  # Not published yet
+
+    learner.steps = 4
+    learner.publish()
+    assert refresh_weights(local, learner.shared_model, learner.version, learner.lock, version) == 4
+    assert torch.all(local.decoder.bias == 0.5)
+
+
+def test_run(learner: ActorLearner):
+    learner.run(games=1)
+
+    assert learner.games == 1
+    assert learner.positions + learner.dropped > 0
+    assert len(learner.replay_buffer) == learner.positions
+    assert learner.actors[0].is_alive()  # Still playing the next game
+
+
+def test_actor_metrics(learner: ActorLearner, monkeypatch, tmp_path):
+    config = load_config()
+    monkeypatch.setattr(config.metrics, "enabled", True)
+    monkeypatch.setattr(config.metrics, "jsonl_path", str(tmp_path / "metrics.jsonl"))
+    monkeypatch.setattr(config.metrics, "prometheus_path", str(tmp_path / "metrics.prom"))
+    monkeypatch.setattr(metrics, "_registry", None)
+    try:
+        learner.run(games=1)  # The actor is started with metrics enabled
+
+        assert get_metrics().counter("checkmatrix_search_nodes_total").value > 0
+        assert get_metrics().histogram("checkmatrix_evaluation_batch_size").count > 0
+    finally:
+        shutdown_metrics()
@@ -0,0 +1,54 @@
+import copy
+import pytest
+from benchmark import Benchmarks, compare, load_positions
+from config import CutoffEvaluation, ModelProfile, SearchMode, load_config
+
+
+
+def test_positions():
+    positions = load_positions()
+    assert len(positions) == 30
+    assert len({position_id for position_id, _ in positions}) == 30
+    assert {position_id.split("/")[0] for position_id, _ in positions} == {"opening", "middlegame", "endgame"}
+    assert all(board.is_valid() and not board.is_game_over() for _, board in positions)
+
+
+def test_run(monkeypatch):
+    config = load_config().model
+    monkeypatch.setattr(config, "profile", ModelProfile.TINY)
+    monkeypatch.setattr(config.mcts, "mode", SearchMode.TREE)
+    monkeypatch.setattr(config.mcts, "workers", 1)
+    monkeypatch.setattr(config.mcts.rollout, "max_depth", 2)
+    monkeypatch.setattr(config.mcts.rollout, "cutoff", CutoffEvaluation.REWARD)
+
+    results = Benchmarks(iterations=4, workers=[1, 2], plies=2, min_time=0.01).run()
+    assert set(results["results"]) == {"encode", "reward", "evaluate_latency", "evaluate_throughput", "search_1_workers", "search_2_workers", "self_play"}
+    assert all(result["value"] > 0 for result in results["results"].values())
+    assert compare(results, results) == []
+
+
+def test_compare():
+    baseline = {
+        "positions_version": 1,
+        "results": {
+            "encode": {"value": 10.0, "unit": "us/position", "higher_is_better": False},
+            "self_play": {"value": 2.0, "unit": "plies/s", "higher_is_better": True},
+        },
+    }
+    results = copy.deepcopy(baseline)
+    results["results"]["encode"]["value"] = 10.5  # Within the threshold
+    results["results"]["self_play"]["value"] = 1.5
+    regressions = compare(results, baseline, threshold=0.1)
+    assert len(regressions) == 1 and regressions[0].startswith("self_play")
+
+    results["results"]["encode"]["value"] = 12.0
+    assert len(compare(results, baseline, threshold=0.1)) == 2
+
+    del results["results"]["self_play"]
+    regressions = compare(results, baseline, threshold=0.1)
+    assert len(regressions) == 2 and "self_play: missing from the results" in regressions
+    assert len(compare(results, baseline, threshold=0.1, only=["encode"])) == 1  # Not run
+
+    results["positions_version"] = 2
+    with pytest.raises(ValueError):
+        compare(results, baseline)
@@ -0,0 +1,51 @@
+import chess
+import random
+import pytest
+import torch
+from board import encode_boards, generate_board_states
+from constants import PIECE_INDICES
+
+
+
+def reference_board_states(board: chess.Board):
+    # Per-square encoding the bitboard encoder has to reproduce exactly
+    states = torch.zeros((1, 8, 8, 8), dtype=torch.float32)
+    for square in chess.SQUARES:
+        piece = board.piece_at(square)
+        if piece:
+            states[0, PIECE_INDICES[piece.symbol().upper()], square // 8, square % 8] = 1 if piece.color == chess.WHITE else -1
+        if board.is_attacked_by(chess.WHITE, square):
+            states[0, 6, square // 8, square % 8] = 1
+        if board.is_attacked_by(chess.BLACK, square):
+            states[0, 7, square // 8, square % 8] = 1
+    return states
+
+
+@pytest.fixture
+def boards():
+    rng = random.Random(0)
+    boards = [chess.Board(), chess.Board("8/P6k/8/8/8/8/6Kp/8 w - - 0 1")]
+    for _ in range(10):
+        board = chess.Board()
+        for _ in range(rng.randint(1, 120)):
+            if board.is_game_over():
+                break
+            board.push(rng.choice(list(board.legal_moves)))
+            boards.append(board.copy())
+    return boards
+
+
+def test_generate_board_states(boards: list[chess.Board]):
+    for board in boards:
+        states = generate_board_states(board)
+        assert states.shape == (1, 8, 8, 8)
+        assert states.numpy().tobytes() == reference_board_states(board).numpy().tobytes()
+
+
+def test_encode_boards_preallocated(boards: list[chess.Board]):
+    out = torch.full((len(boards) + 3, 8, 8, 8), 7.0)
+    result = encode_boards(boards, out=out)
+
+    assert result is out
+    assert torch.equal(out[:len(boards)], torch.cat([reference_board_states(board) for board in boards]))
+    assert torch.all(out[len(boards):] == 7.0)
@@ -0,0 +1,74 @@
+import os
+import torch
+from checkpoint import CheckpointManager
+
+
+
+def make_model():
+    model = torch.nn.Linear(4, 1)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.1)
+    return model, optimizer
+
+
+def train_step(model, optimizer):
+    optimizer.zero_grad()
+    model(torch.randn(8, 4)).pow(2).mean().backward()
+    optimizer.step()
+
+
+def test_interval_and_rotation(tmp_path):
+    model, optimizer = make_model()
+    path = str(tmp_path / "model.pth")
+    checkpoints = CheckpointManager(model, optimizer, path, interval_steps=2, interval_seconds=0, keep=2)
+
+    taken = []
+    for _ in range(7):
+        train_step(model, optimizer)
+        taken.append(checkpoints.step())
+        checkpoints.flush()
+
+    assert taken == [False, True, False, True, False, True, False]
+    assert [os.path.basename(path) for path in checkpoints.versions()] == ["model.4.pth", "model.6.pth"]
+    assert not any(name.endswith(".tmp") for name in os.listdir(tmp_path))
+
+    checkpoints.close()
+    assert [os.path.basename(path) for path in checkpoints.versions()] == ["model.6.pth", "model.7.pth"]
+    weights = torch.load(path)
+    assert all(torch.equal(weights[key], value) for key, value in model.state_dict().items())
+
+
+def test_snapshot_is_a_copy(tmp_path):
+    model, optimizer = make_model()
+    checkpoints = CheckpointManager(model, optimizer, str(tmp_path / "model.pth"), interval_steps=0, interval_seconds=0, keep=1)
+    train_step(model, optimizer)
+    expected = {key: value.clone() for key, value in model.state_dict().items()}
+
+    checkpoints.save()
+    for _ in range(5):
+        train_step(model, optimizer)  # Weights change while the snapshot may still be written
+    checkpoints.flush()
+
+    weights = torch.load(tmp_path / "model.pth")
+    assert all(torch.equal(weights[key], value) for key, value in expected.items())
+    checkpoints.close()
+
+
+def test_restore(tmp_path):
+    model, optimizer = make_model()
+    path = str(tmp_path / "model.pth")
+    checkpoints = CheckpointManager(model, optimizer, path, interval_steps=1, interval_seconds=0, keep=2)
+    for _ in range(3):
+        train_step(model, optimizer)
+        checkpoints.step()
+        checkpoints.flush()
+    checkpoints.close()
+
+    restored_model, restored_optimizer = make_model()
+    restored = CheckpointManager(restored_model, restored_optimizer, path)
+    with open(checkpoints.versions()[-1], "wb") as f:
+        f.write(b"corrupt")  # A damaged newest version falls back to the previous one
+    assert restored.restore()
+    assert restored.steps == 2
+    assert restored_optimizer.state_dict()["state"][0]["step"] == 2
+
+    assert not CheckpointManager(*make_model(), str(tmp_path / "missing.pth")).restore()
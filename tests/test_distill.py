@@ -0,0 +1,59 @@
+import chess
+import pytest
+import torch
+from config import Architecture, ModelProfile
+from distill import distill
+from evaluator import BatchEvaluator
+from inference import InferenceEngine, compare
+from mcts.tree import Tree
+from model import create_model
+from position_store import PositionStore
+from tests.test_position_store import random_boards
+
+
+
+@pytest.mark.parametrize("architecture, profile", [
+    (Architecture.TRANSFORMER, ModelProfile.TINY),
+    (Architecture.CNN, ModelProfile.TINY),
+    (Architecture.CNN, ModelProfile.SMALL),
+])
+def test_profiles(architecture: Architecture, profile: ModelProfile):
+    values = create_model(architecture, profile).eval()(torch.rand(5, 8, 8, 8))
+    assert values.shape == (5, 1)
+    assert torch.all(values.abs() <= 1)
+
+
+def test_distill(tmp_path):
+    torch.manual_seed(0)
+    path = str(tmp_path / "positions.bin")
+    PositionStore(path).append_game(random_boards(600), [0.0] * 600, "*")
+    teacher = create_model(Architecture.TRANSFORMER, ModelProfile.TINY)
+    student = create_model(Architecture.CNN, ModelProfile.TINY)
+
+    states = torch.rand(64, 8, 8, 8)
+    before = compare(InferenceEngine(teacher, "cpu"), InferenceEngine(student, "cpu"), states)
+    report = distill(teacher, student, path, "cpu", steps=60, batch_size=32, learning_rate=0.003, validation_positions=100)
+
+    assert report["positions"] == 100
+    assert report["mae"] < before["mae"]
+    assert report["speedup"] > 0
+
+
+def test_leaf_evaluations():
+    model = create_model(Architecture.TRANSFORMER, ModelProfile.TINY).eval()
+    student = create_model(Architecture.CNN, ModelProfile.TINY).eval()
+    evaluator = BatchEvaluator(model, "cpu", student=student)
+    try:
+        tree = Tree(chess.Board(), evaluator)
+        tree.root_depth = 1
+        board = chess.Board()
+        board.push_uci("e2e4")
+        assert tree.evaluate_board(board) == pytest.approx(InferenceEngine(model, "cpu").evaluate_boards([board])[0], abs=1e-6)
+        assert evaluator.leaf_positions == 0
+
+        board.push_uci("e7e5")
+        assert tree.evaluate_board(board) == pytest.approx(InferenceEngine(student, "cpu").evaluate_boards([board])[0], abs=1e-6)
+        assert evaluator.leaf_positions == 1
+        assert evaluator.positions == 3  # Root, e4 and e5
+    finally:
+        evaluator.close()
@@ -0,0 +1,96 @@
+import multiprocessing
+import random
+import chess
+import chess.engine
+import pytest
+from config import load_config
+from engine_cache import EngineCache
+from tests.fake_uci_engine import FAKE_ENGINE, white_material
+
+
+
+LIMIT = chess.engine.Limit(depth=1)
+
+
+def random_boards(count: int, seed: int = 0) -> list[chess.Board]:
+    rng = random.Random(seed)
+    boards, board = [], chess.Board()
+    while len(boards) < count:
+        if board.is_game_over():
+            board = chess.Board()
+        board.push(rng.choice(list(board.legal_moves)))
+        boards.append(board.copy())
+    return boards
+
+
+def test_lookup_and_store(tmp_path):
+    cache = EngineCache(str(tmp_path / "cache.sqlite"), max_entries=0)
+    boards = random_boards(20)
+    assert cache.lookup_many(boards, LIMIT) == [None] * 20
+
+    cache.store_many(boards[:10], LIMIT, scores=list(range(10)))
+    cache.store_many(boards[:2], LIMIT, moves=[next(iter(board.legal_moves)) for board in boards[:2]])
+    assert cache.lookup_many(boards, LIMIT) == [*range(10), *[None] * 10]  # Storing moves kept the scores
+    assert cache.get_move(boards[0], LIMIT) == next(iter(boards[0].legal_moves))
+    assert cache.get_move(boards[5], LIMIT) is None
+    assert cache.get_score(boards[3], chess.engine.Limit(depth=2)) is None  # Other limits are other entries
+    assert cache.hit_rate == pytest.approx(11 / 43)
+    cache.close()
+
+    reopened = EngineCache(str(tmp_path / "cache.sqlite"))
+    assert reopened.lookup_many(boards[:10], LIMIT) == list(range(10))
+    reopened.close()
+
+
+def test_eviction(tmp_path, monkeypatch):
+    monkeypatch.setattr(EngineCache, "PRUNE_CHECK_INTERVAL", 10)
+    cache = EngineCache(str(tmp_path / "cache.sqlite"), max_entries=50, prune_to=0.8)
+    boards = random_boards(60)
+    cache.store_many(boards[:30], LIMIT, scores=[1] * 30)
+    cache.lookup_many(boards[:5], LIMIT)  # Recently used, they are kept
+    cache.store_many(boards[30:], LIMIT, scores=[2] * 30)
+
+    assert len(cache) == 40 and cache.evicted == 20
+    assert cache.lookup_many(boards[:5], LIMIT) == [1] * 5
+    assert cache.lookup_many(boards[-10:], LIMIT) == [2] * 10
+    cache.close()
+
+
+def store_boards(path: str, seed: int):
+    cache = EngineCache(path)
+    for board in random_boards(100, seed):
+        cache.store_many([board], LIMIT, scores=[seed])
+
+
+def test_processes_share_a_file(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    processes = [multiprocessing.Process(target=store_boards, args=(path, seed)) for seed in range(1, 5)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert all(process.exitcode == 0 for process in processes)
+    cache = EngineCache(path)
+    assert all(score is not None for score in cache.lookup_many(random_boards(100, 3), LIMIT))
+    cache.close()
+
+
+def test_stockfish_cache(tmp_path, monkeypatch):
+    from game import Stockfish
+
+    config = load_config().stockfish
+    monkeypatch.setattr(config, "path", FAKE_ENGINE)
+    monkeypatch.setattr(config, "depth", 1)
+    monkeypatch.setattr(config.cache, "path", str(tmp_path / "cache.sqlite"))
+    boards = random_boards(10)
+
+    stockfish = Stockfish()
+    try:
+        assert stockfish.evaluate_many(boards[:6]) == [white_material(board) for board in boards[:6]]
+        assert stockfish.evaluate_many(boards) == [white_material(board) for board in boards]
+        assert stockfish.get_move(boards[0]) == stockfish.get_move(boards[0])
+        assert stockfish.pool.requests == 10 + 1
+        assert stockfish.cache.hits == 6 + 1
+    finally:
+        stockfish.close()
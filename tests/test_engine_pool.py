@@ -0,0 +1,57 @@
+import asyncio
+import chess
+import chess.engine
+import pytest
+from engine_pool import EnginePool
+from tests.fake_uci_engine import FAKE_ENGINE, white_material
+
+
+
+LIMIT = chess.engine.Limit(depth=1)
+
+
+@pytest.fixture
+def boards():
+    boards = []
+    board = chess.Board()
+    for move in ["e4", "d5", "exd5", "Qxd5", "Nc3", "Qxa2", "Rxa2"]:
+        board.push_san(move)
+        boards.append(board.copy())
+    return boards
+
+
+def test_evaluate_many(boards: list[chess.Board]):
+    pool = EnginePool(FAKE_ENGINE, engines=3, limit=LIMIT, health_check_interval=0)
+    try:
+        assert pool.evaluate_many(boards) == [white_material(board) for board in boards]
+        assert pool.get_evaluation(boards[-1]) == white_material(boards[-1])
+        assert pool.get_move(boards[0]) in boards[0].legal_moves
+        assert pool.requests == len(boards) + 2 and pool.restarts == 0
+        assert all(engine.config["Hash"] == 16 for engine in pool._engines)
+    finally:
+        pool.close()
+
+
+def test_restart(boards: list[chess.Board], monkeypatch):
+    monkeypatch.setenv("FAKE_UCI_CRASH_AFTER", "3")
+    pool = EnginePool(FAKE_ENGINE, engines=1, limit=LIMIT, health_check_interval=0, retries=1)
+    try:
+        # The third search crashes the engine, it is restarted and the search retried
+        assert pool.evaluate_many(boards[:4]) == [white_material(board) for board in boards[:4]]
+        assert pool.failures == 1 and pool.restarts == 1
+    finally:
+        pool.close()
+
+
+def test_health_check():
+    pool = EnginePool(FAKE_ENGINE, engines=1, limit=LIMIT, health_check_interval=0.1)
+    try:
+        engine = pool._engines[0]
+        pool._transports[0].kill()
+        pool._call(asyncio.sleep(0.5))
+        assert engine.returncode.done()
+        assert pool.restarts == 1
+        assert pool._engines[0] is not engine and not pool._engines[0].returncode.done()
+        assert pool.get_evaluation(chess.Board()) == 0
+    finally:
+        pool.close()
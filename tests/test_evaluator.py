@@ -0,0 +1,65 @@
+import threading
+import time
+import chess
+import pytest
+from board import evaluate_board
+from evaluator import BatchEvaluator
+from model import CheckMatrixModel
+
+
+
+@pytest.fixture
+def model():
+    return CheckMatrixModel(num_layers=1, d_model=16, nhead=2, dim_feedforward=32).eval()
+
+
+def test_evaluate_many(model: CheckMatrixModel):
+    board = chess.Board()
+    boards = []
+    for move in board.legal_moves:
+        boards.append(board.copy())
+        boards[-1].push(move)
+
+    evaluator = BatchEvaluator(model, "cpu", max_batch_size=8, flush_timeout=0.5)
+    try:
+        values = evaluator.evaluate_many(boards)
+    finally:
+        evaluator.close()
+
+    assert values == pytest.approx([evaluate_board(board, model, "cpu") for board in boards], abs=1e-5)
+    assert evaluator.positions == len(boards)
+    assert evaluator.batches == 3  # 20 positions in batches of 8
+
+
+def test_flush_without_other_submitters(model: CheckMatrixModel):
+    evaluator = BatchEvaluator(model, "cpu", flush_timeout=10)
+    try:
+        start_time = time.monotonic()
+        evaluator.evaluate(chess.Board())
+        evaluator.evaluate_many([chess.Board()] * 3)
+        assert time.monotonic() - start_time < 5  # The only caller waits, nothing more can come
+    finally:
+        evaluator.close()
+    assert evaluator.batches == 2
+
+
+def test_registered_submitters(model: CheckMatrixModel):
+    evaluator = BatchEvaluator(model, "cpu", flush_timeout=10)
+    barrier = threading.Barrier(2)
+
+    def submit():
+        with evaluator.submitter():
+            barrier.wait()
+            evaluator.evaluate(chess.Board())
+
+    threads = [threading.Thread(target=submit) for _ in range(2)]
+    try:
+        start_time = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert time.monotonic() - start_time < 5
+    finally:
+        evaluator.close()
+    assert evaluator.batches == 1  # The first board waited for the other submitter's
@@ -0,0 +1,91 @@
+import copy
+import pickle
+import chess
+import pytest
+import torch
+from board import encode_boards
+from config import CompileMode, Precision
+from inference import InferenceEngine, fixed_positions, validate_precision
+from model import CheckMatrixModel
+
+
+
+@pytest.fixture
+def model():
+    torch.manual_seed(0)
+    return CheckMatrixModel(num_layers=1, d_model=16, nhead=2, dim_feedforward=32, dropout=0.5)  # Left in train mode
+
+
+@pytest.fixture
+def states():
+    board = chess.Board()
+    boards = []
+    for move in board.legal_moves:
+        boards.append(board.copy())
+        boards[-1].push(move)
+    return encode_boards(boards)
+
+
+def expected(model: CheckMatrixModel, states: torch.Tensor) -> torch.Tensor:
+    with torch.no_grad():
+        return copy.deepcopy(model).eval()(states)
+
+
+@pytest.mark.parametrize("compile_mode", [CompileMode.NONE, CompileMode.TRACE])
+def test_evaluate(model: CheckMatrixModel, states: torch.Tensor, compile_mode: CompileMode):
+    engine = InferenceEngine(model, "cpu", compile_mode)
+    values = engine.evaluate(states)
+
+    assert not values.requires_grad
+    assert torch.allclose(values, expected(model, states), atol=1e-6)
+    assert torch.equal(engine.evaluate(states), values)  # No dropout
+    assert model.training  # The source is untouched
+
+
+@pytest.mark.parametrize("compile_mode", [CompileMode.NONE, CompileMode.TRACE])
+def test_refresh(model: CheckMatrixModel, states: torch.Tensor, compile_mode: CompileMode):
+    engine = InferenceEngine(model, "cpu", compile_mode)
+    before = engine.evaluate(states)
+
+    with torch.no_grad():
+        model.decoder.bias.add_(0.5)
+    assert torch.equal(engine.evaluate(states), before)  # Frozen until refreshed
+
+    engine.refresh()
+    assert engine.version == 1
+    assert torch.allclose(engine.evaluate(states), expected(model, states), atol=1e-6)
+
+
+def test_pickle(model: CheckMatrixModel, states: torch.Tensor):
+    engine = InferenceEngine(model, "cpu", CompileMode.TRACE)
+    copied = pickle.loads(pickle.dumps(engine))
+    assert torch.equal(copied.evaluate(states), engine.evaluate(states))
+
+
+@pytest.mark.parametrize("precision, tolerance", [(Precision.BFLOAT16, 0.05), (Precision.INT8, 0.1)])
+def test_precision(model: CheckMatrixModel, states: torch.Tensor, precision: Precision, tolerance: float):
+    engine = InferenceEngine(model, "cpu", precision=precision)
+    values = engine.evaluate(states)
+    assert values.dtype == torch.float32
+    assert torch.allclose(values, expected(model, states), atol=tolerance)
+    assert torch.backends.mha.get_fastpath_enabled()  # Only off during int8 passes
+
+    with torch.no_grad():
+        model.decoder.bias.add_(0.5)
+    engine.refresh()
+    assert torch.allclose(engine.evaluate(states), expected(model, states), atol=tolerance)
+
+
+def test_int8_trace(model: CheckMatrixModel, states: torch.Tensor):
+    # The quantized Linears fail on the transformer fast path, it must be off while tracing
+    engine = InferenceEngine(model, "cpu", CompileMode.TRACE, precision=Precision.INT8)
+    assert torch.allclose(engine.evaluate(states), expected(model, states), atol=0.1)
+
+
+def test_validate_precision(model: CheckMatrixModel):
+    assert [board.fen() for board in fixed_positions(50)] == [board.fen() for board in fixed_positions(50)]
+
+    report = validate_precision(model, "cpu", Precision.INT8, positions=32)
+    assert report["positions"] == 32
+    assert report["max_error"] < 0.1
+    assert report["speedup"] > 0
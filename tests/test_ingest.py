@@ -0,0 +1,153 @@
+import io
+import json
+import random
+import chess
+import chess.pgn
+import numpy as np
+import pytest
+from config import Label
+from ingest import Ingestion, chunk_ranges, ingest_epd, ingest_pgn
+from position_store import RESULT_UNKNOWN, PositionStore, unpack_boards
+from reward import calculate_reward
+
+
+
+def write_pgn(path, games: int, seed: int = 0) -> list[chess.Board]:
+    """
+    Writes random games, returns the positions after every move
+    """
+    rng = random.Random(seed)
+    positions = []
+    with open(path, "w") as f:
+        for i in range(games):
+            board = chess.Board()
+            for _ in range(rng.randint(1, 40)):
+                if board.is_game_over():
+                    break
+                board.push(rng.choice(list(board.legal_moves)))
+                positions.append(board.copy(stack=False))
+            game = chess.pgn.Game.from_board(board)
+            game.headers["Event"] = f"Game {i}"
+            game.headers["Result"] = rng.choice(["1-0", "0-1", "1/2-1/2", "*"])
+            print(game, file=f, end="\n\n")
+    return positions
+
+
+def test_chunk_ranges(tmp_path):
+    path = tmp_path / "games.pgn"
+    write_pgn(path, 50)
+
+    ranges = list(chunk_ranges(str(path), 500))
+    assert len(ranges) > 5
+    assert ranges[0][0] == 0 and ranges[-1][1] == path.stat().st_size
+    assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+
+    text = path.read_bytes()
+    assert all(text[start:end].startswith(b"[Event ") for start, end in ranges)  # Every range starts with a game
+    assert sum(ingest_pgn(io.StringIO(text[start:end].decode()), Label.REWARD)[1] for start, end in ranges) == 50
+
+
+def test_chunk_ranges_comments(tmp_path):
+    path = tmp_path / "games.pgn"
+    with open(path, "w") as f:
+        for i in range(30):
+            # Clock comments wrapped so that movetext lines start with "["
+            f.write(f'[Event "Game {i}"]\n[Result "*"]\n\n1. e4 {{\n[%clk 0:03:00] }} e5 2. Nf3 {{\n[%clk 0:02:59] }}\nNc6 *\n\n')
+
+    text = path.read_bytes()
+    for chunk_size in range(10, 120, 7):
+        ranges = list(chunk_ranges(str(path), chunk_size))
+        assert all(text[start:end].startswith(b"[Event ") for start, end in ranges)
+        records, games = zip(*[ingest_pgn(io.StringIO(text[start:end].decode()), Label.REWARD) for start, end in ranges])
+        assert sum(games) == 30
+        assert sum(len(r) for r in records) == 30 * 4
+
+
+def test_ingest_pgn(tmp_path):
+    path = tmp_path / "games.pgn"
+    positions = write_pgn(path, 3)
+
+    records, games = ingest_pgn(io.StringIO(path.read_text()), Label.REWARD)
+    assert games == 3
+    assert [board.board_fen() for board in unpack_boards(records)] == [board.board_fen() for board in positions]
+    assert np.allclose(records["reward"], [calculate_reward(board) for board in positions])
+
+    records, _ = ingest_pgn(io.StringIO(path.read_text()), Label.RESULT)
+    assert np.all(records["reward"] == records["result"])
+    assert RESULT_UNKNOWN not in records["result"]
+
+
+def test_ingest_epd():
+    text = io.StringIO(
+        "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 c9 \"1-0\";\n"
+        "\n"
+        "not a position\n"
+        "8/8/8/4k3/8/8/4K3/8 w - -\n"
+    )
+    records, count = ingest_epd(text, Label.REWARD)
+    assert count == 2
+    assert records["result"].tolist() == [1, RESULT_UNKNOWN]
+    assert records["turn"].tolist() == [chess.BLACK, chess.WHITE]
+
+
+def test_resume(tmp_path):
+    path = tmp_path / "games.pgn"
+    positions = write_pgn(path, 40)
+    output = str(tmp_path / "positions.bin")
+
+    ingestion = Ingestion(str(path), output, workers=2, chunk_size=1000)
+    assert ingestion.run() == len(positions)
+    assert len(ingestion.store) == len(positions)
+
+    # A run stopped halfway, while appending the range after the saved state
+    state_path = output + ".ingest.json"
+    with open(state_path) as f:
+        states = json.load(f)
+    ranges = list(chunk_ranges(str(path), 1000))
+    middle = ranges[len(ranges) // 2][0]
+    records = ingest_pgn(io.StringIO(path.read_bytes()[:middle].decode()), Label.REWARD)[0]
+    states["inputs"][str(path)].update(offset=middle, records=len(records), pending=[len(records), len(positions)], positions=len(records), games=0)
+    with open(state_path, "w") as f:
+        json.dump(states, f)
+
+    ingestion = Ingestion(str(path), output, workers=1, chunk_size=1000)
+    assert ingestion.run() == len(positions) - len(records)
+    assert len(ingestion.store) == len(positions)  # Nothing twice
+    assert [board.board_fen() for board in unpack_boards(ingestion.store.records)] == [board.board_fen() for board in positions]
+
+    assert Ingestion(str(path), output, workers=1).run() == 0  # Already done
+
+
+def test_other_writers(tmp_path):
+    path = tmp_path / "games.pgn"
+    positions = write_pgn(path, 20)
+    output = str(tmp_path / "positions.bin")
+    assert Ingestion(str(path), output, workers=1, chunk_size=1000).run() == len(positions)
+
+    # Self-play appends to the same store
+    PositionStore(output).append_game(positions[:50], [0.0] * 50, "*")
+    assert Ingestion(str(path), output, workers=1, chunk_size=1000).run() == 0
+    assert len(PositionStore(output)) == len(positions) + 50
+
+    # An unfinished ingestion doesn't resume past positions it didn't write
+    state_path = output + ".ingest.json"
+    with open(state_path) as f:
+        states = json.load(f)
+    states["inputs"][str(path)].update(offset=0, records=0, pending=None)
+    with open(state_path, "w") as f:
+        json.dump(states, f)
+    with pytest.raises(ValueError):
+        Ingestion(str(path), output, workers=1, chunk_size=1000).run()
+    assert len(PositionStore(output)) == len(positions) + 50
+
+
+def test_several_inputs(tmp_path):
+    first, second = tmp_path / "first.pgn", tmp_path / "second.pgn"
+    first_positions, second_positions = write_pgn(first, 10, seed=1), write_pgn(second, 10, seed=2)
+    output = str(tmp_path / "positions.bin")
+
+    assert Ingestion(str(first), output, workers=1).run() == len(first_positions)
+    assert Ingestion(str(second), output, workers=1).run() == len(second_positions)
+    assert Ingestion(str(first), output, workers=1).run() == 0  # Its progress is kept
+    assert len(PositionStore(output)) == len(first_positions) + len(second_positions)
+
@@ -0,0 +1,118 @@
+import threading
+import time
+import chess
+import numpy as np
+import pytest
+from pydantic import ValidationError
+from config import MCTS, CutoffEvaluation, Limits, SearchMode, TimeControl, load_config
+from evaluator import BatchEvaluator, shutdown_evaluator
+from game import select_move
+from mcts.limits import Clock, SearchLimits, allocate_time
+from mcts.node import MCTSNode
+from mcts.pool import shutdown_pool
+from mcts.shared_tree import shared_tree_search
+from mcts.tree import Tree
+from model import CheckMatrixModel
+
+
+
+@pytest.fixture
+def model(monkeypatch):
+    config = load_config().model.mcts
+    monkeypatch.setattr(config.rollout, "max_depth", 4)
+    monkeypatch.setattr(config.rollout, "cutoff", CutoffEvaluation.REWARD)
+    return CheckMatrixModel(num_layers=1, d_model=16, nhead=2, dim_feedforward=32).eval()
+
+
+def search(model: CheckMatrixModel, board: chess.Board, limits: SearchLimits) -> MCTSNode:
+    evaluator = BatchEvaluator(model, "cpu")
+    try:
+        root = MCTSNode(Tree(board, evaluator))
+        root.expand()
+        shared_tree_search(root, None, 2, limits=limits)
+    finally:
+        evaluator.close()
+    return root
+
+
+def test_time_limit(model: CheckMatrixModel):
+    limits = SearchLimits(seconds=0.3, early_stop=False)
+    root = search(model, chess.Board(), limits)
+    assert limits.reason == "time"
+    assert 0.3 <= limits.elapsed < 1.5
+    assert sum(child.visits for child in root.children) == limits.nodes_searched
+
+
+def test_stop(model: CheckMatrixModel):
+    limits = SearchLimits(seconds=0, early_stop=False)  # No limit
+    threading.Timer(0.2, limits.stop).start()
+    search(model, chess.Board(), limits)
+    assert limits.reason == "stopped"
+    assert limits.nodes_searched > 0
+
+
+def test_early_stop(model: CheckMatrixModel):
+    limits = SearchLimits(nodes=16, seconds=0)
+    limits.nodes_searched = 10
+    assert limits.decided(np.array([8, 1, 1]))  # Leads by 7 with 6 iterations left
+    assert not limits.decided(np.array([6, 3, 1]))
+    assert limits.decided(np.array([10]))
+
+    board = chess.Board("7k/8/8/8/8/8/6q1/7K w - - 0 1")  # Kxg2 is the only move
+    limits = SearchLimits(nodes=500, seconds=0, early_stop=True)
+    search(model, board, limits)
+    assert limits.reason == "decided"
+    assert limits.nodes_searched < 100
+
+
+def test_check_every_iteration(model: CheckMatrixModel, monkeypatch):
+    monkeypatch.setattr(load_config().model.mcts.limits, "check_interval", 0)
+    board = chess.Board("7k/8/8/8/8/8/6q1/7K w - - 0 1")
+    limits = SearchLimits(nodes=500, seconds=0, early_stop=True)
+    assert limits.check_interval == 1
+    search(model, board, limits)
+    assert limits.reason == "decided"
+
+
+def test_root_mode_time_limit(model: CheckMatrixModel):
+    try:
+        select_move(model, chess.Board(), "cpu", 8, 2, search_mode=SearchMode.ROOT)  # Starts the pool
+        limits = SearchLimits(seconds=0.5, early_stop=False)
+        move = select_move(model, chess.Board(), "cpu", None, 2, search_mode=SearchMode.ROOT, limits=limits)
+    finally:
+        shutdown_pool()
+        shutdown_evaluator()
+    assert move in chess.Board().legal_moves
+    assert limits.reason == "time"
+    assert limits.elapsed < 2.5
+    assert limits.nodes_searched > 0
+
+
+def test_unlimited_config():
+    with pytest.raises(ValidationError):
+        MCTS(iterations=0, workers=1)
+    MCTS(iterations=0, workers=1, limits=Limits(move_time=0.5))
+    MCTS(iterations=0, workers=1, time_control=TimeControl(time=60))
+
+
+def test_allocate_time():
+    config = load_config().model.mcts.time_control
+    assert allocate_time(60) == pytest.approx(60 / config.expected_moves - config.overhead)
+    assert allocate_time(60, 2, moves_to_go=10) == pytest.approx(6 + 2 * config.increment_share - config.overhead)
+    assert allocate_time(10, 30) == pytest.approx(10 * config.max_share - config.overhead)  # Capped
+    assert allocate_time(0.01) > 0
+
+
+def test_clock():
+    clock = Clock(60, increment=1, moves_to_go=2)
+    assert clock.allocate(chess.WHITE) == allocate_time(60, 1, 2)
+
+    clock.punch(chess.WHITE, 10)
+    assert clock.remaining[chess.WHITE] == 51
+    assert clock.allocate(chess.WHITE) == allocate_time(51, 1, 1)
+    clock.punch(chess.WHITE, 10)
+    assert clock.remaining[chess.WHITE] == 102  # The next period's time added
+
+    clock.punch(chess.BLACK, 61)
+    assert clock.flagged(chess.BLACK)
+    assert not clock.flagged(chess.WHITE)
@@ -0,0 +1,132 @@
+import chess
+import pytest
+from config import MemoryPolicy, RolloutPolicy
+from evaluator import BatchEvaluator
+from model import CheckMatrixModel
+from mcts.node import MCTSNode
+from mcts.pool import build_root, describe_root
+from mcts.rollout import Rollout
+from mcts.search_tree import SearchTree
+from mcts.shared_tree import shared_tree_search
+from mcts.simulation import run_simulation
+from mcts.tree import Tree, pack_move, unpack_move
+
+
+
+@pytest.fixture
+def evaluator():
+    evaluator = BatchEvaluator(CheckMatrixModel(num_layers=1, d_model=16, nhead=2, dim_feedforward=32).eval(), "cpu")
+    yield evaluator
+    evaluator.close()
+
+
+def test_root_description(evaluator: BatchEvaluator):
+    board = chess.Board()
+    board.push_san("e4")
+    board.push_san("e5")
+    root = MCTSNode(Tree(board, evaluator))
+    root.expand()
+
+    copy = build_root(describe_root(root), evaluator)
+
+    assert copy.board == root.board and copy.board.move_stack == root.board.move_stack
+    assert copy.board_value == root.board_value
+    assert copy.untried_moves == []
+    assert [(child.move, child.board_value) for child in copy.children] == [
+        (child.move, child.board_value) for child in root.children
+    ]
+    assert evaluator.positions == 1 + len(root.children)  # Nothing was evaluated again
+
+
+def test_shared_tree_search(evaluator: BatchEvaluator):
+    root = MCTSNode(Tree(chess.Board(), evaluator))
+    root.expand()
+
+    shared_tree_search(root, iterations=24, num_workers=4, virtual_loss=1.0)
+
+    assert root.visits == 24
+    assert sum(child.visits for child in root.children) == 24
+
+    nodes = [root]
+    while nodes:
+        node = nodes.pop()
+        assert node.virtual_loss == 0
+        assert node.visits >= sum(child.visits for child in node.children)
+        nodes.extend(node.children)
+
+
+def test_search_tree_reuse(evaluator: BatchEvaluator):
+    board = chess.Board()
+    tree = SearchTree()
+    root = tree.get_root(board, evaluator)
+    root.expand()
+    shared_tree_search(root, iterations=40, num_workers=2)
+
+    child = max(root.children, key=lambda child: child.visits)
+    grandchild = max(child.children, key=lambda grandchild: grandchild.visits)
+    board.push(child.move)
+    board.push(grandchild.move)
+    grandchildren = [(node.move, node.visits) for node in grandchild.children]
+
+    new_root = tree.get_root(board, evaluator)
+    assert new_root.parent is None
+    assert new_root.board == board and new_root.visits == grandchild.visits
+    assert [(node.move, node.visits) for node in new_root.children] == grandchildren
+    assert tree.reused_visits == [0, grandchild.visits]
+
+    assert tree.get_root(chess.Board(), evaluator).visits == 0  # The start position is not part of the tree anymore
+
+
+def test_pack_move():
+    for uci in ["e2e4", "a7a8q", "h2h1n", "e1g1"]:
+        assert unpack_move(pack_move(chess.Move.from_uci(uci))) == chess.Move.from_uci(uci)
+
+
+def test_lazy_children(evaluator: BatchEvaluator):
+    root = MCTSNode(Tree(chess.Board(), evaluator))
+    assert evaluator.positions == 1
+
+    assert len(root.untried_moves) == 20
+    assert root.children == [] and evaluator.positions == 1  # Generated, not evaluated
+
+    child = root.add_child(chess.Move.from_uci("e2e4"))
+    assert root.children == [child] and evaluator.positions == 2
+    assert child.board.move_stack == [chess.Move.from_uci("e2e4")]
+    assert len(root.untried_moves) == 19
+
+
+@pytest.mark.parametrize("policy", [MemoryPolicy.PRUNE, MemoryPolicy.FREEZE])
+def test_node_budget(evaluator: BatchEvaluator, policy: MemoryPolicy):
+    tree = Tree(chess.Board(), evaluator)
+    tree.max_nodes, tree.policy = 90, policy
+    root = MCTSNode(tree)
+    root.expand()
+
+    run_simulation(root, iterations=20)
+
+    assert tree.size <= 90 and tree.refused > 0
+    assert root.visits == 20 and sum(child.visits for child in root.children) == 20
+    if policy == MemoryPolicy.PRUNE:
+        assert tree.pruned > 0
+    else:
+        assert tree.pruned == 0
+
+
+def test_rollout():
+    rollout = Rollout(lambda board: 0.5)
+    rollout.config = rollout.config.model_copy(update={"max_depth": 4, "fast_terminal": True})
+
+    assert rollout(chess.Board("7k/5QQ1/8/8/8/8/8/K7 b - - 0 1")) == 1  # Black is mated
+    assert rollout(chess.Board("k7/8/8/8/8/8/8/K7 w - - 0 1")) == 0  # Insufficient material
+
+    board = chess.Board()
+    assert rollout(board) == 0.75  # Cut off and evaluated by the value function
+    assert len(board.move_stack) == 4
+    assert (rollout.rollouts, rollout.plies, rollout.cutoffs) == (3, 4, 1)
+
+
+def test_capture_policy():
+    rollout = Rollout()
+    rollout.config = rollout.config.model_copy(update={"policy": RolloutPolicy.CAPTURE})
+    board = chess.Board("4k3/8/8/3p4/4P3/8/8/4K3 w - - 0 1")
+    assert rollout.select_move(board) == chess.Move.from_uci("e4d5")
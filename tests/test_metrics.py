@@ -0,0 +1,85 @@
+import json
+import chess
+import pytest
+import metrics
+from config import CutoffEvaluation, SearchMode, load_config
+from evaluator import shutdown_evaluator
+from game import select_move
+from metrics import NULL_METRIC, NULL_REGISTRY, SIZE_BUCKETS, Registry, get_metrics, shutdown_metrics
+from mcts.pool import shutdown_pool
+from model import CheckMatrixModel
+
+
+
+@pytest.fixture
+def enabled(tmp_path, monkeypatch):
+    config = load_config()
+    monkeypatch.setattr(config.metrics, "enabled", True)
+    monkeypatch.setattr(config.metrics, "jsonl_path", str(tmp_path / "metrics.jsonl"))
+    monkeypatch.setattr(config.metrics, "prometheus_path", str(tmp_path / "metrics.prom"))
+    monkeypatch.setattr(config.model.mcts, "iterations", 8)
+    monkeypatch.setattr(config.model.mcts.rollout, "max_depth", 2)
+    monkeypatch.setattr(config.model.mcts.rollout, "cutoff", CutoffEvaluation.REWARD)
+    monkeypatch.setattr(metrics, "_registry", None)
+    yield tmp_path
+    shutdown_metrics()
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setattr(metrics, "_registry", None)
+    assert get_metrics() is NULL_REGISTRY
+    assert get_metrics().histogram("checkmatrix_test_seconds") is NULL_METRIC
+
+
+def test_write(tmp_path):
+    registry = Registry(str(tmp_path / "metrics.jsonl"), str(tmp_path / "metrics.prom"), interval=60)
+    registry.counter("checkmatrix_test_total", "Test counter").inc(3)
+    registry.gauge("checkmatrix_test_rate").set(0.5)
+    histogram = registry.histogram("checkmatrix_test_size", "Test histogram", SIZE_BUCKETS)
+    for value in [1, 3, 3, 1000]:
+        histogram.observe(value)
+    registry.write()
+    registry.write()
+
+    lines = (tmp_path / "metrics.jsonl").read_text().splitlines()
+    assert len(lines) == 2
+    snapshot = json.loads(lines[-1])["metrics"]
+    assert snapshot["checkmatrix_test_total"] == 3
+    assert snapshot["checkmatrix_test_size"]["buckets"] == {"1": 1, "2": 0, "4": 2, "8": 0, "16": 0, "32": 0, "64": 0, "128": 0, "256": 0, "512": 0, "inf": 1}
+
+    text = (tmp_path / "metrics.prom").read_text()
+    assert "# TYPE checkmatrix_test_total counter\ncheckmatrix_test_total 3\n" in text
+    assert 'checkmatrix_test_size_bucket{le="4"} 3\n' in text
+    assert 'checkmatrix_test_size_bucket{le="+Inf"} 4\n' in text
+    assert "checkmatrix_test_size_count 4\n" in text
+
+
+def test_merge(tmp_path):
+    worker, main = Registry("", ""), Registry("", "")
+    worker.counter("checkmatrix_test_total").inc(2)
+    worker.histogram("checkmatrix_test_seconds").observe(0.002)
+    main.counter("checkmatrix_test_total").inc(1)
+
+    main.merge(worker.drain())
+    main.merge(worker.drain())  # Drained, adds nothing
+    assert main.counter("checkmatrix_test_total").value == 3
+    assert main.histogram("checkmatrix_test_seconds").count == 1
+
+
+@pytest.mark.parametrize("search_mode", [SearchMode.TREE, SearchMode.ROOT])
+def test_search_metrics(enabled, search_mode: SearchMode):
+    model = CheckMatrixModel(num_layers=1, d_model=16, nhead=2, dim_feedforward=32).eval()
+    try:
+        select_move(model, chess.Board(), "cpu", 8, 2, search_mode=search_mode)
+    finally:
+        shutdown_pool()
+        shutdown_evaluator()
+
+    registry = get_metrics()
+    assert registry.counter("checkmatrix_search_nodes_total").value == 8
+    assert registry.gauge("checkmatrix_search_nodes_per_second").value > 0
+    assert registry.histogram("checkmatrix_evaluation_batch_size").count > 0
+    assert registry.histogram("checkmatrix_rollout_depth").count > 0  # Played in the workers with the root mode
+
+    shutdown_metrics()
+    assert "checkmatrix_search_nodes_total 8" in (enabled / "metrics.prom").read_text()
@@ -0,0 +1,39 @@
+import pytest
+import torch
+from config import CutoffEvaluation, load_config
+from evaluator import get_evaluator, shutdown_evaluator
+from model import CheckMatrixModel
+from multi_game import play_games
+from position_store import PositionStore
+from replay_buffer import ReplayBuffer
+
+
+
+@pytest.fixture
+def model(monkeypatch):
+    config = load_config().model
+    monkeypatch.setattr(config.mcts.rollout, "max_depth", 2)
+    monkeypatch.setattr(config.mcts.rollout, "cutoff", CutoffEvaluation.REWARD)
+    monkeypatch.setattr(config.training, "min_samples", 8)
+    monkeypatch.setattr(config.training, "train_every", 8)
+    monkeypatch.setattr(config.training, "batch_size", 8)
+    monkeypatch.setattr(config.training, "batches", 1)
+
+    yield CheckMatrixModel(num_layers=1, d_model=16, nhead=2, dim_feedforward=32)
+    shutdown_evaluator()
+
+
+def test_play_games(model: CheckMatrixModel, tmp_path):
+    replay_buffer = ReplayBuffer(capacity=4096)
+    position_store = PositionStore(str(tmp_path / "positions.bin"))
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
+    device = torch.device("cpu")
+
+    results = play_games(model, optimizer, torch.nn.SmoothL1Loss(), device, 2, 2, replay_buffer=replay_buffer, position_store=position_store, concurrent_games=2, games=2)
+
+    assert len(results) == 2
+    assert all(result in ["1-0", "0-1", "1/2-1/2"] for result in results)
+    assert len(replay_buffer) > 0
+    assert len(position_store) == replay_buffer.added
+    evaluator = get_evaluator(model, device)
+    assert evaluator.positions > evaluator.batches  # Evaluations of several games shared batches
@@ -0,0 +1,80 @@
+import random
+import chess
+import numpy as np
+import pytest
+import torch
+from board import encode_boards
+from position_store import RECORD, RESULT_UNKNOWN, PositionDataset, PositionStore, encode_records, pack_positions, unpack_boards
+
+
+
+def random_boards(count: int, seed: int = 0) -> list[chess.Board]:
+    rng = random.Random(seed)
+    boards = []
+    board = chess.Board()
+    while len(boards) < count:
+        if board.is_game_over():
+            board = chess.Board()
+        board.push(rng.choice(list(board.legal_moves)))
+        boards.append(board.copy(stack=False))
+    return boards
+
+
+def test_round_trip():
+    boards = random_boards(500) + [chess.Board("r3k2r/8/8/3pP3/8/8/8/R3K2R w Kq d6 0 1")]
+    records = pack_positions(boards, list(range(len(boards))), "0-1")
+
+    assert RECORD.itemsize == 64
+    assert all(unpacked.board_fen() == board.board_fen() for unpacked, board in zip(unpack_boards(records), boards))
+    assert [unpacked.fen(en_passant="fen") for unpacked in unpack_boards(records)][-1] == "r3k2r/8/8/3pP3/8/8/8/R3K2R w Kq d6 0 1"
+    assert torch.equal(encode_records(records), encode_boards(boards))
+    assert records["result"].tolist() == [-1] * len(boards)
+
+
+def test_append(tmp_path):
+    path = str(tmp_path / "positions.bin")
+    store = PositionStore(path)
+    store.append_game(random_boards(10), [0.5] * 10, "1-0")
+    store.append_game(random_boards(5, seed=1), [0.25] * 5, "*")
+    assert len(store) == 15
+    assert store.records["reward"].tolist() == [0.5] * 10 + [0.25] * 5
+    assert store.records["result"].tolist() == [1] * 10 + [RESULT_UNKNOWN] * 5
+
+    with open(path, "ab") as f:
+        f.write(bytes(RECORD.itemsize // 2))  # A write cut short
+    store = PositionStore(path)
+    assert len(store) == 15
+    store.append_game(random_boards(1), [1.0], "1/2-1/2")
+    assert len(store) == 16 and store.records["result"][-1] == 0
+
+
+def test_wrong_file(tmp_path):
+    path = tmp_path / "positions.bin"
+    path.write_bytes(b"not a position store")
+    with pytest.raises(ValueError):
+        PositionStore(str(path))
+
+
+def test_dataset(tmp_path):
+    path = str(tmp_path / "positions.bin")
+    store = PositionStore(path)
+    store.append_game(random_boards(100), np.arange(100) / 100, "1-0")
+    store.append_game(random_boards(50, seed=1), np.zeros(50), "*")
+
+    batches = list(PositionDataset(path, batch_size=32, chunk_size=64, seed=0))
+    assert sum(len(states) for states, _ in batches) == 150
+    assert all(states.shape[1:] == (8, 8, 8) and targets.shape == (len(states), 1) for states, targets in batches)
+    rewards = torch.cat([targets for _, targets in batches]).flatten()
+    assert sorted(rewards.tolist()) == sorted(store.records["reward"].tolist())
+
+    results = torch.cat([targets for _, targets in PositionDataset(path, target="result", shuffle=False)])
+    assert results.flatten().tolist() == [1.0] * 100  # Unfinished games are skipped
+
+
+def test_dataset_workers(tmp_path):
+    path = str(tmp_path / "positions.bin")
+    PositionStore(path).append_game(random_boards(200), np.arange(200, dtype=np.float32), "1-0")
+
+    loader = torch.utils.data.DataLoader(PositionDataset(path, batch_size=16, chunk_size=32), batch_size=None, num_workers=2)
+    rewards = torch.cat([targets for _, targets in loader]).flatten()
+    assert sorted(rewards.tolist()) == list(range(200))  # Every position once
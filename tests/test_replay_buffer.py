@@ -0,0 +1,78 @@
+import pytest
+import torch
+from config import Eviction, Precision, Sampling, load_config
+from model import CheckMatrixModel, train_model
+from replay_buffer import ReplayBuffer
+
+
+
+def test_fifo_eviction():
+    buffer = ReplayBuffer(capacity=4, eviction=Eviction.FIFO)
+    for i in range(6):
+        buffer.add(torch.full((1, 8, 8, 8), float(i)), i)
+
+    assert len(buffer) == 4
+    assert sorted(buffer.targets.tolist()) == [2, 3, 4, 5]
+    assert all(torch.all(buffer.states[slot] == buffer.targets[slot]) for slot in range(4))
+
+
+def test_prioritized_eviction():
+    buffer = ReplayBuffer(capacity=4, eviction=Eviction.PRIORITIZED)
+    for i in range(4):
+        buffer.add(torch.zeros(8, 8, 8), i)
+    buffer.update_priorities(torch.arange(4), torch.tensor([0.5, 0.1, 0.9, 0.3]))
+
+    buffer.add(torch.zeros(8, 8, 8), 4)
+    assert buffer.targets.tolist() == [0, 4, 2, 3]
+    assert buffer.priorities[1] == buffer.max_priority  # New samples are trained on before they are evicted
+
+
+def test_prioritized_eviction_order():
+    generator = torch.Generator().manual_seed(0)
+    buffer = ReplayBuffer(capacity=16, eviction=Eviction.PRIORITIZED)
+    for i in range(200):
+        if len(buffer) == buffer.capacity:
+            lowest = int(torch.argmin(buffer.priorities))
+            buffer.add(torch.zeros(8, 8, 8), i)
+            assert buffer.targets[lowest] == i
+        else:
+            buffer.add(torch.zeros(8, 8, 8), i)
+        indices = torch.randint(len(buffer), (4,), generator=generator)
+        buffer.update_priorities(indices, torch.rand(4, generator=generator))
+    assert len(buffer._heap) <= 2 * buffer.capacity
+
+
+def test_sampling():
+    buffer = ReplayBuffer(capacity=1000, sampling=Sampling.UNIFORM)
+    for i in range(100):
+        buffer.add(torch.zeros(8, 8, 8), i)
+    indices = buffer.sample(64)
+    assert len(indices) == len(set(indices.tolist())) == 64
+    assert len(buffer.sample(500)) == 100
+
+    buffer.sampling = Sampling.RECENCY
+    buffer.recency_half_life = 10
+    counts = torch.zeros(100)
+    for _ in range(50):
+        counts[buffer.sample(10)] += 1
+    assert counts[90:].sum() > 5 * counts[:50].sum()
+
+
+@pytest.mark.parametrize("precision", [Precision.FLOAT32, Precision.BFLOAT16])
+def test_train_model(monkeypatch, precision: Precision):
+    monkeypatch.setattr(load_config().model.training, "precision", precision)
+    torch.manual_seed(0)
+    model = CheckMatrixModel(num_layers=1, d_model=16, nhead=2, dim_feedforward=32, dropout=0)
+    optimizer = torch.optim.Adam(model.parameters(), lr=0.01)
+    buffer = ReplayBuffer(capacity=256, eviction=Eviction.PRIORITIZED)
+    states = torch.randn(64, 8, 8, 8)
+    buffer.add_many(states, (states.mean(dim=(1, 2, 3)) * 10).tanh().tolist())
+
+    def loss():
+        with torch.no_grad():
+            return torch.nn.functional.smooth_l1_loss(model(buffer.states[:64]), buffer.targets[:64].unsqueeze(1)).item()
+
+    before = loss()
+    train_model(model, buffer, optimizer, torch.nn.SmoothL1Loss(), torch.device("cpu"), batches=100)
+    assert loss() < before / 2
+    assert not torch.all(buffer.priorities[:64] == 1.0)  # Priorities are the training losses
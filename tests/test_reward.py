@@ -0,0 +1,97 @@
+import chess
+import random
+import pytest
+from constants import PIECE_VALUES
+from reward import calculate_reward, calculate_rewards
+
+
+
+def reference_reward(board: chess.Board):
+    # The original per-square reward, the bitboard version has to reproduce it
+    material = sum(PIECE_VALUES[piece.symbol().upper()] for piece in board.piece_map().values())
+
+    control = 0
+    for square in chess.SQUARES:
+        if board.is_attacked_by(chess.WHITE, square):
+            control += 1 if square in [chess.E4, chess.D4, chess.E5, chess.D5] else 0.5
+        if board.is_attacked_by(chess.BLACK, square):
+            control -= 1 if square in [chess.E4, chess.D4, chess.E5, chess.D5] else 0.5
+
+    activity = 0
+    values = {chess.PAWN: 0.1, chess.KNIGHT: 0.3, chess.BISHOP: 0.3, chess.ROOK: 0.5, chess.QUEEN: 0.9, chess.KING: 0}
+    for square, piece in board.piece_map().items():
+        activity += values[piece.piece_type] * sum(1 for move in board.legal_moves if move.from_square == square)
+
+    def king_safety(color):
+        king_square = board.king(color)
+        score = 0
+        for i in range(-1, 2):
+            for j in range(-1, 2):
+                square = king_square + i + 8 * j
+                if (i != 0 or j != 0) and square in range(64) and board.color_at(square) == color:
+                    score += 10
+        for direction in [8, -8, -1, 1]:
+            square = king_square + direction
+            while square in range(64):
+                if board.piece_at(square):
+                    if board.color_at(square) != color:
+                        score -= 5
+                    break
+                square += direction
+        return score
+
+    def pawn_structure(color):
+        score = 0
+        for square in board.pieces(chess.PAWN, color):
+            file_index, rank_index = chess.square_file(square), chess.square_rank(square)
+            pawns = board.pieces(chess.PAWN, color).tolist()
+            if pawns.count(file_index) > 1:
+                score -= 5
+            if not any(pawns.count(adjacent) > 0 for adjacent in [file_index - 1, file_index + 1] if 0 <= adjacent <= 7):
+                score -= 10
+            if not any(board.piece_at(chess.square(file_index, rank)) == chess.Piece(chess.PAWN, not color) for rank in range(rank_index + 1, 8)):
+                score += 20
+        return score
+
+    if board.is_checkmate():
+        return 1.0
+    if board.is_stalemate() or board.is_insufficient_material() or board.can_claim_draw():
+        return 0.0
+    safety = king_safety(chess.WHITE) - king_safety(chess.BLACK)
+    pawns = pawn_structure(chess.WHITE) - pawn_structure(chess.BLACK)
+    return (material + control + activity + safety + pawns) / 39.0
+
+
+@pytest.fixture
+def boards():
+    rng = random.Random(1)
+    boards = [
+        chess.Board(),
+        chess.Board("7k/5Q2/6K1/8/8/8/8/8 b - - 0 1"),  # Stalemate
+        chess.Board("R5k1/5ppp/8/8/8/8/8/6K1 b - - 0 1"),  # Checkmate
+        chess.Board("8/PP5k/8/8/8/8/6Kp/8 w - - 0 1"),
+    ]
+    for _ in range(10):
+        board = chess.Board()
+        for _ in range(rng.randint(1, 150)):
+            if board.is_game_over():
+                break
+            board.push(rng.choice(list(board.legal_moves)))
+            boards.append(board.copy())
+
+    board = chess.Board()
+    for move in ["g1f3", "g8f6", "f3g1", "f6g8"] * 2:
+        board.push_uci(move)
+        boards.append(board.copy())  # Repetitions
+    return boards
+
+
+def test_calculate_reward(boards: list[chess.Board]):
+    for board in boards:
+        assert calculate_reward(board) == pytest.approx(reference_reward(board), abs=1e-9), board.fen()
+
+
+def test_calculate_rewards(boards: list[chess.Board]):
+    rewards = calculate_rewards(boards)
+    assert rewards.shape == (len(boards),)
+    assert list(rewards) == [calculate_reward(board) for board in boards]
@@ -0,0 +1,57 @@
+import pickle
+import torch.multiprocessing  # Registers the reducers sharing tensors with other processes
+from multiprocessing.reduction import ForkingPickler
+import chess
+import chess.polyglot
+import pytest
+from transposition_table import TranspositionTable
+
+
+
+def test_store_lookup():
+    table = TranspositionTable(max_size=64)
+    key = chess.polyglot.zobrist_hash(chess.Board())
+
+    assert table.lookup(key) is None
+    table.store(key, 0.25)
+    assert table.lookup(key) == 0.25
+    table.store(key, -0.5)
+    assert table.lookup(key) == -0.5
+
+    assert (table.hits, table.misses, table.stores, table.collisions) == (2, 1, 2, 0)
+    assert table.hit_rate == pytest.approx(2 / 3)
+
+
+def test_visit_preferred_replacement():
+    table = TranspositionTable(max_size=2)  # A single bucket
+    table.store(1, 0.1)
+    table.store(2, 0.2)
+    table.lookup(1)  # 1 now has more visits than 2
+
+    table.store(3, 0.3)
+
+    assert table.collisions == 1
+    assert table.lookup(1) == pytest.approx(0.1)
+    assert table.lookup(2) is None
+    assert table.lookup(3) == pytest.approx(0.3)
+
+
+def test_clear():
+    table = TranspositionTable(max_size=64)
+    table.store(1, 0.5)
+    table.lookup(1)
+    table.lookup(2)
+    table.clear()
+    assert (table.hits, table.misses, table.stores, table.collisions) == (0, 0, 0, 0)
+    assert table.lookup(1) is None
+
+
+def test_shared_memory():
+    table = TranspositionTable(max_size=64).share_memory()
+    table.store(1, 0.5)
+
+    copy = pickle.loads(ForkingPickler.dumps(table))  # As it is sent to pool workers
+    copy.store(2, 0.75)
+
+    assert copy.lookup(1) == 0.5
+    assert table.lookup(2) == 0.75
@@ -0,0 +1,126 @@
+import time
+import chess
+import pytest
+from config import CutoffEvaluation, SearchMode, load_config
+from model import CheckMatrixModel
+from uci import UCIEngine, parse_go, parse_position
+
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    config = load_config().model.mcts
+    monkeypatch.setattr(config, "mode", SearchMode.TREE)
+    monkeypatch.setattr(config, "workers", 2)
+    monkeypatch.setattr(config.rollout, "max_depth", 4)
+    monkeypatch.setattr(config.rollout, "cutoff", CutoffEvaluation.REWARD)
+    model = CheckMatrixModel(num_layers=1, d_model=16, nhead=2, dim_feedforward=32).eval()
+    lines = []
+    engine = UCIEngine(model, "cpu", lines.append)
+    engine.lines = lines
+    yield engine
+    engine.close()
+
+
+def bestmove(engine: UCIEngine) -> list[str]:
+    return next(line for line in engine.lines if line.startswith("bestmove")).split()
+
+
+def test_parse():
+    board = parse_position("startpos moves e2e4 e7e5".split())
+    assert board.fen() == "rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2"
+    board = parse_position("fen 7k/8/8/8/8/8/6q1/7K w - - 0 1 moves h1g2".split())
+    assert board.fen() == "7k/8/8/8/8/8/6K1/8 b - - 0 1"
+
+    assert parse_go("wtime 1000 btime 2000 winc 10 ponder".split()) == {"wtime": 1000, "btime": 2000, "winc": 10, "ponder": True}
+
+
+def test_handshake(engine: UCIEngine):
+    engine.handle("uci")
+    engine.handle("isready")
+    assert engine.lines[-1] == "readyok"
+    assert "uciok" in engine.lines
+    assert not engine.handle("quit")
+
+
+def test_go_nodes(engine: UCIEngine):
+    engine.handle("position startpos moves e2e4")
+    engine.handle("go nodes 16")
+    engine.wait()
+
+    _, move, *ponder = bestmove(engine)
+    board = parse_position("startpos moves e2e4".split())
+    assert chess.Move.from_uci(move) in board.legal_moves
+    board.push_uci(move)
+    assert ponder[0] == "ponder" and chess.Move.from_uci(ponder[1]) in board.legal_moves
+    assert engine.lines[-2].startswith("info nodes 16 ")
+
+
+def test_go_clock(engine: UCIEngine):
+    engine.handle("position startpos")
+    start_time = time.monotonic()
+    engine.handle("go wtime 3000 btime 3000 winc 0 binc 0")
+    engine.wait()
+    assert time.monotonic() - start_time < 1.5
+    assert engine.limits.reason in ["time", "decided"]
+
+
+def test_infinite_stop(engine: UCIEngine):
+    engine.handle("position startpos")
+    engine.handle("go infinite")
+    time.sleep(0.3)
+    assert not any(line.startswith("bestmove") for line in engine.lines)
+    engine.handle("stop")
+    assert engine.limits.reason == "stopped"
+    assert bestmove(engine)
+
+
+def test_ponderhit(engine: UCIEngine):
+    engine.handle("position startpos moves e2e4 e7e5")
+    engine.handle("go ponder movetime 200")
+    time.sleep(0.3)
+    assert not any(line.startswith("bestmove") for line in engine.lines)  # Pondering goes on past the move time
+    pondered = engine.limits.nodes_searched
+
+    engine.handle("ponderhit")
+    engine.wait()
+    assert engine.limits.reason in ["time", "decided"]
+    assert engine.limits.nodes_searched > pondered  # The same search went on
+    assert 0.5 <= engine.limits.elapsed < 1.5
+    assert bestmove(engine)
+
+    info = engine.lines[-2].split()
+    assert int(info[info.index("time") + 1]) < (engine.limits.elapsed - 0.25) * 1000  # Time since the ponderhit
+
+
+def test_invalid_position(engine: UCIEngine):
+    engine.handle("position startpos moves e2e4")
+    engine.handle("position startpos moves e2e4 e2e4")  # Illegal move
+    engine.handle("position fen 8/8/8 w - - 0 1")
+    engine.handle("position")
+    assert engine.board.fen() == parse_position("startpos moves e2e4".split()).fen()
+
+    engine.handle("go nodes 16")
+    engine.wait()
+    assert chess.Move.from_uci(bestmove(engine)[1]) in engine.board.legal_moves
+
+
+def test_invalid_go(engine: UCIEngine):
+    engine.handle("position startpos")
+    engine.handle("go movetime 1.5")
+    engine.wait()
+    assert engine.limits.nodes == engine.config.iterations  # The configured limits
+    assert chess.Move.from_uci(bestmove(engine)[1]) in engine.board.legal_moves
+
+
+def test_ponder_miss(engine: UCIEngine):
+    engine.handle("position startpos moves e2e4 e7e5")
+    engine.handle("go ponder nodes 16")
+    time.sleep(0.1)
+    engine.handle("stop")
+    assert engine.limits.reason == "stopped"
+
+    engine.handle("position startpos moves e2e4 c7c5")
+    engine.handle("go nodes 16")
+    engine.wait()
+    assert chess.Move.from_uci(engine.lines[-1].split()[1]) in parse_position("startpos moves e2e4 c7c5".split()).legal_moves